@@ -57,14 +57,22 @@ else:							# windows
 	import libtcodpy as libtcod
 	os.environ['PYSDL2_DLL_PATH'] = os.getcwd() + '/lib'.replace('/', os.sep)	# set sdl2 dll path
 from configparser import ConfigParser			# saving and loading configuration settings
-from random import choice, shuffle, sample		# for the illusion of randomness
+import random						# for the illusion of randomness
 from math import floor, cos, sin, sqrt, degrees, atan2, ceil	# math and heading calculations
 import xp_loader, gzip					# loading xp image files
 import json						# for loading JSON data
 import time
+import cProfile						# debug session profiling
+from collections import OrderedDict, deque		# least-recently-used image cache, event trace buffer
+import heapq						# pathfinding
 from datetime import datetime, timedelta		# for timestamping logs, date calculations
 from textwrap import wrap				# breaking up strings
-import shelve						# saving and loading games
+import shelve						# loading games saved in the older format
+import pickle, hashlib, zlib, io			# saving and loading games
+import threading					# writing saved games in the background
+import argparse						# command line options for headless runs
+import multiprocessing					# running batches of headless campaigns
+import atexit						# writing input recordings on exit
 import sdl2.sdlmixer as mixer				# sound effects
 from calendar import monthrange				# for date calculations
 if STEAM_ON:
@@ -80,6 +88,9 @@ VERSION = '3.0.2'					# game version
 DISCLAIMER = 'This is a work of fiction and no endorsement of any historical ideologies or events depicted within is intended.'
 DATAPATH = 'data/'.replace('/', os.sep)			# path to data files
 SAVEPATH = 'saved_campaigns/'.replace('/', os.sep)	# path to saved campaign folders
+SAVE_FILE = 'savegame.sav'				# filename of saved game within campaign folder
+SAVE_SCHEMA_VERSION = 1					# layout of saved game files, see SaveWriter.Read()
+SAVE_COMPRESSION_LEVEL = 6				# zlib compression level for saved game sections
 SOUNDPATH = 'sounds/'.replace('/', os.sep)		# path to sound samples
 CAMPAIGNPATH = 'campaigns/'.replace('/', os.sep)	# path to campaign files
 
@@ -92,17 +103,66 @@ else:
 
 LIMIT_FPS = 50						# maximum screen refreshes per second
 ANIM_UPDATE_TIMER = 0.15				# number of seconds between animation frame checks
+MAX_REDRAW_INTERVAL = 1.0				# maximum seconds between screen refreshes when nothing has changed
+MAX_DIRTY_RECTS = 64					# dirty screen areas tracked before they are merged into one
 WINDOW_WIDTH, WINDOW_HEIGHT = 90, 60			# size of game window in character cells
 WINDOW_XM, WINDOW_YM = int(WINDOW_WIDTH/2), int(WINDOW_HEIGHT/2)	# center of game window
 KEYBOARDS = ['QWERTY', 'AZERTY', 'QWERTZ', 'Dvorak', 'Custom']	# list of possible keyboard layout settings
 MAX_TANK_NAME_LENGTH = 20				# maximum length of tank names
 MAX_NICKNAME_LENGTH = 10				# " for crew nicknames
+XP_CACHE_SIZE = 64					# maximum number of decoded .xp images held in memory
+CD_TILE_CACHE_SIZE = 256				# maximum number of campaign day map zone images held in memory
+SOUND_CHANNELS = 16					# number of sound effects that can play at once
+SOUND_BANK_SIZE = 32 * 1024 * 1024			# maximum bytes of decoded sound samples held in memory
+SAVE_HISTORY_SECTIONS = ['journal', 'logs']		# campaign records saved separately and only re-pickled if changed
+
+# priority of sound effects for each action; background sounds are the first to be cut off
+SOUND_PRIORITIES = {
+	'movement' : 0,
+	'move_1_shell' : 0,
+	'move_10_shell' : 0,
+	'hatch' : 0,
+	'fire' : 2,
+	'he_explosion' : 2,
+	'vehicle_explosion' : 3,
+	'plane_incoming' : 3,
+	'stuka_divebomb' : 3
+}
+
+# attributes that have been added to saved classes, keyed by class name, with functions that
+# return their default values; objects loaded from games saved before an attribute was added
+# are given its default, see SetSavedDefaults()
+SAVED_ATTRIBUTE_DEFAULTS = {
+	'Campaign' : {
+		'rng' : lambda campaign: RandomStreams()
+	},
+	'CampaignDay' : {},
+	'Personnel' : {},
+	'Weapon' : {},
+	'Unit' : {},
+	'Scenario' : {
+		'los_table' : lambda scenario: scenario.BuildSavedLoSTable()
+	}
+}
+XP_BUNDLE_FILE = 'xp_images.bundle'			# packed copy of the .xp files in the data folder
 
 DEBUG_OPTIONS  = [
 	'Regenerate CD Map Roads & Rivers', 'Attack Selected Crewman (Scenario)', 'Set Crewman Injury',
 	'Set Time to End of Day', 'End Current Scenario', 'Export Campaign Log',
-	'Regenerate Weather'
+	'Regenerate Weather', 'Toggle Timing Overlay', 'Start/Dump Session Profile'
+]
+
+# functions timed for the whole session in debug mode: owning class, or None for a general
+# function, and function name
+PROFILED_FUNCTIONS = [
+	('AI', 'DoActivation'), ('Scenario', 'CalcAttack'), ('Scenario', 'GenerateLoS'),
+	('Scenario', 'UpdateScenarioDisplay'), ('Scenario', 'AdvanceToNextPhase'),
+	('CampaignDay', 'UpdateCDMapCon'), (None, 'LoadXP'), (None, 'SaveGame')
 ]
+PROFILE_OVERLAY_HOTSPOTS = 6				# number of slowest functions shown on the timing overlay
+
+EVENT_TRACE_BUFFER_SIZE = 8192				# most game events held in memory before the oldest are dropped
+EVENT_TRACE_WRITE_INTERVAL = 0.5			# seconds between writes of buffered game events
 
 ##### Hex geometry definitions #####
 
@@ -145,6 +205,27 @@ CAMPAIGN_DAY_HEXES = [
 	(-4,8),(-3,8),(-2,8),(-1,8),(0,8)
 ]
 
+# campaign day map topology, calculated once since the map layout never changes
+# index of each zone in the list of campaign day hexes
+CD_HEX_INDEX = {(hx, hy) : i for i, (hx, hy) in enumerate(CAMPAIGN_DAY_HEXES)}
+
+# distance in zones between each pair of zones, by zone index
+CD_HEX_DISTANCE = [
+	[int((abs(hx1-hx2) + abs(hy1-hy2) + abs((hx1+hy1)-(hx2+hy2))) / 2) for (hx2, hy2) in CAMPAIGN_DAY_HEXES]
+	for (hx1, hy1) in CAMPAIGN_DAY_HEXES
+]
+
+# index of the adjacent zone in each direction for each zone, -1 if off map
+CD_HEX_NEIGHBOURS = [
+	[CD_HEX_INDEX.get((hx+hx_m, hy+hy_m), -1) for (hx_m, hy_m) in CD_DESTHEX]
+	for (hx, hy) in CAMPAIGN_DAY_HEXES
+]
+
+# zones on the edge of the map, ie. with at least one adjacent hex off map
+CD_EDGE_HEXES = [
+	(hx, hy) for (hx, hy) in CAMPAIGN_DAY_HEXES if -1 in CD_HEX_NEIGHBOURS[CD_HEX_INDEX[(hx, hy)]]
+]
+
 
 ##### Colour Definitions #####
 KEY_COLOR = libtcod.Color(255, 0, 255)			# key color for transparency
@@ -872,17 +953,35 @@ BASE_CD_RANDOM_EVENT_CHANCE = 3.0
 # base number of minutes between weather update checks
 BASE_WEATHER_UPDATE_CLOCK = 30
 
+# named random number streams, each derived from the campaign seed
+RNG_STREAMS = ['weather', 'spawning', 'combat', 'crew', 'map', 'campaign', 'cosmetic']
+
 
 
 ##########################################################################################
 #                                         Classes                                        #
 ##########################################################################################
 
+# Random Streams: a set of random number generators, one for each part of the game, all derived
+# from a single seed so that a campaign can be repeated exactly; keeping them separate means that
+# cosmetic rolls such as animations will not change the outcome of combat
+class RandomStreams:
+	def __init__(self, seed=None):
+		if seed is None:
+			seed = random.getrandbits(32)
+		self.seed = seed
+		self.streams = {}
+		for name in RNG_STREAMS:
+			self.streams[name] = random.Random(str(seed) + ':' + name)
+
+
+
 # Campaign: stores data about a campaign and calendar currently in progress
 class Campaign:
-	def __init__(self):
+	def __init__(self, rng_seed=None):
 		
 		self.filename = ''		# record filename of campaign definitions
+		self.rng = RandomStreams(rng_seed)	# random number streams for this campaign
 		
 		self.options = {
 			'permadeath' : True,
@@ -919,6 +1018,20 @@ class Campaign:
 			self.records[text] = 0
 	
 	
+	# skill definitions are not saved, since they are loaded again from the data file on load
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['skills']
+		return state
+	
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+		with open(DATAPATH + 'skill_defs.json', encoding='utf8') as data_file:
+			self.skills = json.load(data_file)
+	
+	
 	# check for the start of a new campaign week given the current date, apply any modifiers
 	def CheckForNewWeek(self):
 		week_index = self.stats['calendar_weeks'].index(self.current_week)
@@ -950,7 +1063,7 @@ class Campaign:
 		(days_min, days_max) = crewman.field_hospital
 		days = days_min
 		for i in range(days_max-days_min):
-			if GetPercentileRoll() <= FIELD_HOSPITAL_RELEASE_CHANCE:
+			if GetPercentileRoll('crew') <= FIELD_HOSPITAL_RELEASE_CHANCE:
 				break
 			days += 1
 		
@@ -1123,7 +1236,7 @@ class Campaign:
 		while not exit_menu:
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('ShowReturningCrewMenu'): continue
 			
 			# don't accept the return and transfer the crewman
 			if key.vk == libtcod.KEY_ESCAPE:
@@ -1251,8 +1364,8 @@ class Campaign:
 		
 		# keep rolling until combat calendar is full
 		while len(self.combat_calendar) < self.stats['combat_days']:
-			(day_text, combat_chance) = choice(possible_days)
-			if libtcod.random_get_int(0, 1, 100) <= combat_chance:
+			(day_text, combat_chance) = GetRNG('campaign').choice(possible_days)
+			if GetRNG('campaign').randint(1, 100) <= combat_chance:
 				self.combat_calendar.append(day_text)
 				possible_days.remove((day_text, combat_chance))
 
@@ -1472,7 +1585,7 @@ class Campaign:
 		while not exit_menu:
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('CampaignSelectionMenu'): continue
 			
 			# exit without starting a new campaign if escape is pressed
 			if key.vk == libtcod.KEY_ESCAPE:
@@ -1519,7 +1632,7 @@ class Campaign:
 			# select a random campaign (not keymapped)
 			elif chr(key.c).lower() == 'r':
 				old_campaign = selected_campaign
-				selected_campaign = choice(campaign_list)
+				selected_campaign = GetRNG('campaign').choice(campaign_list)
 				
 				# check to see whether there's already a saved game for this campaign
 				if os.path.isdir(SAVEPATH + selected_campaign['filename'].rsplit('.', 1)[0]):
@@ -1533,9 +1646,16 @@ class Campaign:
 				exit_menu = True
 				
 		
+		self.LoadCampaign(selected_campaign['filename'])
+		return True
+	
+	
+	# load the stats for a campaign from its file and set up the calendar
+	def LoadCampaign(self, filename):
+		
 		# create a local copy of selected campaign stats
-		with open(CAMPAIGNPATH + selected_campaign['filename'], encoding='utf8') as data_file:
-			self.filename = selected_campaign['filename'].rsplit('.', 1)[0]
+		with open(CAMPAIGNPATH + filename, encoding='utf8') as data_file:
+			self.filename = filename.rsplit('.', 1)[0]
 			self.stats = json.load(data_file)
 		
 		# generate list of combat days
@@ -1545,8 +1665,6 @@ class Campaign:
 		self.today = self.combat_calendar[0]
 		self.current_week = self.stats['calendar_weeks'][0]
 		
-		return True
-		
 		
 	# menu to select player tank
 	# also allows input/generation of tank name, and return both
@@ -1623,24 +1741,7 @@ class Campaign:
 			libtcod.console_blit(con, 0, 0, 0, 0, 0, 0, 0)
 		
 		# generate tempoary list of units, one per possible unit type
-		unit_list = []
-		with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
-			unit_types = json.load(data_file)
-		
-		for unit_id in self.stats['player_unit_list']:
-			
-			# check that unit is available at current point in calendar
-			if unit_id not in unit_types: continue
-			if 'rarity' in unit_types[unit_id]:
-				for date, chance in unit_types[unit_id]['rarity'].items():
-					# not yet available at this time
-					if date > campaign.today:
-						continue
-					# earliest rarity date is on or after current date, proceed
-					break
-			
-			new_unit = Unit(unit_id)
-			unit_list.append(new_unit)
+		unit_list = self.GetTankSelectionList()
 		
 		# select first tank by default
 		selected_unit = unit_list[0]
@@ -1658,7 +1759,7 @@ class Campaign:
 			if libtcod.console_is_window_closed(): sys.exit()
 			
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('TankSelectionMenu'): continue
 			
 			# proceed with selected tank
 			if key.vk == libtcod.KEY_ENTER:
@@ -1699,6 +1800,27 @@ class Campaign:
 		return (selected_unit.unit_id, player_tank_name)
 	
 	
+	# generate a list of units for the tank selection menu, one per possible unit type
+	def GetTankSelectionList(self):
+		unit_list = []
+		for unit_id in self.stats['player_unit_list']:
+			
+			# check that unit is available at current point in calendar
+			if not unit_type_registry.Exists(unit_id): continue
+			unit_stats = unit_type_registry.GetStats(unit_id)
+			if 'rarity' in unit_stats:
+				for date, chance in unit_stats['rarity'].items():
+					# not yet available at this time
+					if date > campaign.today:
+						continue
+					# earliest rarity date is on or after current date, proceed
+					break
+			
+			new_unit = Unit(unit_id)
+			unit_list.append(new_unit)
+		return unit_list
+	
+	
 	# allow player to choose a new tank after losing one or during a refit period
 	def ReplacePlayerTank(self):
 		
@@ -1718,10 +1840,8 @@ class Campaign:
 			
 			# build a list of the required position names for the new tank type
 			open_position_list = []
-			with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
-				unit_types = json.load(data_file)
-				for position in unit_types[unit_id]['crew_positions']:
-					open_position_list.append(position['name'])
+			for position in unit_type_registry.GetStats(unit_id)['crew_positions']:
+				open_position_list.append(position['name'])
 			
 			# run through every position in current tank, try to place crew into a position in the new one
 			# if any crew cannot be fit into new position, put them into a list
@@ -1838,8 +1958,8 @@ class Campaign:
 		
 		# starfield
 		for i in range(18):
-			x = libtcod.random_get_int(0, 0, WINDOW_WIDTH)
-			y = libtcod.random_get_int(0, 0, 18)
+			x = GetRNG('cosmetic').randint(0, WINDOW_WIDTH)
+			y = GetRNG('cosmetic').randint(0, 18)
 			libtcod.console_put_char_ex(con, x, y, 250, libtcod.white, libtcod.black)
 		
 		# gradient
@@ -1934,7 +2054,7 @@ class Campaign:
 				position.crewman.fatigue = -5
 				
 				# grant random additional exp
-				position.crewman.exp += libtcod.random_get_int(0, 0, 5)
+				position.crewman.exp += GetRNG('crew').randint(0, 5)
 				
 				# check for level up
 				levels_up = 0
@@ -1996,7 +2116,7 @@ class Campaign:
 		while not exit_menu:
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('ShowEndOfDay'): continue
 			
 			if key.vk == libtcod.KEY_ENTER:
 				exit_menu = True
@@ -2116,7 +2236,7 @@ class Campaign:
 		while not exit_menu:
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('DisplayCampaignSummary'): continue
 			
 			# end menu
 			if key.vk in [libtcod.KEY_ESCAPE, libtcod.KEY_ENTER]:
@@ -2530,7 +2650,7 @@ class Campaign:
 				
 				# roll for return to action based on how many days elapsed
 				if min_days <= 0:
-					if GetPercentileRoll() <= days_past * FIELD_HOSPITAL_RELEASE_CHANCE:
+					if GetPercentileRoll('crew') <= days_past * FIELD_HOSPITAL_RELEASE_CHANCE:
 						self.ShowReturningCrewMenu(crewman)
 						continue
 				
@@ -2594,7 +2714,7 @@ class Campaign:
 				
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()	
+			keypress = GetInputEvent('DoCampaignCalendarLoop')	
 			if not keypress: continue
 			
 			# game menu
@@ -2891,7 +3011,7 @@ class CampaignDay:
 		self.GenerateWeather()
 		
 		if campaign.options['fate_points']:
-			self.fate_points = libtcod.random_get_int(0, 1, 2)	# fate points protecting the player
+			self.fate_points = GetRNG('campaign').randint(1, 2)	# fate points protecting the player
 		else:
 			self.fate_points = 0
 		
@@ -3013,6 +3133,13 @@ class CampaignDay:
 			'hex_highlight' : False
 		}
 	
+	
+	# give any attributes added since this was saved their default values
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+	
+	
 	# set up the list of player guns and select the first one if any
 	def BuildPlayerGunList(self):
 		self.gun_list = []
@@ -3031,7 +3158,7 @@ class CampaignDay:
 			# determine unit type
 			if 'player_squad_list' in campaign.stats:
 				if campaign.player_unit.unit_id in campaign.stats['player_squad_list']:
-					unit_id = choice(campaign.stats['player_squad_list'][campaign.player_unit.unit_id])
+					unit_id = GetRNG('spawning').choice(campaign.stats['player_squad_list'][campaign.player_unit.unit_id])
 				else:
 					unit_id = campaign.player_unit.unit_id
 			else:
@@ -3111,7 +3238,7 @@ class CampaignDay:
 		
 		# copy terrain for current player row to new row
 		for hx in range(player_hx-4, player_hx+5):
-			if (hx, player_hy) not in CAMPAIGN_DAY_HEXES: continue
+			if (hx, player_hy) not in CD_HEX_INDEX: continue
 			self.map_hexes[(hx+hx_mod, new_hy)] = self.map_hexes[(hx, player_hy)]
 			self.map_hexes[(hx+hx_mod, new_hy)].hx = hx+hx_mod
 			self.map_hexes[(hx+hx_mod, new_hy)].hy = new_hy
@@ -3137,6 +3264,7 @@ class CampaignDay:
 			for (hx, hy) in CAMPAIGN_DAY_HEXES:
 				self.map_hexes[(hx, hy)].controlled_by = 1
 			self.map_hexes[self.player_unit_location].controlled_by = 0
+		ClearHexPathCache()
 		
 		# update consoles
 		self.UpdateCDMapCon()
@@ -3149,7 +3277,7 @@ class CampaignDay:
 	# roll for type of mission for today
 	def GenerateMission(self):
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('campaign')
 		
 		for k, v in campaign.current_week['mission_odds'].items():
 			if roll <= float(v):
@@ -3252,7 +3380,7 @@ class CampaignDay:
 		weather_odds = weather_odds_dict[season]
 		
 		# roll for ground cover first
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('weather')
 		for result, chance in weather_odds['ground_conditions'].items():
 			if roll <= chance:
 				break
@@ -3264,11 +3392,11 @@ class CampaignDay:
 			self.weather['Freezing'] = True
 		# even if ground conditions are dry, chance that snow might fall later
 		elif result == 'Dry':
-			if GetPercentileRoll() <= weather_odds['freezing']:
+			if GetPercentileRoll('weather') <= weather_odds['freezing']:
 				self.weather['Freezing'] = True
 
 		# roll for cloud cover
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('weather')
 		for result, chance in weather_odds['cloud_cover'].items():
 			if roll <= chance:
 				break
@@ -3276,7 +3404,7 @@ class CampaignDay:
 		self.weather['Cloud Cover'] = result
 		
 		# roll for precipitation
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('weather')
 		for result, chance in weather_odds['precipitation'].items():
 			
 			# only allow snow if weather is cold
@@ -3298,22 +3426,22 @@ class CampaignDay:
 		
 		# if precipitation has been rolled, fix clear cloud cover
 		if self.weather['Precipitation'] != 'None' and self.weather['Cloud Cover'] == 'Clear':
-			self.weather['Cloud Cover'] = choice(['Scattered', 'Heavy', 'Overcast'])
+			self.weather['Cloud Cover'] = GetRNG('weather').choice(['Scattered', 'Heavy', 'Overcast'])
 		
 		# FUTURE fog level: 0-3
 		
 		# set first weather update countdown
-		self.weather_update_clock = BASE_WEATHER_UPDATE_CLOCK + (libtcod.random_get_int(0, 1, 16))
+		self.weather_update_clock = BASE_WEATHER_UPDATE_CLOCK + (GetRNG('weather').randint(1, 16))
 	
 	
 	# update weather conditions, possibly changing them
 	def UpdateWeather(self):
 		
 		# reset update clock
-		self.weather_update_clock = BASE_WEATHER_UPDATE_CLOCK + (libtcod.random_get_int(0, 1, 16))
+		self.weather_update_clock = BASE_WEATHER_UPDATE_CLOCK + (GetRNG('weather').randint(1, 16))
 		
 		# check for ground condition update
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('weather')
 		
 		# muddy ground drying out
 		if self.weather['Ground'] == 'Muddy':
@@ -3370,10 +3498,10 @@ class CampaignDay:
 		
 		
 		# roll to see weather change takes place
-		if GetPercentileRoll() > 15.0: return
+		if GetPercentileRoll('weather') > 15.0: return
 		
 		# roll for possible type of weather change
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('weather')
 			
 		# change in precipitation level
 		if roll <= 70.0:
@@ -3382,7 +3510,7 @@ class CampaignDay:
 			if self.weather['Cloud Cover'] == 'Clear':
 				return
 			
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('weather')
 			
 			if self.weather['Precipitation'] == 'None':
 				
@@ -3477,7 +3605,7 @@ class CampaignDay:
 		# change in cloud level
 		else:
 			
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('weather')
 			
 			if self.weather['Cloud Cover'] == 'Clear':
 				if roll <= 85.0:
@@ -3538,7 +3666,10 @@ class CampaignDay:
 		self.weather_update_clock -= minutes
 		if self.weather_update_clock <= 0:
 			# check for weather conditions change, update relevant consoles
+			old_weather = self.weather.copy()
 			self.UpdateWeather()
+			if self.weather != old_weather:
+				TraceEvent('weather', weather=self.weather.copy())
 			self.UpdateCDCommandCon()
 			DisplayWeatherInfo(cd_weather_con)
 			if scenario is not None:
@@ -3564,7 +3695,7 @@ class CampaignDay:
 		# don't trigger if a scenario just started
 		if scenario is not None: return
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('campaign')
 		
 		if DEBUG:
 			if session.debug['Always CD Random Event']:
@@ -3576,7 +3707,7 @@ class CampaignDay:
 			return
 		
 		# roll for type of event
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('campaign')
 		
 		# new target of opportunity possibly generated
 		if roll <= 20.0:
@@ -3598,7 +3729,7 @@ class CampaignDay:
 			(player_hx, player_hy) = self.player_unit_location
 			for hy in range(0, player_hy+1):
 				for hx in range(player_hx-4, player_hx+5):
-					if (hx, hy) not in CAMPAIGN_DAY_HEXES: continue
+					if (hx, hy) not in CD_HEX_INDEX: continue
 					if self.map_hexes[(hx, hy)].target_of_opportunity is not None: continue
 					if self.map_hexes[(hx, hy)].controlled_by == 0: continue
 					if self.map_hexes[(hx, hy)].enemy_strength > highest_strength:
@@ -3613,17 +3744,17 @@ class CampaignDay:
 					hex_list.remove((strength, hx, hy))
 			
 			# choose from remaining hex zones
-			(strength, hx, hy) = choice(hex_list) 
+			(strength, hx, hy) = GetRNG('campaign').choice(hex_list) 
 			
 			self.map_hexes[(hx, hy)].target_of_opportunity = 10
 			
 			# NEW: increase enemy strength here
-			self.map_hexes[(hx, hy)].enemy_strength += libtcod.random_get_int(0, 2, 5)
+			self.map_hexes[(hx, hy)].enemy_strength += GetRNG('campaign').randint(2, 5)
 			if self.map_hexes[(hx, hy)].enemy_strength > 10:
 				self.map_hexes[(hx, hy)].enemy_strength = 10
 			
 			# set flavour text
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('campaign')
 			if roll <= 20.0:
 				text = 'Ammo Depot'
 			elif roll <= 40.0:
@@ -3652,10 +3783,10 @@ class CampaignDay:
 			if len(hex_list) == 0:
 				return
 			
-			(hx, hy) = choice(hex_list)
+			(hx, hy) = GetRNG('campaign').choice(hex_list)
 			map_hex = self.map_hexes[(hx,hy)]
 			
-			map_hex.enemy_strength += libtcod.random_get_int(0, 1, 3)
+			map_hex.enemy_strength += GetRNG('campaign').randint(1, 3)
 			if map_hex.enemy_strength > 10:
 				map_hex.enemy_strength = 10
 			
@@ -3676,7 +3807,7 @@ class CampaignDay:
 			if len(hex_list) == 0:
 				return
 			
-			(hx, hy) = choice(hex_list)
+			(hx, hy) = GetRNG('campaign').choice(hex_list)
 			self.map_hexes[(hx,hy)].known_to_player = True
 			
 			ShowMessage('We have received information about expected enemy strength in an area.', cd_highlight=(hx,hy))
@@ -3693,7 +3824,7 @@ class CampaignDay:
 			if len(hex_list) == 0:
 				return
 			
-			(hx, hy) = choice(hex_list)
+			(hx, hy) = GetRNG('campaign').choice(hex_list)
 			map_hex = self.map_hexes[(hx,hy)]
 			
 			map_hex.known_to_player = False
@@ -3701,7 +3832,7 @@ class CampaignDay:
 			ShowMessage('Enemy movement reported in a map zone, estimated strength no longer certain.', cd_highlight=(hx,hy))
 			
 			map_hex.enemy_strength -= 3
-			map_hex.enemy_strength += libtcod.random_get_int(0, 0, 6)
+			map_hex.enemy_strength += GetRNG('campaign').randint(0, 6)
 			
 			if map_hex.enemy_strength < 1:
 				map_hex.enemy_strength = 1
@@ -3715,13 +3846,13 @@ class CampaignDay:
 			
 			if 'air_support_level' in campaign.current_week:
 				text += 'air'
-				self.air_support_level += (10.0 * float(libtcod.random_get_int(0, 1, 3)))
+				self.air_support_level += (10.0 * float(GetRNG('campaign').randint(1, 3)))
 				# make sure does not go beyond initial level
 				if self.air_support_level > campaign.current_week['air_support_level']:
 					self.air_support_level = campaign.current_week['air_support_level']
 			elif 'arty_support_level' in campaign.current_week:
 				text += 'artillery'
-				self.arty_support_level += (10.0 * float(libtcod.random_get_int(0, 1, 3)))
+				self.arty_support_level += (10.0 * float(GetRNG('campaign').randint(1, 3)))
 				if self.arty_support_level > campaign.current_week['arty_support_level']:
 					self.arty_support_level = campaign.current_week['arty_support_level']
 			else:
@@ -3787,7 +3918,7 @@ class CampaignDay:
 		else:
 			return
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('campaign')
 		
 		# friendly forces capture an enemy zone
 		if roll <= friendly_capture_odds:
@@ -3813,11 +3944,11 @@ class CampaignDay:
 			
 			# 1+ possible hexes to capture
 			if len(hex_list) > 0:
-				(hx, hy) = choice(hex_list)
+				(hx, hy) = GetRNG('campaign').choice(hex_list)
 				ShowMessage('Allied forces have captured an enemy-held zone!', cd_highlight=(hx,hy)) 
 				self.map_hexes[(hx,hy)].CaptureMe(0, no_vp=True)
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('campaign')
 		
 		(player_hx, player_hy) = self.player_unit_location
 		
@@ -3850,11 +3981,11 @@ class CampaignDay:
 			# 1+ possible hexes to capture
 			if len(hex_list) > 0:
 				
-				capture_num = libtcod.random_get_int(0, 1, enemy_max_capture)
+				capture_num = GetRNG('campaign').randint(1, enemy_max_capture)
 				if capture_num > len(hex_list):
 					capture_list = hex_list.copy()
 				else:
-					capture_list = sample(hex_list, capture_num)
+					capture_list = GetRNG('campaign').sample(hex_list, capture_num)
 				
 				for (hx, hy) in capture_list:
 					self.map_hexes[(hx,hy)].CaptureMe(1)
@@ -3906,7 +4037,7 @@ class CampaignDay:
 			libtcod.console_rect(con, x, y, 25, 8, True, libtcod.BKGND_SET)
 			portrait = campaign.player_unit.GetStat('portrait')
 			if portrait is not None:
-				libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, con, x, y)
+				libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, con, x, y)
 			libtcod.console_set_default_foreground(con, libtcod.white)
 			if campaign.player_unit.unit_name != '':
 				libtcod.console_print(con, x, y, campaign.player_unit.unit_name)
@@ -4174,7 +4305,7 @@ class CampaignDay:
 			
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('AmmoReloadMenu')
 			if not keypress: continue
 			
 			if key.vk == libtcod.KEY_ENTER:
@@ -4353,7 +4484,7 @@ class CampaignDay:
 			for (k, v) in position.crewman.injury.items():
 				if v is None: continue
 				if v != 'Critical': continue
-				roll = GetPercentileRoll() - 20.0
+				roll = GetPercentileRoll('crew') - 20.0
 				if roll <= position.crewman.stats['Grit'] * 10.0:
 					position.crewman.injury[k] = 'Serious'
 					continue
@@ -4428,22 +4559,16 @@ class CampaignDay:
 		dirt_road = False
 		stone_road = False
 		
-		if GetPercentileRoll() <= float(REGIONS[campaign.stats['region']]['stone_road_odds']):
+		if GetPercentileRoll('map') <= float(REGIONS[campaign.stats['region']]['stone_road_odds']):
 			stone_road = True
-		if GetPercentileRoll() <= float(REGIONS[campaign.stats['region']]['dirt_road_odds']):
+		if GetPercentileRoll('map') <= float(REGIONS[campaign.stats['region']]['dirt_road_odds']):
 			dirt_road = True
 		
 		# no roads generated
 		if not dirt_road and not stone_road: return
 		
 		# choose a random edge hex
-		edge_list = []
-		for (hx, hy) in CAMPAIGN_DAY_HEXES:
-			for d in range(6):
-				if self.GetAdjacentCDHex(hx, hy, d) not in CAMPAIGN_DAY_HEXES:
-					edge_list.append((hx, hy))
-					break
-		(hx1, hy1) = choice(edge_list)
+		(hx1, hy1) = GetRNG('map').choice(CD_EDGE_HEXES)
 		
 		# find the hex on opposite edge of map
 		hx2 = hx1 * -1
@@ -4458,17 +4583,18 @@ class CampaignDay:
 		hx, hy = hx1, hy1
 		while hx != hx2 or hy != hy2:
 			path_choices = []
-			distance = GetHexDistance(hx, hy, hx2, hy2)
+			distance = GetCDHexDistance(hx, hy, hx2, hy2)
 			for d in range(6):
 				
-				(hx_p, hy_p) = self.GetAdjacentCDHex(hx, hy, d)
+				i = CD_HEX_NEIGHBOURS[CD_HEX_INDEX[(hx, hy)]][d]
 				
 				# target hex not on map
-				if (hx_p, hy_p) not in CAMPAIGN_DAY_HEXES:
+				if i == -1:
 					continue
 				
 				# further away or same distance from target hex
-				if GetHexDistance(hx_p, hy_p, hx2, hy2) >= distance:
+				(hx_p, hy_p) = CAMPAIGN_DAY_HEXES[i]
+				if GetCDHexDistance(hx_p, hy_p, hx2, hy2) >= distance:
 					continue
 				
 				path_choices.append(d)
@@ -4478,7 +4604,7 @@ class CampaignDay:
 				break
 			
 			# choose one and make a link to it
-			d = choice(path_choices)
+			d = GetRNG('map').choice(path_choices)
 			(hx_p,hy_p) = self.GetAdjacentCDHex(hx, hy, d)
 			
 			if stone_road:
@@ -4504,7 +4630,7 @@ class CampaignDay:
 				hex_list.append((hx, hy))
 		
 		if len(hex_list) > 0:
-			shuffle(hex_list)
+			GetRNG('map').shuffle(hex_list)
 			for (hx1, hy1) in hex_list:
 				
 				# find the nearest CD map hex with at least one road link
@@ -4517,7 +4643,7 @@ class CampaignDay:
 					if self.map_hexes[(hx2,hy2)].road_links == [None,None,None,None,None,None]: continue
 										
 					# get the distance to the possible link
-					d = GetHexDistance(hx1, hy1, hx2, hy2)
+					d = GetCDHexDistance(hx1, hy1, hx2, hy2)
 					
 					link_list.append((d,hx2,hy2))
 				
@@ -4557,13 +4683,14 @@ class CampaignDay:
 			self.map_hexes[(hx,hy)].rivers = []
 			self.map_hexes[(hx,hy)].bridges = []
 		self.cd_map_bridge_locations = []
+		ClearHexPathCache()
 		
 		rivers = 0
 		odds = float(REGIONS[campaign.stats['region']]['river_odds'])
 		
-		if GetPercentileRoll() <= odds:
+		if GetPercentileRoll('map') <= odds:
 			rivers += 1
-			if GetPercentileRoll() <= odds:
+			if GetPercentileRoll('map') <= odds:
 				rivers += 1
 		
 		if rivers == 0: return
@@ -4578,18 +4705,13 @@ class CampaignDay:
 				libtcod.console_flush()
 				
 				# build a list of map edge hexes
-				edge_list = []
-				for (hx, hy) in CAMPAIGN_DAY_HEXES:
-					for d in range(6):
-						if self.GetAdjacentCDHex(hx, hy, d) not in CAMPAIGN_DAY_HEXES:
-							edge_list.append((hx, hy))
-							break
+				edge_list = CD_EDGE_HEXES.copy()
 				
 				# determine starting and ending hex 
-				(hx1, hy1) = choice(edge_list)
-				shuffle(edge_list)
+				(hx1, hy1) = GetRNG('map').choice(edge_list)
+				GetRNG('map').shuffle(edge_list)
 				for (hx2, hy2) in edge_list:
-					if GetHexDistance(hx1, hy1, hx2, hy2) < 5: continue
+					if GetCDHexDistance(hx1, hy1, hx2, hy2) < 5: continue
 					break
 				
 				#print('DEBUG: Adding river from ' + str(hx1) + ',' + str(hy1) + ' to ' + str(hx2) + ',' + str(hy2))
@@ -4600,10 +4722,10 @@ class CampaignDay:
 				
 					(hx, hy) = hex_line[index]
 					
-					if (hx, hy) not in CAMPAIGN_DAY_HEXES: continue
+					if (hx, hy) not in CD_HEX_INDEX: continue
 					
 					# chance that river will end in map
-					if GetPercentileRoll() <= 2.0:
+					if GetPercentileRoll('map') <= 2.0:
 						break
 					
 					# each hex needs 1+ hexsides to become rivers
@@ -4613,7 +4735,7 @@ class CampaignDay:
 						
 						# for first hex, we need to use off-board hex as previous location
 						for direction1 in range(6):
-							if self.GetAdjacentCDHex(hx, hy, direction1) not in CAMPAIGN_DAY_HEXES:
+							if CD_HEX_NEIGHBOURS[CD_HEX_INDEX[(hx, hy)]][direction1] == -1:
 								break
 					
 					else:
@@ -4625,7 +4747,7 @@ class CampaignDay:
 					if hx == hx2 and hy == hy2:
 						# for final hex, we need to use off-board hex as next location
 						for direction2 in range(6):
-							if self.GetAdjacentCDHex(hx, hy, direction2) not in CAMPAIGN_DAY_HEXES:
+							if CD_HEX_NEIGHBOURS[CD_HEX_INDEX[(hx, hy)]][direction2] == -1:
 								break
 					else:
 						# otherwise use direction toward next hex
@@ -4662,10 +4784,11 @@ class CampaignDay:
 						
 						# randomly add bridges
 						if direction not in self.map_hexes[(hx,hy)].bridges:
-							if GetPercentileRoll() <= 10.0:
+							if GetPercentileRoll('map') <= 10.0:
 								self.map_hexes[(hx,hy)].bridges.append(direction)
 			
 			# do path checking
+			ClearHexPathCache()
 			path_good = True
 			STARTING_HEXES = [(-4,8), (-3,8), (-2,8), (-1,8), (0,8)]
 			ENDING_HEXES = [(4,0), (3,0), (2,0), (1,0), (0,0)]
@@ -4688,6 +4811,7 @@ class CampaignDay:
 			for (hx, hy) in CAMPAIGN_DAY_HEXES:
 				self.map_hexes[(hx,hy)].rivers = []
 				self.map_hexes[(hx,hy)].bridges = []
+			ClearHexPathCache()
 		
 		
 	# plot the centre of a day map hex location onto the map console
@@ -4798,7 +4922,7 @@ class CampaignDay:
 		while not exit_menu:
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			if not GetInputEvent(): continue
+			if not GetInputEvent('DisplayCampaignDaySummary'): continue
 			
 			# end menu
 			if key.vk in [libtcod.KEY_ESCAPE, libtcod.KEY_ENTER]:
@@ -4808,118 +4932,38 @@ class CampaignDay:
 	##### Campaign Day Console Functions #####
 	
 	# generate/update the campaign day map console
+	# zone terrain images come from the tile cache, and the whole map is reused if nothing on
+	# it has changed since it was last drawn
 	def UpdateCDMapCon(self):
 		
-		CHAR_LOCATIONS = [
-			(3,1), (2,2), (3,2), (4,2), (1,3), (2,3), (3,3), (4,3), (5,3),
-			(1,4), (2,4), (4,4), (5,4), (1,5), (2,5), (3,5), (4,5), (5,5),
-			(2,6), (3,6), (4,6), (3,7)
-		]
+		snow = self.weather['Ground'] in ['Snow', 'Deep Snow']
+		freezing = self.weather['Freezing']
 		
-		def GetRandomLocation():
-			return CHAR_LOCATIONS[libtcod.random_get_int(generator, 0, 21)]
+		tile_keys = []
+		for (hx, hy), cd_hex in self.map_hexes.items():
+			tile_keys.append((cd_hex.terrain_type, cd_hex.console_seed))
+		overlay = self.GetCDMapOverlay()
+		map_key = (snow, freezing, tuple(tile_keys), overlay['key'])
+		
+		# map is the same as last time
+		if cd_tile_cache.map_key == map_key:
+			libtcod.console_blit(cd_tile_cache.map_console, 0, 0, 0, 0, cd_map_con, 0, 0)
+			self.cd_map_index = cd_tile_cache.map_index.copy()
+			for (x, y, char) in overlay['bridges']:
+				if (x, y) not in self.cd_map_bridge_locations:
+					self.cd_map_bridge_locations.append((x, y))
+			return
 		
 		libtcod.console_clear(cd_map_con)
 		self.cd_map_index = {}
 		
 		# draw map hexes to console
-		
-		# load base zone image - depends on current ground conditions
-		if self.weather['Ground'] in ['Snow', 'Deep Snow']:
-			dayhex = LoadXP('dayhex_openground_snow.xp')
-			bg_col = libtcod.Color(158,158,158)
-		else:
-			dayhex = LoadXP('dayhex_openground.xp')
-			bg_col = libtcod.Color(0,64,0)
-		temp_con = libtcod.console_new(7, 9)
-		libtcod.console_set_key_color(temp_con, KEY_COLOR)
-		
-		
 		for (hx, hy), cd_hex in self.map_hexes.items():
 			
-			# generate console image for this zone's terrain type
-			libtcod.console_blit(dayhex, 0, 0, 0, 0, temp_con, 0, 0)
-			
-			generator = libtcod.random_new_from_seed(cd_hex.console_seed)
-			
-			if cd_hex.terrain_type == 'Forest':
-				
-				for (x,y) in CHAR_LOCATIONS:
-					if libtcod.random_get_int(generator, 1, 10) <= 4: continue
-					
-					if self.weather['Freezing']:
-						if libtcod.random_get_int(generator, 1, 2) == 1:
-							char = 24
-							if libtcod.random_get_int(generator, 1, 3) == 1: char += 100
-							col = libtcod.Color(libtcod.random_get_int(generator, 60, 100),20,20)
-						else:
-							char = 6
-							col = libtcod.Color(0,libtcod.random_get_int(generator, 100, 170),0)
-					else:
-						char = 6
-						col = libtcod.Color(0,libtcod.random_get_int(generator, 100, 170),0)
-					
-					libtcod.console_put_char_ex(temp_con, x, y, char, col, bg_col)
-				
-			elif cd_hex.terrain_type == 'Hills':
-				
-				if self.weather['Ground'] in ['Snow', 'Deep Snow']:
-					x = libtcod.random_get_int(generator, 170, 210)
-					col = libtcod.Color(x,x,x)
-				else:
-					col = libtcod.Color(70,libtcod.random_get_int(generator, 110, 150),0)
-				x = libtcod.random_get_int(generator, 2, 3)
-				libtcod.console_put_char_ex(temp_con, x, 2, 236, col, bg_col)
-				libtcod.console_put_char_ex(temp_con, x+1, 2, 237, col, bg_col)
-				
-				if libtcod.random_get_int(generator, 0, 1) == 0:
-					x = 1
-				else:
-					x = 4
-				libtcod.console_put_char_ex(temp_con, x, 4, 236, col, bg_col)
-				libtcod.console_put_char_ex(temp_con, x+1, 4, 237, col, bg_col)
-				
-				x = libtcod.random_get_int(generator, 2, 3)
-				libtcod.console_put_char_ex(temp_con, x, 6, 236, col, bg_col)
-				libtcod.console_put_char_ex(temp_con, x+1, 6, 237, col, bg_col)
-				
-			elif cd_hex.terrain_type == 'Fields':
-				
-				for (x,y) in CHAR_LOCATIONS:
-					
-					if self.weather['Freezing']:
-						col = libtcod.Color(50,40,20)
-						char = 124
-					else:
-						c = libtcod.random_get_int(generator, 120, 190)
-						col = libtcod.Color(c,c,0)
-						char = 176
-					libtcod.console_put_char_ex(temp_con, x, y, char,
-						col, bg_col)
-				
-			elif cd_hex.terrain_type == 'Marsh':
-				
-				elements = libtcod.random_get_int(generator, 7, 13)
-				while elements > 0:
-					(x,y) = GetRandomLocation()
-					if libtcod.console_get_char(temp_con, x, y) == 176: continue
-					libtcod.console_put_char_ex(temp_con, x, y, 176,
-						libtcod.Color(45,0,180), bg_col)
-					elements -= 1
-				
-			elif cd_hex.terrain_type == 'Villages':
-				
-				elements = libtcod.random_get_int(generator, 5, 9)
-				while elements > 0:
-					(x,y) = GetRandomLocation()
-					if libtcod.console_get_char(temp_con, x, y) == 249: continue
-					libtcod.console_put_char_ex(temp_con, x, y, 249,
-						libtcod.Color(77,77,77), bg_col)
-					elements -= 1
-			
-			# draw the final image to the map console
+			# draw the terrain image for this zone to the map console
+			tile = cd_tile_cache.GetTile(cd_hex.terrain_type, cd_hex.console_seed, snow, freezing)
 			(x,y) = self.PlotCDHex(hx, hy)
-			libtcod.console_blit(temp_con, 0, 0, 0, 0, cd_map_con, x-3, y-4)
+			libtcod.console_blit(tile, 0, 0, 0, 0, cd_map_con, x-3, y-4)
 			
 			# record screen locations of hex
 			self.cd_map_index[(x, y-3)] = (hx, hy)
@@ -4931,10 +4975,70 @@ class CampaignDay:
 				self.cd_map_index[(x1, y)] = (hx, hy)
 				self.cd_map_index[(x1, y+1)] = (hx, hy)
 			self.cd_map_index[(x, y+3)] = (hx, hy)
-			
-		del temp_con, dayhex
 		
 		# draw stone and dirt roads overtop
+		for (line, col, off_map) in overlay['roads']:
+			for (x, y) in line:
+				
+				# don't paint outside of map area
+				if libtcod.console_get_char_background(cd_map_con, x, y) == libtcod.black:
+					if off_map: break
+					continue
+				
+				libtcod.console_set_char_background(cd_map_con, x, y,
+					col, libtcod.BKGND_SET)
+				
+				# if character is not blank or hex edge, remove it
+				if libtcod.console_get_char(cd_map_con, x, y) not in [0, 249, 250]:
+					libtcod.console_set_char(cd_map_con, x, y, 0)
+		
+		# draw rivers overtop
+		for (x, y) in overlay['rivers']:
+			libtcod.console_put_char_ex(cd_map_con, x, y, 0, libtcod.white, RIVER_COL)
+		
+		# draw any bridges, also record their locations
+		for (x, y, char) in overlay['bridges']:
+			bg_col = libtcod.console_get_char_background(cd_map_con, x, y)
+			libtcod.console_put_char_ex(cd_map_con, x, y, char, libtcod.dark_sepia, bg_col)
+			self.cd_map_bridge_locations.append((x, y))
+		
+		# draw hex row guides
+		for i in range(0, 9):
+			libtcod.console_put_char_ex(cd_map_con, 0, 6+(i*5), chr(i+65),
+				libtcod.light_green, libtcod.black)
+		
+		# draw hex column guides
+		for i in range(0, 5):
+			libtcod.console_put_char_ex(cd_map_con, 7+(i*6), 50, chr(i+49),
+				libtcod.light_green, libtcod.black)
+		for i in range(5, 9):
+			libtcod.console_put_char_ex(cd_map_con, 32, 39-((i-5)*10), chr(i+49),
+				libtcod.light_green, libtcod.black)
+		
+		cd_tile_cache.StoreMap(map_key, cd_map_con, self.cd_map_index)
+	
+	
+	# return the screen cells covered by roads, rivers, and bridges on the campaign day map,
+	# in the order they are drawn; these only change when a new map is generated, so the last
+	# result is kept in the tile cache
+	def GetCDMapOverlay(self):
+		
+		overlay_key = []
+		for (hx, hy), map_hex in self.map_hexes.items():
+			overlay_key.append((hx, hy, tuple(map_hex.road_links), tuple(map_hex.rivers),
+				tuple(map_hex.bridges)))
+		overlay_key = tuple(overlay_key)
+		if cd_tile_cache.overlay is not None and cd_tile_cache.overlay['key'] == overlay_key:
+			return cd_tile_cache.overlay
+		
+		overlay = {
+			'key' : overlay_key,
+			'roads' : [],		# road lines: cells, colour, and whether it leads off map
+			'rivers' : [],		# river edge cells
+			'bridges' : []		# bridge cells and characters
+		}
+		
+		# stone and dirt roads
 		for (hx, hy), map_hex in self.map_hexes.items():
 			if map_hex.road_links == [None,None,None,None,None,None]: continue
 			
@@ -4952,25 +5056,12 @@ class CampaignDay:
 				
 				road_num += 1
 				
-				# paint road
 				if map_hex.road_links[direction] is False:
 					col = DIRT_ROAD_COL
 				else:
 					col = STONE_ROAD_COL
 				(x2, y2) = self.PlotCDHex(hx2, hy2)
-				line = GetLine(x1, y1, x2, y2)
-				for (x, y) in line:
-				
-					# don't paint outside of map area
-					if libtcod.console_get_char_background(cd_map_con, x, y) == libtcod.black:
-						continue
-					
-					libtcod.console_set_char_background(cd_map_con, x, y,
-						col, libtcod.BKGND_SET)
-					
-					# if character is not blank or hex edge, remove it
-					if libtcod.console_get_char(cd_map_con, x, y) not in [0, 249, 250]:
-						libtcod.console_set_char(cd_map_con, x, y, 0)
+				overlay['roads'].append((GetLine(x1, y1, x2, y2), col, False))
 			
 			# if map hex is on edge and has 1 road connection, draw a road leading off the edge of the map
 			if road_num > 1: continue
@@ -4981,59 +5072,38 @@ class CampaignDay:
 					off_map_hexes.append((hx2, hy2))
 			if len(off_map_hexes) == 0: continue
 			
+			# use the colour of a road leading into this zone
+			if False in map_hex.road_links:
+				col = DIRT_ROAD_COL
+			else:
+				col = STONE_ROAD_COL
+			
 			(hx2, hy2) = off_map_hexes[0]
 			(x2, y2) = self.PlotCDHex(hx2, hy2)
-			line = GetLine(x1, y1, x2, y2)
-			for (x, y) in line:
-				if libtcod.console_get_char_background(cd_map_con, x, y) == libtcod.black:
-					break
-					
-				libtcod.console_set_char_background(cd_map_con, x, y,
-					col, libtcod.BKGND_SET)
-					
-				# if character is not blank or hex edge, remove it
-				if libtcod.console_get_char(cd_map_con, x, y) not in [0, 249, 250]:
-					libtcod.console_set_char(cd_map_con, x, y, 0)
+			overlay['roads'].append((GetLine(x1, y1, x2, y2), col, True))
 		
-		# draw rivers overtop
+		# rivers and bridges
 		for (hx, hy), map_hex in self.map_hexes.items():
 			if len(map_hex.rivers) == 0: continue
 			
 			(x, y) = self.PlotCDHex(hx, hy)
 			
-			# draw each river edge
 			for direction in map_hex.rivers:
 				for (xm, ym) in CD_HEX_EDGE_CELLS[direction]:
-					libtcod.console_put_char_ex(cd_map_con, x+xm, y+ym, 0,
-						libtcod.white, RIVER_COL)
-					
-			# draw any bridges
+					overlay['rivers'].append((x+xm, y+ym))
+			
 			for direction in map_hex.bridges:
 				for (xm, ym) in CD_HEX_EDGE_CELLS[direction][1:-1]:
-					bg_col = libtcod.console_get_char_background(cd_map_con, x+xm, y+ym)
 					if direction in [0, 3]:
 						char = 47
 					elif direction in [2, 5]:
 						char = 92
 					else:
 						char = 45
-					libtcod.console_put_char_ex(cd_map_con, x+xm, y+ym, char,
-						libtcod.dark_sepia, bg_col)
-					# also record location
-					self.cd_map_bridge_locations.append((x+xm, y+ym))
-		
-		# draw hex row guides
-		for i in range(0, 9):
-			libtcod.console_put_char_ex(cd_map_con, 0, 6+(i*5), chr(i+65),
-				libtcod.light_green, libtcod.black)
+					overlay['bridges'].append((x+xm, y+ym, char))
 		
-		# draw hex column guides
-		for i in range(0, 5):
-			libtcod.console_put_char_ex(cd_map_con, 7+(i*6), 50, chr(i+49),
-				libtcod.light_green, libtcod.black)
-		for i in range(5, 9):
-			libtcod.console_put_char_ex(cd_map_con, 32, 39-((i-5)*10), chr(i+49),
-				libtcod.light_green, libtcod.black)
+		cd_tile_cache.overlay = overlay
+		return overlay
 	
 	
 	# generate/update the campaign day unit layer console
@@ -5483,9 +5553,9 @@ class CampaignDay:
 			if campaign_day.weather['Precipitation'] == 'Heavy Rain':
 				num = 16
 			for i in range(num):
-				x = libtcod.random_get_int(0, 4, 36)
-				y = libtcod.random_get_int(0, 0, 50)
-				lifespan = libtcod.random_get_int(0, 1, 5)
+				x = GetRNG('cosmetic').randint(4, 36)
+				y = GetRNG('cosmetic').randint(0, 50)
+				lifespan = GetRNG('cosmetic').randint(1, 5)
 				self.animation['rain_drops'].append((x, y, lifespan))		
 		
 		# set up snow if any
@@ -5498,9 +5568,9 @@ class CampaignDay:
 			else:
 				num = 16
 			for i in range(num):
-				x = libtcod.random_get_int(0, 4, 36)
-				y = libtcod.random_get_int(0, 0, 50)
-				lifespan = libtcod.random_get_int(0, 4, 10)
+				x = GetRNG('cosmetic').randint(4, 36)
+				y = GetRNG('cosmetic').randint(0, 50)
+				lifespan = GetRNG('cosmetic').randint(4, 10)
 				self.animation['snowflakes'].append((x, y, lifespan))	
 		
 	
@@ -5518,9 +5588,9 @@ class CampaignDay:
 				
 				# respawn if finished
 				if lifespan == 0:
-					x = libtcod.random_get_int(0, 4, 36)
-					y = libtcod.random_get_int(0, 0, 50)
-					lifespan = libtcod.random_get_int(0, 1, 5)
+					x = GetRNG('cosmetic').randint(4, 36)
+					y = GetRNG('cosmetic').randint(0, 50)
+					lifespan = GetRNG('cosmetic').randint(1, 5)
 				else:
 					y += 2
 					lifespan -= 1
@@ -5549,11 +5619,11 @@ class CampaignDay:
 				
 				# respawn if finished
 				if lifespan == 0:
-					x = libtcod.random_get_int(0, 4, 36)
-					y = libtcod.random_get_int(0, 0, 50)
-					lifespan = libtcod.random_get_int(0, 4, 10)
+					x = GetRNG('cosmetic').randint(4, 36)
+					y = GetRNG('cosmetic').randint(0, 50)
+					lifespan = GetRNG('cosmetic').randint(4, 10)
 				else:
-					x += choice([-1, 0, 1])
+					x += GetRNG('cosmetic').choice([-1, 0, 1])
 					y += 1
 					lifespan -= 1
 				
@@ -5659,7 +5729,7 @@ class CampaignDay:
 		
 		# calculate initial time to travel to front lines
 		if not self.travel_time_spent:
-			minutes = 5 + (libtcod.random_get_int(0, 1, 3) * 10)
+			minutes = 5 + (GetRNG('campaign').randint(1, 3) * 10)
 			self.AdvanceClock(0, minutes, skip_checks=True)
 			DisplayTimeInfo(time_con)
 			text = 'It takes you ' + str(minutes) + ' minutes to travel to the front lines.'
@@ -5735,7 +5805,7 @@ class CampaignDay:
 						
 						# should always happen - otherwise, how did they get here?
 						if len(hex_list) > 0:
-							(hx, hy) = choice(hex_list)
+							(hx, hy) = GetRNG('campaign').choice(hex_list)
 							self.MovePlayerTo(hx,hy)
 							self.CheckForCDMapShift()
 							
@@ -5797,13 +5867,13 @@ class CampaignDay:
 				continue
 			
 			# check for animation update
-			if time.time() - session.anim_timer >= 0.20:
+			if not headless and time.time() - session.anim_timer >= 0.20:
 				self.UpdateAnimCon()
 				self.UpdateCDDisplay()
 			
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('DoCampaignDayLoop')
 			
 			# check to see if mouse cursor has moved
 			if mouse.cx != mouse_x or mouse.cy != mouse_y:
@@ -6110,7 +6180,7 @@ class CampaignDay:
 								if weapon.GetStat('type') == 'Gun':
 									if 'HE' in weapon.ammo_stores:
 										if weapon.ammo_stores['HE'] > 0 :
-											weapon.ammo_stores['HE'] -= libtcod.random_get_int(0, 4, 10)
+											weapon.ammo_stores['HE'] -= GetRNG('campaign').randint(4, 10)
 											if weapon.ammo_stores['HE'] < 0:
 												weapon.ammo_stores['HE'] = 0
 											adv_fire_done = True
@@ -6123,7 +6193,7 @@ class CampaignDay:
 							ShowMessage(text + '.')
 														
 							# roll for scenario trigger
-							roll = GetPercentileRoll()
+							roll = GetPercentileRoll('campaign')
 							roll -= campaign_day.encounter_mod
 							
 							if DEBUG:
@@ -6148,14 +6218,14 @@ class CampaignDay:
 							
 							# spend support costs and reset flags
 							if self.air_support_request:
-								if GetPercentileRoll() <= self.air_support_level:
+								if GetPercentileRoll('campaign') <= self.air_support_level:
 									self.air_support_level -= 10.0
 								if self.air_support_level < 0.0:
 									self.air_support_level = 0.0
 								self.air_support_request = False
 							
 							if self.arty_support_request:
-								if GetPercentileRoll() <= self.arty_support_level:
+								if GetPercentileRoll('campaign') <= self.arty_support_level:
 									self.arty_support_level -= 10.0
 								if self.arty_support_level < 0.0:
 									self.arty_support_level = 0.0
@@ -6191,7 +6261,7 @@ class CDMapHex:
 		self.hy = hy
 		
 		self.terrain_type = ''		# placeholder for terrain type in this zone
-		self.console_seed = libtcod.random_get_int(0, 1, 128)	# seed for console image generation
+		self.console_seed = GetRNG('map').randint(1, 128)	# seed for console image generation
 		
 		# road links in 6 directions: false if dirt road, true if stone
 		self.road_links = [None,None,None,None,None,None]
@@ -6206,12 +6276,6 @@ class CDMapHex:
 		# VP value if captured by player
 		self.vp_value = 0
 		
-		# Pathfinding stuff
-		self.parent = None
-		self.g = 0
-		self.h = 0
-		self.f = 0
-		
 		# set enemy strength level
 		self.SetEnemyStrength(mission)
 		
@@ -6244,7 +6308,7 @@ class CDMapHex:
 		# roll for actual strength level
 		self.enemy_strength = 0
 		for i in range(2):
-			self.enemy_strength += libtcod.random_get_int(0, 0, avg_strength)
+			self.enemy_strength += GetRNG('map').randint(0, avg_strength)
 		self.enemy_strength = int(self.enemy_strength / 2)
 		
 		if self.enemy_strength < 1:
@@ -6281,14 +6345,6 @@ class CDMapHex:
 			self.vp_value = 0
 	
 	
-	# reset pathfinding info for this zone
-	def ClearPathInfo(self):
-		self.parent = None
-		self.g = 0
-		self.h = 0
-		self.f = 0
-	
-	
 	# generate a random terrain type for this zone hex
 	def GenerateTerrainType(self):
 		
@@ -6304,7 +6360,7 @@ class CDMapHex:
 		for terrain_type, odds in terrain_dict.items():
 			total_chance += odds
 		
-		roll = libtcod.random_get_int(0, 0, total_chance)
+		roll = GetRNG('map').randint(0, total_chance)
 		
 		for terrain_type, odds in terrain_dict.items():
 			if roll <= odds:
@@ -6318,9 +6374,13 @@ class CDMapHex:
 	# if no_vp is True, player doesn't receive VP or credit for this capture
 	def CaptureMe(self, player_num, no_vp=False):
 		
+		TraceEvent('zone_capture', hx=self.hx, hy=self.hy, player=player_num,
+			previous=self.controlled_by, vp_value=self.vp_value)
+		
 		# if captured by enemy, we can just set the zone control and then return
 		if player_num == 1:
 			self.controlled_by = player_num
+			ClearHexPathCache()
 			return
 		
 		# check for VP reward
@@ -6346,69 +6406,780 @@ class CDMapHex:
 		
 		# set new zone control
 		self.controlled_by = player_num
+		ClearHexPathCache()
 
 
 
-# Session: stores data that is generated for each game session and not stored in the saved game
-class Session:
-	def __init__(self):
-		
-		# flag for when player is exiting from game
-		self.exiting = False
-		
-		# pointer to player unit
-		#self.player_unit = None
-		
-		# flag: the last time the keyboard was polled, a key was pressed
-		self.key_down = False
-		
-		# load debug flags if in debug mode
-		self.debug = {}
-		if DEBUG:
-			with open(DATAPATH + 'debug.json', encoding='utf8') as data_file:
-				self.debug = json.load(data_file)
-		
-		# store player crew command defintions
-		with open(DATAPATH + 'crew_command_defs.json', encoding='utf8') as data_file:
-			self.crew_commands = json.load(data_file)
+# XP Cache: holds decoded .xp images in memory so that they don't have to be re-read from disk
+# and re-parsed every time they are drawn; least recently used images are dropped once the
+# cache is full
+# images are read from the memory-mapped image bundle if present and up to date, otherwise
+# from the individual .xp files
+class XPCache:
+	def __init__(self, max_size):
+		self.max_size = max_size	# maximum number of images to hold
+		self.bundle = xp_loader.open_xp_bundle(DATAPATH + XP_BUNDLE_FILE, source_dir=DATAPATH)
+		self.images = OrderedDict()	# master consoles, keyed by filename
+		self.hits = 0			# number of requests served from the cache
+		self.misses = 0			# number of requests that had to load the file
+	
+	
+	# check that an image is available, either in the cache, the bundle, or as a file
+	def Exists(self, filename):
+		if filename in self.images:
+			return True
+		if self.bundle is not None:
+			if filename in self.bundle['index']:
+				return True
+		return os.path.exists(DATAPATH + filename)
+	
+	
+	# return the master console for an image, loading and decoding it if required
+	def GetMaster(self, filename):
+		if filename in self.images:
+			self.hits += 1
+			self.images.move_to_end(filename)
+			return self.images[filename]
 		
-		# store nation definition info
-		with open(DATAPATH + 'nation_defs.json', encoding='utf8') as data_file:
-			self.nations = json.load(data_file)
+		self.misses += 1
+		if self.bundle is not None and filename in self.bundle['index']:
+			xp_data = xp_loader.load_xp_bundle_entry(self.bundle, filename)
+		else:
+			xp_file = gzip.open(DATAPATH + filename)
+			raw_data = xp_file.read()
+			xp_file.close()
+			xp_data = xp_loader.load_xp_string(raw_data, cells=False)
+		console = libtcod.console_new(xp_data['width'], xp_data['height'])
+		xp_loader.load_layer_to_console(console, xp_data['layer_data'][0])
+		
+		self.images[filename] = console
+		self.CheckSize()
+		return console
+	
+	
+	# drop least recently used images until the cache is within its size limit
+	def CheckSize(self):
+		while len(self.images) > self.max_size:
+			(filename, console) = self.images.popitem(last=False)
+			libtcod.console_delete(console)
+	
+	
+	# return a console image for the given file: either a new copy that the caller is free to
+	# modify, or the shared master console which must not be drawn on, and which may be deleted
+	# by the next request to the cache
+	def GetConsole(self, filename, shared=False):
+		master = self.GetMaster(filename)
+		if shared:
+			return master
+		console = libtcod.console_new(libtcod.console_get_width(master),
+			libtcod.console_get_height(master))
+		libtcod.console_blit(master, 0, 0, 0, 0, console, 0, 0)
+		return console
+	
+	
+	# clear all cached images and reset the hit and miss counters
+	def Clear(self):
+		for console in self.images.values():
+			libtcod.console_delete(console)
+		self.images.clear()
+		self.hits = 0
+		self.misses = 0
+
+
+
+# Terrain Tile Cache: holds the terrain images of campaign day map zones so that they don't need
+# to be procedurally redrawn each time the map console is updated, along with the road and river
+# cells of the current map and a copy of the last complete map
+class TerrainTileCache:
+	def __init__(self, max_size):
+		self.max_size = max_size	# maximum number of zone images to hold
+		self.tiles = OrderedDict()	# zone images, keyed by terrain type, seed, snow and freezing
+		self.overlay = None		# road, river, and bridge cells for the current map
+		self.map_key = None		# description of the last complete map
+		self.map_console = None		# copy of the last complete map
+		self.map_index = {}		# screen locations of zones on the last complete map
+	
+	
+	# return the image for a zone, drawing it if it's not already in the cache
+	def GetTile(self, terrain_type, console_seed, snow, freezing):
+		tile_key = (terrain_type, console_seed, snow, freezing)
+		if tile_key in self.tiles:
+			self.tiles.move_to_end(tile_key)
+			return self.tiles[tile_key]
 		
-		# load national flag images
-		self.flags = {}
-		for name, data in self.nations.items():
-			self.flags[name] = LoadXP(data['flag_image'])
+		tile = self.DrawTile(terrain_type, console_seed, snow, freezing)
+		self.tiles[tile_key] = tile
+		while len(self.tiles) > self.max_size:
+			(old_key, old_tile) = self.tiles.popitem(last=False)
+			libtcod.console_delete(old_tile)
+		return tile
+	
+	
+	# draw and return a new zone image for the given terrain type and ground conditions
+	def DrawTile(self, terrain_type, console_seed, snow, freezing):
 		
-		# background for attack console
-		self.attack_bkg = LoadXP('attack_bkg.xp')
+		CHAR_LOCATIONS = [
+			(3,1), (2,2), (3,2), (4,2), (1,3), (2,3), (3,3), (4,3), (5,3),
+			(1,4), (2,4), (4,4), (5,4), (1,5), (2,5), (3,5), (4,5), (5,5),
+			(2,6), (3,6), (4,6), (3,7)
+		]
 		
-		# field of view highlight on scenario hex map
-		self.scen_hex_fov = LoadXP('scen_hex_fov.xp')
-		libtcod.console_set_key_color(self.scen_hex_fov, KEY_COLOR)
+		def GetRandomLocation():
+			return CHAR_LOCATIONS[libtcod.random_get_int(generator, 0, 21)]
 		
-		# animation timer, used by both the campaign day and the scenario object
-		self.anim_timer = 0.0
+		# base zone image depends on current ground conditions
+		if snow:
+			dayhex = LoadXP('dayhex_openground_snow.xp', shared=True)
+			bg_col = libtcod.Color(158,158,158)
+		else:
+			dayhex = LoadXP('dayhex_openground.xp', shared=True)
+			bg_col = libtcod.Color(0,64,0)
+		temp_con = libtcod.console_new(7, 9)
+		libtcod.console_set_key_color(temp_con, KEY_COLOR)
+		libtcod.console_blit(dayhex, 0, 0, 0, 0, temp_con, 0, 0)
 		
-		# pop-up message console
-		self.msg_con = None
-		self.msg_location = None
+		generator = libtcod.random_new_from_seed(console_seed)
 		
-		# tank portrait for main menu
-		self.tank_portrait = None
-		with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
-			unit_types = json.load(data_file)
-		#print('Loaded ' + str(len(unit_types)) + ' unit types.')
+		if terrain_type == 'Forest':
+			
+			for (x,y) in CHAR_LOCATIONS:
+				if libtcod.random_get_int(generator, 1, 10) <= 4: continue
+				
+				if freezing:
+					if libtcod.random_get_int(generator, 1, 2) == 1:
+						char = 24
+						if libtcod.random_get_int(generator, 1, 3) == 1: char += 100
+						col = libtcod.Color(libtcod.random_get_int(generator, 60, 100),20,20)
+					else:
+						char = 6
+						col = libtcod.Color(0,libtcod.random_get_int(generator, 100, 170),0)
+				else:
+					char = 6
+					col = libtcod.Color(0,libtcod.random_get_int(generator, 100, 170),0)
+				
+				libtcod.console_put_char_ex(temp_con, x, y, char, col, bg_col)
+			
+		elif terrain_type == 'Hills':
+			
+			if snow:
+				x = libtcod.random_get_int(generator, 170, 210)
+				col = libtcod.Color(x,x,x)
+			else:
+				col = libtcod.Color(70,libtcod.random_get_int(generator, 110, 150),0)
+			x = libtcod.random_get_int(generator, 2, 3)
+			libtcod.console_put_char_ex(temp_con, x, 2, 236, col, bg_col)
+			libtcod.console_put_char_ex(temp_con, x+1, 2, 237, col, bg_col)
+			
+			if libtcod.random_get_int(generator, 0, 1) == 0:
+				x = 1
+			else:
+				x = 4
+			libtcod.console_put_char_ex(temp_con, x, 4, 236, col, bg_col)
+			libtcod.console_put_char_ex(temp_con, x+1, 4, 237, col, bg_col)
+			
+			x = libtcod.random_get_int(generator, 2, 3)
+			libtcod.console_put_char_ex(temp_con, x, 6, 236, col, bg_col)
+			libtcod.console_put_char_ex(temp_con, x+1, 6, 237, col, bg_col)
+			
+		elif terrain_type == 'Fields':
+			
+			for (x,y) in CHAR_LOCATIONS:
+				
+				if freezing:
+					col = libtcod.Color(50,40,20)
+					char = 124
+				else:
+					c = libtcod.random_get_int(generator, 120, 190)
+					col = libtcod.Color(c,c,0)
+					char = 176
+				libtcod.console_put_char_ex(temp_con, x, y, char,
+					col, bg_col)
+			
+		elif terrain_type == 'Marsh':
+			
+			elements = libtcod.random_get_int(generator, 7, 13)
+			while elements > 0:
+				(x,y) = GetRandomLocation()
+				if libtcod.console_get_char(temp_con, x, y) == 176: continue
+				libtcod.console_put_char_ex(temp_con, x, y, 176,
+					libtcod.Color(45,0,180), bg_col)
+				elements -= 1
+			
+		elif terrain_type == 'Villages':
+			
+			elements = libtcod.random_get_int(generator, 5, 9)
+			while elements > 0:
+				(x,y) = GetRandomLocation()
+				if libtcod.console_get_char(temp_con, x, y) == 249: continue
+				libtcod.console_put_char_ex(temp_con, x, y, 249,
+					libtcod.Color(77,77,77), bg_col)
+				elements -= 1
+		
+		return temp_con
+	
+	
+	# keep a copy of a complete map console
+	def StoreMap(self, map_key, console, map_index):
+		if self.map_console is None:
+			self.map_console = libtcod.console_new(libtcod.console_get_width(console),
+				libtcod.console_get_height(console))
+		libtcod.console_blit(console, 0, 0, 0, 0, self.map_console, 0, 0)
+		self.map_key = map_key
+		self.map_index = map_index.copy()
+
+
+
+# Sound Bank: holds decoded sound samples so that they don't have to be read from disk each time
+# they are played, and keeps track of which sample is playing on which mixer channel; least
+# recently used samples are freed once the bank is over its size limit
+class SoundBank:
+	def __init__(self, max_bytes, channels):
+		self.max_bytes = max_bytes	# maximum bytes of decoded audio to hold
+		self.samples = OrderedDict()	# decoded chunks, keyed by sound name
+		self.sizes = {}			# decoded size of each chunk in bytes
+		self.total_bytes = 0
+		self.channels = []		# sound name, priority, and start time for each channel
+		for i in range(channels):
+			self.channels.append(None)
+		self.dropped = 0		# number of sounds not played because all channels were busy
+	
+	
+	# decode all sound effects in the sounds folder, as many as will fit in the bank
+	def Preload(self):
+		for filename in sorted(os.listdir(SOUNDPATH)):
+			if not filename.endswith('.ogg'): continue
+			sound_name = filename[:-4]
+			if sound_name == 'armcom2_theme': continue
+			if self.GetSample(sound_name) is None: continue
+			if self.total_bytes >= self.max_bytes: break
+	
+	
+	# return the decoded chunk for a sound, loading it if required
+	def GetSample(self, sound_name):
+		if sound_name in self.samples:
+			self.samples.move_to_end(sound_name)
+			return self.samples[sound_name]
+		
+		sample = mixer.Mix_LoadWAV((SOUNDPATH + sound_name + '.ogg').encode('ascii'))
+		if not sample:
+			return None
+		self.samples[sound_name] = sample
+		self.sizes[sound_name] = sample.contents.alen
+		self.total_bytes += sample.contents.alen
+		self.CheckSize()
+		return sample
+	
+	
+	# free least recently used samples until the bank is within its size limit; samples that
+	# are still playing are kept
+	def CheckSize(self):
+		for sound_name in list(self.samples.keys()):
+			if self.total_bytes <= self.max_bytes: return
+			if len(self.samples) == 1: return
+			if self.IsPlaying(sound_name): continue
+			sample = self.samples.pop(sound_name)
+			self.total_bytes -= self.sizes.pop(sound_name)
+			mixer.Mix_FreeChunk(sample)
+	
+	
+	# check whether a sound is currently playing on any channel
+	def IsPlaying(self, sound_name):
+		for channel in range(len(self.channels)):
+			if self.channels[channel] is None: continue
+			if self.channels[channel][0] != sound_name: continue
+			if mixer.Mix_Playing(channel) == 1:
+				return True
+		return False
+	
+	
+	# find a channel to play a new sound on, stopping a lower or equal priority sound if all
+	# channels are busy; returns None if the sound should be dropped
+	def GetChannel(self, priority):
+		
+		# first free channel
+		for channel in range(len(self.channels)):
+			if mixer.Mix_Playing(channel) == 0:
+				return channel
+		
+		# oldest of the lowest priority sounds, if it is no more important than this one
+		steal_channel = None
+		for channel in range(len(self.channels)):
+			if self.channels[channel] is None: continue
+			(sound_name, channel_priority, start_time) = self.channels[channel]
+			if channel_priority > priority: continue
+			if steal_channel is not None:
+				(old_name, old_priority, old_time) = self.channels[steal_channel]
+				if channel_priority > old_priority: continue
+				if channel_priority == old_priority and start_time >= old_time: continue
+			steal_channel = channel
+		
+		if steal_channel is not None:
+			mixer.Mix_HaltChannel(steal_channel)
+		return steal_channel
+	
+	
+	# play a sound, returns False if it could not be played
+	def Play(self, sound_name, priority):
+		sample = self.GetSample(sound_name)
+		if sample is None:
+			print('ERROR: Sound not found: ' + sound_name)
+			return False
+		channel = self.GetChannel(priority)
+		if channel is None:
+			self.dropped += 1
+			return False
+		if mixer.Mix_PlayChannel(channel, sample, 0) == -1:
+			self.dropped += 1
+			return False
+		self.channels[channel] = (sound_name, priority, time.monotonic())
+		return True
+
+
+
+# Saved Game Error: raised when a saved game is damaged and can't be read
+class SavedGameError(Exception):
+	pass
+
+
+
+# Save Writer: writes saved games in the background; each saved game is a single file holding a
+# header followed by pickled and compressed sections, and is written to a temporary file which
+# then replaces the previous save so that an interrupted write never leaves a broken save behind
+# campaign history sections are pickled on the writer thread, and only if they have changed
+# the campaign and campaign day are pickled together, followed by a list of any of their objects
+# that the scenario refers to, such as the player unit and its crew; the scenario is pickled
+# separately with references to this list, so that it can be unpickled later and still share
+# these objects
+class SaveWriter:
+	def __init__(self):
+		self.thread = None		# thread writing the current save, if any
+		self.campaign = None		# campaign that the cached sections belong to
+		self.cache = {}			# change check and pickled data for each history section
+		self.error = None		# error from the last write, if any
+	
+	
+	# wait for a save in progress to be written
+	def Wait(self):
+		if self.thread is None: return
+		self.thread.join()
+		self.thread = None
+		if self.error is not None:
+			print('ERROR: Could not write saved game: ' + self.error)
+			self.error = None
+	
+	
+	# return a quick check value for a history section, used to tell whether it has changed since
+	# it was last pickled; journal days are only ever added to, and each day's log is recorded once
+	def GetSectionCheck(self, name, data):
+		if name == 'journal':
+			return tuple([(day, len(entries)) for (day, entries) in data.items()])
+		return tuple([(day, tuple(records.items())) for (day, records) in data.items()])
+	
+	
+	# take a snapshot of the game state and start writing it to disk
+	def Save(self, directory, campaign, campaign_day, scenario):
+		
+		# only one save can be written at a time
+		self.Wait()
+		
+		if self.campaign is not campaign:
+			self.campaign = campaign
+			self.cache = {}
+		
+		header = {
+			'schema' : SAVE_SCHEMA_VERSION,
+			'version' : VERSION,
+			'datetime' : datetime.now().strftime("%Y-%m-%d_%H_%M_%S"),
+			'sections' : []
+		}
+		header['info'] = GetSavedGameInfo(campaign, header['version'], header['datetime'])
+		
+		# take the history sections out of the campaign, and either reuse their pickled data
+		# from the last save or copy them to be pickled on the writer thread
+		section_list = []
+		history = {}
+		checks = {}
+		for name in SAVE_HISTORY_SECTIONS:
+			history[name] = getattr(campaign, name)
+			checks[name] = self.GetSectionCheck(name, history[name])
+			if name in self.cache and self.cache[name][0] == checks[name]:
+				section_list.append((name, self.cache[name][1]))
+			else:
+				snapshot = {}
+				for (k, v) in history[name].items():
+					snapshot[k] = v.copy()
+				section_list.append((name, snapshot))
+			setattr(campaign, name, {})
+		
+		# pickle the rest of the game state now, since it will change as soon as play continues;
+		# it will be compressed on the writer thread
+		game_file = io.BytesIO()
+		game_pickler = pickle.Pickler(game_file, pickle.HIGHEST_PROTOCOL)
+		try:
+			game_pickler.dump((campaign, campaign_day))
+		finally:
+			for name in SAVE_HISTORY_SECTIONS:
+				setattr(campaign, name, history[name])
+		
+		# a scenario that hasn't been unpickled since the game was loaded is saved as-is, and
+		# there is no scenario section if there is no scenario in progress
+		if scenario is None:
+			shared_list = []
+		elif isinstance(scenario, SavedScenario):
+			shared_list = scenario.shared_list
+			data = scenario.data
+		else:
+			(data, shared_list) = self.PickleScenario(scenario, game_pickler.memo.copy())
+		game_pickler.dump(shared_list)
+		section_list.append(('game', game_file.getvalue()))
+		if scenario is not None:
+			section_list.append(('scenario', data))
+		
+		path = SAVEPATH + directory + os.sep
+		if not os.path.isdir(path): os.mkdir(path)
+		self.thread = threading.Thread(target=self.Write, args=(path, header, section_list, checks))
+		self.thread.start()
+	
+	
+	# pickle a scenario, replacing any objects that have already been pickled in the campaign or
+	# campaign day with an index in a list of shared objects; returns the pickled scenario and
+	# the shared object list
+	def PickleScenario(self, scenario, game_memo):
+		shared_list = []
+		shared_index = {}
+		
+		def GetPersistentID(obj):
+			if id(obj) not in game_memo: return None
+			if isinstance(obj, (str, bytes)): return None
+			if id(obj) not in shared_index:
+				shared_index[id(obj)] = len(shared_list)
+				shared_list.append(obj)
+			return shared_index[id(obj)]
+		
+		scenario_file = io.BytesIO()
+		scenario_pickler = pickle.Pickler(scenario_file, pickle.HIGHEST_PROTOCOL)
+		scenario_pickler.persistent_id = GetPersistentID
+		scenario_pickler.dump(scenario)
+		return (scenario_file.getvalue(), shared_list)
+	
+	
+	# pickle and compress any remaining sections and write the save file, run on the writer thread
+	def Write(self, path, header, section_list, checks):
+		try:
+			data_list = []
+			for (name, data) in section_list:
+				if name in checks:
+					if not isinstance(data, bytes):
+						data = zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL),
+							SAVE_COMPRESSION_LEVEL)
+						self.cache[name] = (checks[name], data)
+				else:
+					data = zlib.compress(data, SAVE_COMPRESSION_LEVEL)
+				header['sections'].append((name, len(data), hashlib.sha1(data).hexdigest()))
+				data_list.append(data)
+			
+			with open(path + SAVE_FILE + '.tmp', 'wb') as f:
+				pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+				for data in data_list:
+					f.write(data)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(path + SAVE_FILE + '.tmp', path + SAVE_FILE)
+			
+			# remove any save in the older format
+			for extension in ['.dat', '.dir', '.bak']:
+				if os.path.exists(path + 'savegame' + extension):
+					os.remove(path + 'savegame' + extension)
+		
+		except OSError as e:
+			self.error = str(e)
+	
+	
+	# read the header of a saved game file
+	def ReadHeader(self, filename):
+		try:
+			with open(filename, 'rb') as f:
+				return pickle.load(f)
+		
+		# a damaged pickle can raise almost any error
+		except Exception as e:
+			raise SavedGameError('Saved game header is damaged: ' + str(e))
+	
+	
+	# read a saved game file, returns a dictionary of sections
+	# the scenario is not unpickled, and is returned as a placeholder instead
+	# raises SavedGameError if any part of the file is damaged
+	def Read(self, filename):
+		header = self.ReadHeader(filename)
+		sections = {}
+		try:
+			with open(filename, 'rb') as f:
+				pickle.load(f)
+				for (name, length, digest) in header['sections']:
+					data = f.read(length)
+					if hashlib.sha1(data).hexdigest() != digest:
+						raise SavedGameError('Saved game section is damaged: ' + name)
+					data = zlib.decompress(data)
+					if name == 'game':
+						unpickler = pickle.Unpickler(io.BytesIO(data))
+						sections['game'] = unpickler.load()
+						sections['shared'] = unpickler.load()
+					elif name == 'scenario':
+						sections['scenario'] = data
+					else:
+						sections[name] = pickle.loads(data)
+		except SavedGameError:
+			raise
+		except Exception as e:
+			raise SavedGameError('Saved game could not be read: ' + str(e))
+		
+		# if the layout of saved games changes, sections from older schemas are upgraded here
+		if 'scenario' not in sections:
+			sections['scenario'] = None
+		elif isinstance(sections['scenario'], bytes):
+			sections['scenario'] = SavedScenario(sections['scenario'], sections['shared'])
+		return sections
+
+
+
+# Saved Scenario: stands in for a scenario in progress that has been read from a saved game but
+# not yet unpickled; the scenario is unpickled and replaces this placeholder when it is first
+# used, normally when the scenario loop is re-entered, and if the game is saved before then
+# the pickled scenario is written back as-is
+class SavedScenario:
+	def __init__(self, data, shared_list):
+		self.data = data		# pickled scenario
+		self.shared_list = shared_list	# objects that the scenario shares with the campaign and campaign day
+		self.scenario = None		# unpickled scenario, once loaded
+	
+	
+	# unpickle the scenario and replace this placeholder with it
+	def Load(self):
+		global scenario
+		if self.scenario is None:
+			unpickler = pickle.Unpickler(io.BytesIO(self.data))
+			unpickler.persistent_load = self.shared_list.__getitem__
+			self.scenario = unpickler.load()
+		if scenario is self:
+			scenario = self.scenario
+		return self.scenario
+	
+	
+	# any other use of the scenario loads it first
+	def __getattr__(self, name):
+		if name in ['data', 'shared_list', 'scenario']:
+			raise AttributeError(name)
+		return getattr(self.Load(), name)
+	
+	
+	def __setattr__(self, name, value):
+		if name in ['data', 'shared_list', 'scenario']:
+			object.__setattr__(self, name, value)
+			return
+		setattr(self.Load(), name, value)
+
+
+
+# Unit Type Registry: holds the unit type definitions loaded once from JSON file, plus
+# a list of unit types with portraits and indexes of unit lists by class
+class UnitTypeRegistry:
+	def __init__(self):
+		
+		with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
+			self.unit_types = json.load(data_file)
+		
+		self.portrait_list = []		# unit ids that have a portrait image
+		
+		for unit_id, stats in self.unit_types.items():
+			if 'portrait' in stats:
+				self.portrait_list.append(unit_id)
+		
+		# class indexes for unit lists such as campaign enemy unit lists, keyed by the
+		# tuple of unit ids in the list
+		self.list_class_indexes = {}
+	
+	
+	# check that a unit type exists
+	def Exists(self, unit_id):
+		return unit_id in self.unit_types
+	
+	
+	# return the shared stats dictionary for a unit type, or None if not found
+	# this must not be modified; units and weapons hold a TypeStats object instead
+	def GetStats(self, unit_id):
+		if unit_id not in self.unit_types:
+			return None
+		return self.unit_types[unit_id]
+	
+	
+	# return the unit ids from a given list that are of a given class, in the same order as in
+	# the original list; unrecognized unit ids are skipped
+	# used for campaign enemy unit lists for each nation
+	def GetClassListFrom(self, unit_id_list, unit_class):
+		key = tuple(unit_id_list)
+		if key not in self.list_class_indexes:
+			class_index = {}
+			for unit_id in unit_id_list:
+				if unit_id not in self.unit_types: continue
+				class_index.setdefault(self.unit_types[unit_id]['class'], []).append(unit_id)
+			self.list_class_indexes[key] = class_index
+		if unit_class not in self.list_class_indexes[key]:
+			return []
+		return self.list_class_indexes[key][unit_class]
+
+
+
+# Type Stats: stats for a single unit or weapon; the stats of its type are shared between all
+# units of that type and never modified, and any stats that are changed or removed for this one
+# unit or weapon are stored separately
+# only the type id is saved, so the type stats are looked up again from the registry on load
+class TypeStats:
+	def __init__(self, unit_id, weapon_index=None):
+		self.unit_id = unit_id			# unit type id
+		self.weapon_index = weapon_index	# index in unit type weapon list, if weapon stats
+		self.shared = self.GetSharedStats()	# shared stats for this type
+		self.overrides = {}			# stats that have been set for this unit/weapon only
+		self.removed = set()			# stats that have been removed "
+	
+	
+	# look up the shared stats for this type from the registry
+	def GetSharedStats(self):
+		stats = unit_type_registry.GetStats(self.unit_id)
+		if stats is None:
+			print('ERROR: Could not find unit id: ' + self.unit_id)
+			return {}
+		if self.weapon_index is not None:
+			return stats['weapon_list'][self.weapon_index]
+		return stats
+	
+	
+	def __contains__(self, stat_name):
+		if stat_name in self.overrides:
+			return True
+		if stat_name in self.removed:
+			return False
+		return stat_name in self.shared
+	
+	
+	def __getitem__(self, stat_name):
+		if stat_name in self.overrides:
+			return self.overrides[stat_name]
+		if stat_name in self.removed:
+			raise KeyError(stat_name)
+		return self.shared[stat_name]
+	
+	
+	def __setitem__(self, stat_name, value):
+		self.overrides[stat_name] = value
+		self.removed.discard(stat_name)
+	
+	
+	def __delitem__(self, stat_name):
+		if stat_name not in self:
+			raise KeyError(stat_name)
+		if stat_name in self.overrides:
+			del self.overrides[stat_name]
+		self.removed.add(stat_name)
+	
+	
+	# return the value of a stat, or default if not present
+	def get(self, stat_name, default=None):
+		if stat_name in self:
+			return self[stat_name]
+		return default
+	
+	
+	# don't save the shared stats
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['shared']
+		return state
+	
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.shared = self.GetSharedStats()
+
+
+
+# Session: stores data that is generated for each game session and not stored in the saved game
+class Session:
+	def __init__(self):
+		
+		# flag for when player is exiting from game
+		self.exiting = False
+		
+		# pointer to player unit
+		#self.player_unit = None
+		
+		# flag: the last time the keyboard was polled, a key was pressed
+		self.key_down = False
+		
+		# policy that supplies key presses when running headless or replaying
+		self.player_policy = None
+		
+		# recorder for key presses during a new campaign, if recording
+		self.recorder = None
+		
+		# decoded sound effects and mixer channel use, once the mixer has been initialized
+		self.sound_bank = None
+		
+		# function and phase timings, in debug mode
+		self.profiler = None
+		
+		# stream of game events written for later analysis, if tracing
+		self.trace = None
+		
+		# load debug flags if in debug mode
+		self.debug = {}
+		if DEBUG:
+			with open(DATAPATH + 'debug.json', encoding='utf8') as data_file:
+				self.debug = json.load(data_file)
+		
+		# store player crew command defintions
+		with open(DATAPATH + 'crew_command_defs.json', encoding='utf8') as data_file:
+			self.crew_commands = json.load(data_file)
+		
+		# store nation definition info
+		with open(DATAPATH + 'nation_defs.json', encoding='utf8') as data_file:
+			self.nations = json.load(data_file)
+		
+		# load national flag images
+		self.flags = {}
+		for name, data in self.nations.items():
+			self.flags[name] = LoadXP(data['flag_image'])
+		
+		# background for attack console
+		self.attack_bkg = LoadXP('attack_bkg.xp')
+		
+		# field of view highlight on scenario hex map
+		self.scen_hex_fov = LoadXP('scen_hex_fov.xp')
+		libtcod.console_set_key_color(self.scen_hex_fov, KEY_COLOR)
+		
+		# animation timer, used by both the campaign day and the scenario object
+		self.anim_timer = 0.0
+		
+		# pop-up message console
+		self.msg_con = None
+		self.msg_location = None
+		
+		# random number streams for use outside of a campaign, eg. the main menu
+		self.rng = RandomStreams()
+		
+		# tank portrait for main menu
+		self.tank_portrait = None
+		unit_list = []
+		for unit_id in unit_type_registry.portrait_list:
+			if unit_type_registry.GetStats(unit_id)['class'] not in ['Light Tank', 'Medium Tank', 'Heavy Tank', 'Tank Destroyer']: continue
+			unit_list.append(unit_id)
 		
 		for tries in range(300):
-			unit_id = choice(list(unit_types.keys()))
-			if 'portrait' not in unit_types[unit_id]: continue
-			if unit_types[unit_id]['class'] not in ['Light Tank', 'Medium Tank', 'Heavy Tank', 'Tank Destroyer']: continue
-			if not os.path.exists(DATAPATH + unit_types[unit_id]['portrait']): continue
-			self.tank_portrait = LoadXP(unit_types[unit_id]['portrait'])
+			if len(unit_list) == 0: break
+			unit_id = self.rng.streams['cosmetic'].choice(unit_list)
+			portrait = unit_type_registry.GetStats(unit_id)['portrait']
+			if not xp_cache.Exists(portrait): continue
+			self.tank_portrait = LoadXP(portrait)
 			break
-		del unit_types
 		
 		# campaign day map player unit animation offset
 		self.cd_x_offset = 0
@@ -6420,8 +7191,13 @@ class Session:
 		if mixer.Mix_OpenAudio(48000, mixer.MIX_DEFAULT_FORMAT,	2, 1024) == -1:
 			print('ERROR in Mix_OpenAudio: ' + mixer.Mix_GetError())
 			return False
-		mixer.Mix_AllocateChannels(16)
+		mixer.Mix_AllocateChannels(SOUND_CHANNELS)
 		self.SetMasterVolume(config['ArmCom2'].getint('master_volume'))
+		
+		# decode sound effects now rather than during play
+		if self.sound_bank is None:
+			self.sound_bank = SoundBank(SOUND_BANK_SIZE, SOUND_CHANNELS)
+			self.sound_bank.Preload()
 		return True
 	
 	# load the main theme music
@@ -6473,7 +7249,7 @@ class Personnel:
 		}
 		
 		# randomly increase two stats to 3
-		for i in sample(range(3), 2):
+		for i in GetRNG('crew').sample(range(3), 2):
 			self.stats[CREW_STATS[i]] = 3
 		
 		self.skills = []				# list of skills
@@ -6504,7 +7280,7 @@ class Personnel:
 			self.level = 4
 			self.exp = GetExpRequiredFor(self.level)
 			self.adv = 4
-			self.age += libtcod.random_get_int(0, 3, 9)
+			self.age += GetRNG('crew').randint(3, 9)
 			self.rank = 2
 		
 		# gunners a little higher
@@ -6512,13 +7288,13 @@ class Personnel:
 			self.level = 2
 			self.exp = GetExpRequiredFor(self.level)
 			self.adv = 2
-			self.age += libtcod.random_get_int(0, 2, 5)
+			self.age += GetRNG('crew').randint(2, 5)
 			self.rank = 1
 		
 		# give current age, set random birthday
 		year = int(campaign.today.split('.')[0].lstrip('0')) - self.age
-		month = libtcod.random_get_int(0, 1, 12)
-		day = choice(monthrange(year, month))
+		month = GetRNG('crew').randint(1, 12)
+		day = GetRNG('crew').choice(monthrange(year, month))
 		self.birthday = str(year) + '.' + str(month).zfill(2) + '.' + str(day).zfill(2)
 		
 		# exposed / buttoned up status
@@ -6529,6 +7305,12 @@ class Personnel:
 		self.current_cmd = 'Spot'			# currently assigned command in scenario
 	
 	
+	# give any attributes added since this was saved their default values
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+	
+	
 	# resolve current injuries - called at end of campaign day
 	def ResolveInjuries(self):
 		if not self.alive: return
@@ -6550,11 +7332,11 @@ class Personnel:
 				if hospital_min == 0:
 					hospital_min = 3
 				else:
-					hospital_min += libtcod.random_get_int(0, 0, 1)
+					hospital_min += GetRNG('crew').randint(0, 1)
 				if hospital_max < 7:
 					hospital_max = 7
 				else:
-					hospital_max += libtcod.random_get_int(0, 0, 2)
+					hospital_max += GetRNG('crew').randint(0, 2)
 			
 			# serious injuries have a larger chance
 			elif v == 'Serious':
@@ -6562,14 +7344,14 @@ class Personnel:
 				if hospital_min < 7:
 					hospital_min = 7
 				else:
-					hospital_min += libtcod.random_get_int(0, 2, 4)
+					hospital_min += GetRNG('crew').randint(2, 4)
 				if hospital_max < 21:
 					hospital_max = 21
 				else:
-					hospital_max += libtcod.random_get_int(0, 2, 4)
+					hospital_max += GetRNG('crew').randint(2, 4)
 		
 		# do the field hospital roll
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('crew')
 		if roll <= hospital_chance:
 			self.field_hospital = (hospital_min, hospital_max)
 		else:
@@ -6605,7 +7387,7 @@ class Personnel:
 		# randomly determine body location hit
 		def GetHitLocation(attack_profile):
 			
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('crew')
 			
 			# sniper attack has greater chance of hitting head or torso,
 			# no chance of hitting legs
@@ -6670,7 +7452,7 @@ class Personnel:
 		
 		# spalling
 		elif 'spalling' in attack_profile:
-			modifier -= (libtcod.random_get_int(0, 1, 40) * 1.0)
+			modifier -= (GetRNG('crew').randint(1, 40) * 1.0)
 		
 		# initial KO hit on vehicle
 		elif 'ko_hit' in attack_profile:
@@ -6704,7 +7486,7 @@ class Personnel:
 		# part of bail-out - caught in burning vehicle
 		elif 'burn_up' in attack_profile:
 			if not self.ce:
-				modifier += (libtcod.random_get_int(0, 2, 5) * 10.0)
+				modifier += (GetRNG('crew').randint(2, 5) * 10.0)
 		
 		# crewman grit modifier
 		modifier -= self.stats['Grit'] * 3.0
@@ -6716,7 +7498,7 @@ class Personnel:
 		#print('DEBUG: Total injury modifier for ' + self.first_name + ' ' + self.last_name + ' is: ' + str(modifier))
 		
 		# do injury roll
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('crew')
 		
 		# check for debug flag
 		if DEBUG:
@@ -6731,8 +7513,14 @@ class Personnel:
 		# determine location
 		location = GetHitLocation(attack_profile)
 		
+		# add the outcome of the injury roll to the event trace
+		def TraceInjury(result, injury=None):
+			TraceEvent('crew_injury', unit=self.unit, position=self.current_position.name,
+				location=location, roll=roll, injury=injury, result=result)
+		
 		# if crewman is exposed in an AFV and leg/foot location is rolled, no effect
 		if 'firepower' in attack_profile and location in ['Right Leg & Foot', 'Left Leg & Foot']:
+			TraceInjury('No Effect')
 			return None
 		
 		#print('DEBUG: Location roll was: ' + location)
@@ -6741,13 +7529,16 @@ class Personnel:
 		
 		# miss - no effect
 		if roll < 35.0:
+			TraceInjury('No Effect')
 			return None
 		
 		# near miss - possible change in condition
 		elif roll <= 45.0:
-			if self.condition != 'Good Order': return False
-			if self.DoMoraleCheck(0.0): return False
+			if self.condition != 'Good Order' or self.DoMoraleCheck(0.0):
+				TraceInjury('No Effect')
+				return False
 			self.condition = 'Shaken'
+			TraceInjury('Shaken')
 			if show_messages:
 				if self.current_position.name in PLAYER_POSITIONS:
 					ShowMessage('You had a near miss and are now Shaken.')
@@ -6763,9 +7554,11 @@ class Personnel:
 						ShowMessage('You suffer a grazing hit but are no worse for wear.')
 					else:
 						ShowMessage('Your ' + self.current_position.name + ' suffers a grazing hit but is no worse for wear.')
+				TraceInjury('No Effect')
 				return None
 			if self.DoMoraleCheck(0.0):
 				self.condition = 'Shaken'
+				TraceInjury('Shaken')
 				self.DoFatigueCheck()
 				if show_messages:
 					if self.current_position.name in PLAYER_POSITIONS:
@@ -6775,6 +7568,7 @@ class Personnel:
 				return 'Shaken'
 			else:
 				self.condition = 'Stunned'
+				TraceInjury('Stunned')
 				self.DoFatigueCheck()
 				if show_messages:
 					if self.current_position.name in PLAYER_POSITIONS:
@@ -6785,7 +7579,7 @@ class Personnel:
 		
 		# hit in a non-critical location
 		elif roll <= 80.0:
-			injury_roll = GetPercentileRoll()
+			injury_roll = GetPercentileRoll('crew')
 			if injury_roll <= 50.0:
 				injury = 'Light'
 			elif injury_roll <= 80.0:
@@ -6795,7 +7589,7 @@ class Personnel:
 			
 		# hit in a possibly critical location
 		elif roll <= 90.0:
-			injury_roll = GetPercentileRoll()
+			injury_roll = GetPercentileRoll('crew')
 			if injury_roll <= 40.0:
 				injury = 'Light'
 			elif injury_roll <= 60.0:
@@ -6816,9 +7610,11 @@ class Personnel:
 			if self.current_position.name in PLAYER_POSITIONS and campaign_day.fate_points > 0:
 				campaign_day.fate_points -= 1
 				#print('DEBUG: Player saved from death by fate point')
+				TraceInjury('Fate Point', injury='KIA')
 				return False
 			
 			self.KIA()
+			TraceInjury('KIA', injury='KIA')
 			
 			if campaign.options['permadeath'] and self.current_position.name in PLAYER_POSITIONS:
 				text = 'You have been hit in the ' + location + ' and killed. Your campaign is over.'	
@@ -6836,6 +7632,7 @@ class Personnel:
 		if injury in ['Serious', 'Critical'] and self.current_position.name in PLAYER_POSITIONS and campaign_day.fate_points > 0:
 			campaign_day.fate_points -= 1
 			#print('DEBUG: Player saved from ' + injury + ' injury by fate point')
+			TraceInjury('Fate Point', injury=injury)
 			return None
 		
 		injury_change = False
@@ -6847,7 +7644,7 @@ class Personnel:
 			# light injury: chance of worsening to Heavy
 			if injury == 'Light':
 				if self.injury[location] == 'Light':
-					if GetPercentileRoll() <= 50.0:
+					if GetPercentileRoll('crew') <= 50.0:
 						self.injury[location] = 'Heavy'
 						injury_change = True
 			
@@ -6857,7 +7654,7 @@ class Personnel:
 					self.injury[location] = 'Heavy'
 					injury_change = True
 				elif self.injury[location] == 'Heavy':
-					if GetPercentileRoll() <= 50.0:
+					if GetPercentileRoll('crew') <= 50.0:
 						self.injury[location] = 'Serious'
 						injury_change = True
 			
@@ -6867,7 +7664,7 @@ class Personnel:
 					self.injury[location] = 'Serious'
 					injury_change = True
 				elif self.injury[location] == 'Serious':
-					if GetPercentileRoll() <= 50.0:
+					if GetPercentileRoll('crew') <= 50.0:
 						self.injury[location] = 'Critical'
 						injury_change = True
 			
@@ -6877,6 +7674,8 @@ class Personnel:
 					self.injury[location] = 'Critical'
 					injury_change = True
 		
+		TraceInjury(self.injury[location], injury=injury)
+		
 		if injury_change:
 			self.DoFatigueCheck()
 			if self.current_position.name in PLAYER_POSITIONS:
@@ -6932,20 +7731,20 @@ class Personnel:
 	
 	# do a grit test for this crewman
 	def DoGritCheck(self, modifier):
-		if GetPercentileRoll() + modifier <= self.stats['Grit'] * 9.0: return True
+		if GetPercentileRoll('crew') + modifier <= self.stats['Grit'] * 9.0: return True
 		return False
 		
 	
 	# do a morale check for this crewman
 	def DoMoraleCheck(self, modifier):
-		if GetPercentileRoll() + modifier <= self.stats['Morale'] * 9.0: return True
+		if GetPercentileRoll('crew') + modifier <= self.stats['Morale'] * 9.0: return True
 		return False
 	
 	
 	# do a stun check for this crewman
 	def DoStunCheck(self, modifier):
 		if self.condition not in ['Good Order', 'Shaken']: return True
-		if GetPercentileRoll() + modifier <= self.stats['Grit'] * 9.0: return True
+		if GetPercentileRoll('crew') + modifier <= self.stats['Grit'] * 9.0: return True
 		return False
 	
 	
@@ -6962,7 +7761,7 @@ class Personnel:
 			
 			#print('DEBUG: Checking for change in critical injury to ' + k)
 			
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('crew')
 			
 			# injury worsens and causes death
 			if roll > 97.0:
@@ -7055,7 +7854,7 @@ class Personnel:
 		for (k, v) in LEVEL_RANK_LIST.items():
 			if int(k) <= self.level:
 				if v > self.rank:
-					if GetPercentileRoll() <= PROMOTION_CHANCE:
+					if GetPercentileRoll('crew') <= PROMOTION_CHANCE:
 						self.rank = v
 						ShowMessage('Your ' + self.current_position.name + ' has been promoted to ' +
 							session.nations[self.nation]['rank_names'][str(self.rank)] + '!')
@@ -7283,7 +8082,7 @@ class Personnel:
 			
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('ShowCrewmanMenu')
 			
 			if not keypress: continue
 			
@@ -7368,8 +8167,8 @@ class Personnel:
 	def GenerateName(self):
 		name_okay = False
 		while not name_okay:
-			first_name = choice(session.nations[self.nation]['first_names'])
-			last_name = choice(session.nations[self.nation]['surnames'])
+			first_name = GetRNG('crew').choice(session.nations[self.nation]['first_names'])
+			last_name = GetRNG('crew').choice(session.nations[self.nation]['surnames'])
 			if first_name == last_name:
 				continue
 			name_okay = True
@@ -7442,9 +8241,9 @@ class Personnel:
 	def DoFatigueCheck(self):
 		if not self.alive or self.condition in ['Unconscious', 'Critcal']: return
 		if self.fatigue == 10: return
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('crew')
 		if roll <= 50.0: return
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('crew')
 		if roll <= float(self.stats['Morale']) * 10.0:
 			return
 		self.fatigue += 1
@@ -7454,7 +8253,7 @@ class Personnel:
 	def Rest(self):
 		if not self.alive: return
 		if self.fatigue == -5: return
-		i = libtcod.random_get_int(0, 0, self.stats['Morale'])
+		i = GetRNG('crew').randint(0, self.stats['Morale'])
 		self.fatigue -= i
 		if self.fatigue < -5:
 			self.fatigue = -5
@@ -7735,7 +8534,7 @@ class Position:
 class Weapon:
 	def __init__(self, unit, stats):
 		self.unit = unit			# unit that owns this weapon
-		self.stats = stats			# dictionary of weapon stats
+		self.stats = stats			# TypeStats object of weapon stats
 		
 		# some weapons need a descriptive name generated
 		if 'name' not in self.stats:
@@ -7793,11 +8592,15 @@ class Weapon:
 		self.acquired_target = None		# acquired target status and target unit
 	
 	
+	# give any attributes added since this was saved their default values
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+	
+	
 	# check for the value of a stat, return None if stat not present
 	def GetStat(self, stat_name):
-		if stat_name not in self.stats:
-			return None
-		return self.stats[stat_name]
+		return self.stats.get(stat_name)
 	
 	
 	# do a jam test for this weapon
@@ -7806,7 +8609,7 @@ class Weapon:
 		# already jammed
 		if self.jammed: return False
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		chance = WEAPON_JAM_CHANCE
 		if roll > chance: return False
 		
@@ -7837,7 +8640,7 @@ class Weapon:
 			break
 		if not crewman_found: return False
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		if roll > WEAPON_UNJAM_CHANCE: return False
 		
 		self.jammed = False
@@ -7853,7 +8656,7 @@ class Weapon:
 		if self.GetStat('unreliable') is not None:
 			chance = 1.0
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		if roll > chance: return False
 		
 		self.broken = True
@@ -8210,30 +9013,24 @@ class AI:
 		
 		# check for enemy being recalled because campaign day is over
 		if campaign_day.ended and not self.recall and self.owner.owning_player == 1:
-			if GetPercentileRoll() <= 25.0:
+			if GetPercentileRoll('combat') <= 25.0:
 				self.recall = True
 		
 		# if recalled, chance that unit simply disappears
 		if self.recall:
-			if GetPercentileRoll() <= 10.0:
+			if GetPercentileRoll('combat') <= 10.0:
 				ShowMessage(self.owner.GetName() + ' withdraws from the battlefield.', scenario_highlight=(self.owner.hx, self.owner.hy))
 				self.owner.DestroyMe(no_vp=True)
 				return
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		
 		if DEBUG:
 			if session.debug['AI Hates Player']:
 				roll = 0.0
 		
 		# check for LoS on enemy units
-		has_los_to_enemy = False
-		for unit in scenario.units:
-			if not unit.alive: continue
-			if unit.owning_player == self.owner.owning_player: continue
-			if not self.owner.los_table[unit]: continue
-			has_los_to_enemy = True
-			break
+		has_los_to_enemy = scenario.los_table.AnyEnemyInLoS(self.owner)
 		
 		# check for player crew vulnerability
 		player_crew_vulnerable = False
@@ -8328,12 +9125,12 @@ class AI:
 		# recalled units much more likely to move
 		if self.recall and self.owner.GetStat('category') != 'Gun':
 			if self.disposition != 'Movement':
-				if GetPercentileRoll() <= 80.0:
+				if GetPercentileRoll('combat') <= 80.0:
 					self.disposition = 'Movement'
 		
 		# if ambush is in progress, much more likely to attack
 		if scenario.ambush:
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			if roll <= 50.0:
 				self.disposition = 'Combat'
 			elif roll <= 65.0:
@@ -8350,7 +9147,7 @@ class AI:
 
 		# want to attack player but no LoS to player
 		if self.disposition in ['Attack Player', 'Harass Player']:
-			if not self.owner.los_table[scenario.player_unit]:
+			if not scenario.los_table.HasLoS(self.owner, scenario.player_unit):
 				self.disposition = 'Combat'
 		
 		# need to reposition if no LoS to enemy units at all
@@ -8359,15 +9156,15 @@ class AI:
 		
 		# MG teams less likely to move or reposition
 		if self.owner.GetStat('class') == 'MG Team' and  self.disposition in ['Movement', 'Reposition']:
-			if GetPercentileRoll() <= 80.0:
+			if GetPercentileRoll('combat') <= 80.0:
 				self.disposition = 'Combat'
 		
 		# dug-in and entrenched units much less likely to move or reposition
 		if self.owner.dug_in and self.disposition in ['Movement', 'Reposition']:
-			if GetPercentileRoll() <= 80.0:
+			if GetPercentileRoll('combat') <= 80.0:
 				self.disposition = 'Combat'
 		if self.owner.entrenched and self.disposition in ['Movement', 'Reposition']:
-			if GetPercentileRoll() <= 97.0:
+			if GetPercentileRoll('combat') <= 97.0:
 				self.disposition = 'Combat'
 		# fortified units won't move or reposition
 		if self.owner.fortified and self.disposition in ['Movement', 'Reposition']:
@@ -8375,7 +9172,7 @@ class AI:
 		
 		# unit has been routed
 		if self.owner.routed:
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			if roll <= 50.0:
 				self.disposition = 'None'
 			else:
@@ -8449,13 +9246,13 @@ class AI:
 				else:
 					
 					if dist == 4:
-						if GetPercentileRoll() <= 75.0:
+						if GetPercentileRoll('combat') <= 75.0:
 							hex_list.remove((hx, hy))
 							continue
 					
 					# otherwise, if range would change, smaller chance that this hex gets thrown out
 					elif dist != current_range:
-						if GetPercentileRoll() <= 40.0:
+						if GetPercentileRoll('combat') <= 40.0:
 							hex_list.remove((hx, hy))
 							continue
 			
@@ -8463,7 +9260,7 @@ class AI:
 			if len(hex_list) == 0:
 				return
 			
-			(hx, hy) = choice(hex_list)
+			(hx, hy) = GetRNG('combat').choice(hex_list)
 			
 			# if destination is off-map, remove from game
 			if (hx, hy) not in scenario.hex_dict:
@@ -8485,7 +9282,8 @@ class AI:
 			
 			# do movement roll
 			chance = self.owner.forward_move_chance + self.owner.forward_move_bonus
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
+			TraceEvent('move', unit=self.owner, destination=[hx, hy], chance=chance, roll=roll)
 			
 			# move was successful
 			if roll <= chance:
@@ -8526,7 +9324,7 @@ class AI:
 		# transports attempt to unload passengers
 		elif self.disposition == 'Unload Passengers':
 			
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			if roll > 80.0:
 				return
 			
@@ -8597,9 +9395,8 @@ class AI:
 				if weapon.GetStat('type') == 'Gun':
 					ammo_list = weapon.stats['ammo_type_list']
 					for ammo_type in ammo_list:
-						
-						weapon.ammo_type = ammo_type
-						result = scenario.CheckAttack(self.owner, weapon, target, ignore_facing=True)
+						result = scenario.CheckAttack(self.owner, weapon, target,
+							ignore_facing=True, ammo_type=ammo_type)
 						# attack not possible
 						if result != '':
 							continue
@@ -8610,7 +9407,6 @@ class AI:
 				if result != '':
 					continue
 				attack_list.append((weapon, target, ''))
-				libtcod.console_flush()
 		
 		# no possible attacks
 		if len(attack_list) == 0:
@@ -8644,19 +9440,17 @@ class AI:
 			if pivot_req and self.owner in scenario.player_unit.squad:
 				continue
 			
-			# set ammo type if required
-			if ammo_type != '':
-				weapon.ammo_type = ammo_type
-			
 			# calculate odds of attack, taking into account if the attack
 			# would require a pivot or turret rotation
-			profile = scenario.CalcAttack(self.owner, weapon, target,
-				pivot=pivot_req, turret_rotate=turret_rotate_req)
+			if ammo_type == '':
+				score = scenario.CalcAttackChance(self.owner, weapon, target,
+					pivot=pivot_req, turret_rotate=turret_rotate_req)
+			else:
+				score = scenario.CalcAttackChance(self.owner, weapon, target,
+					pivot=pivot_req, turret_rotate=turret_rotate_req, ammo_type=ammo_type)
 			
 			# attack not possible
-			if profile is None: continue
-			
-			score = profile['final_chance']
+			if score is None: continue
 			
 			# apply score modifiers
 			
@@ -8701,8 +9495,6 @@ class AI:
 			
 			# add to list
 			scored_list.append((score, weapon, target, ammo_type))
-
-			libtcod.console_flush()
 		
 		# no possible attacks
 		if len(scored_list) == 0:
@@ -8734,7 +9526,7 @@ class AI:
 		# proceed with best attack
 		
 		# set ammo type if any
-		if ammo_type != '': weapon.current_ammo = ammo_type
+		if ammo_type != '': weapon.ammo_type = ammo_type
 		
 		# pivot or rotate turret if required
 		mount = weapon.GetStat('mount')
@@ -8815,14 +9607,12 @@ class Unit:
 		
 		self.positions_list = []		# list of crew/personnel positions
 		
-		# load unit stats from JSON file
-		with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
-			unit_types = json.load(data_file)
-		if unit_id not in unit_types:
+		# load unit stats from unit type registry
+		if not unit_type_registry.Exists(unit_id):
 			print('ERROR: Could not find unit id: ' + unit_id)
 			self.unit_id = None
 			return
-		self.stats = unit_types[unit_id].copy()
+		self.stats = TypeStats(unit_id)
 		
 		if 'nick_name' in self.stats:
 			self.nick_name = self.stats['nick_name']
@@ -8834,7 +9624,7 @@ class Unit:
 		# roll for HVSS if any
 		if 'HVSS' in self.stats:
 			chance = float(self.stats['HVSS'])
-			if GetPercentileRoll() <= chance:
+			if GetPercentileRoll('spawning') <= chance:
 				self.stats['HVSS'] = True
 			else:
 				del self.stats['HVSS']
@@ -8842,9 +9632,8 @@ class Unit:
 		# set up weapons
 		self.weapon_list = []			# list of unit weapons
 		if 'weapon_list' in self.stats:
-			weapon_list = self.stats['weapon_list']
-			for weapon_dict in weapon_list:
-				self.weapon_list.append(Weapon(self, weapon_dict))
+			for i in range(len(self.stats['weapon_list'])):
+				self.weapon_list.append(Weapon(self, TypeStats(unit_id, weapon_index=i)))
 			
 			# clear this stat since we don't need it any more
 			self.stats['weapon_list'] = None
@@ -8857,6 +9646,12 @@ class Unit:
 		self.ResetMe()
 	
 	
+	# give any attributes added since this was saved their default values
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+	
+	
 	# set/reset all scenario statuses for this unit
 	def ResetMe(self):
 		
@@ -8869,7 +9664,7 @@ class Unit:
 		self.dest_hex = None			# destination hex for move
 		self.animation_cells = []		# list of x,y unit console locations for animation
 		
-		self.los_table = {}			# other units to which this one has line of sight
+		self.los_slot = None			# slot in the scenario line of sight table
 		self.spotted = False			# unit has been spotted by opposing side
 		self.smoke = 0				# unit smoke level
 		
@@ -8914,7 +9709,7 @@ class Unit:
 		if not skip_smoke:
 		
 			if self.smoke > 0:
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 				
 				if self.moving:
 					roll -= 5.0
@@ -8968,9 +9763,7 @@ class Unit:
 	
 	# check for the value of a stat, return None if stat not present
 	def GetStat(self, stat_name):
-		if stat_name not in self.stats:
-			return None
-		return self.stats[stat_name]
+		return self.stats.get(stat_name)
 	
 	
 	# clear all ammo loads for all guns in this unit
@@ -8995,7 +9788,7 @@ class Unit:
 			return False
 		chance += 10.0
 		
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			return True
 		return False
 
@@ -9019,7 +9812,7 @@ class Unit:
 				chance = 3.0
 		
 		# do roll and apply result
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			self.dug_in = True
 			return True
 		return False
@@ -9041,7 +9834,7 @@ class Unit:
 			chance = chance * 1.5 
 		chance = round(chance, 1)
 		
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			self.bogged = True
 	
 	
@@ -9049,7 +9842,7 @@ class Unit:
 	def DoUnbogCheck(self):
 		if not self.bogged: return
 		self.moving = True
-		if GetPercentileRoll() > self.bog_chance:
+		if GetPercentileRoll('combat') > self.bog_chance:
 			self.bogged = False
 			return True
 		return False
@@ -9063,7 +9856,7 @@ class Unit:
 			chance = 3.0
 		else:
 			chance = 0.8
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			return True
 		return False
 	
@@ -9071,7 +9864,7 @@ class Unit:
 	# set a random smoke level for this unit, upon spawn or after move
 	def SetSmokeLevel(self):
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		
 		# account for effects of rain
 		if campaign_day.weather['Precipitation'] == 'Rain':
@@ -9336,7 +10129,7 @@ class Unit:
 		
 		chance = RestrictChance(chance)
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		
 		# check for debug flag
 		if self == scenario.player_unit and DEBUG:
@@ -9348,7 +10141,7 @@ class Unit:
 		if driver_attempt:
 			direction = self.facing
 		else:
-			direction = choice(range(6))
+			direction = GetRNG('combat').choice(range(6))
 		self.hull_down = [direction]
 		self.hull_down.append(ConstrainDir(direction + 1))
 		self.hull_down.append(ConstrainDir(direction - 1))
@@ -9374,7 +10167,7 @@ class Unit:
 			return
 		
 		# create a local list of crew positions in a random order
-		position_list = sample(self.positions_list, len(self.positions_list))
+		position_list = GetRNG('combat').sample(self.positions_list, len(self.positions_list))
 		
 		for position in position_list:
 			
@@ -9389,16 +10182,19 @@ class Unit:
 				if not unit.alive: continue
 				if unit.spotted: continue
 				if (unit.hx, unit.hy) not in position.visible_hexes: continue
-				if not self.los_table[unit]: continue
+				if not scenario.los_table.HasLoS(self, unit): continue
 				spot_list.append(unit)
 			
 			# no units possible to spot from this position
 			if len(spot_list) == 0: continue
 			
 			# select a random target unit and attempt to reveal it
-			unit = choice(spot_list)
+			unit = GetRNG('combat').choice(spot_list)
 			chance = scenario.CalcSpotChance(self, unit, crewman=position.crewman)
-			if GetPercentileRoll() > chance: continue
+			roll = GetPercentileRoll('combat')
+			TraceEvent('spot', unit=self, target=unit, position=position.name, chance=chance,
+				roll=roll)
+			if roll > chance: continue
 			
 			unit.SpotMe()
 			scenario.UpdateUnitCon()
@@ -9443,6 +10239,8 @@ class Unit:
 		self.GenerateTerrain()
 		self.CheckForHD()
 		self.SetSmokeLevel()
+		
+		TraceEvent('spawn', unit=self, terrain=self.terrain)
 	
 	
 	# randomly determine what kind of terrain this unit is in
@@ -9453,9 +10251,9 @@ class Unit:
 		
 		if scenario is None: return
 		
-		self.terrain_seed = libtcod.random_get_int(0, 1, 128)
+		self.terrain_seed = GetRNG('map').randint(1, 128)
 		odds_dict = SCENARIO_TERRAIN_ODDS[scenario.cd_map_hex.terrain_type]
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('map')
 		for terrain, odds in odds_dict.items():
 			if roll <= odds:
 				self.terrain = terrain
@@ -9490,6 +10288,7 @@ class Unit:
 		scenario.hex_dict[(self.hx, self.hy)].unit_stack.remove(self)
 		# remove from scenario unit list
 		scenario.units.remove(self)
+		scenario.los_table.RemoveUnit(self)
 	
 	
 	# return the display character to use on the map viewport
@@ -9633,8 +10432,8 @@ class Unit:
 		# determine foreground color to use
 		if self.owning_player == 1:
 			col = ENEMY_UNIT_COL
-			if self in scenario.player_unit.los_table:
-				if not scenario.player_unit.los_table[self]:
+			if scenario.los_table.Tracks(scenario.player_unit) and scenario.los_table.Tracks(self):
+				if not scenario.los_table.HasLoS(scenario.player_unit, self):
 					col = libtcod.grey
 				
 		else:	
@@ -9731,7 +10530,7 @@ class Unit:
 		# draw portrait if any
 		portrait = self.GetStat('portrait')
 		if portrait is not None:
-			libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, console, x, y+2)
+			libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, console, x, y+2)
 		
 		# display name if any overtop portrait
 		if self.unit_name != '':
@@ -10070,7 +10869,7 @@ class Unit:
 					if libtcod.console_is_window_closed(): sys.exit()
 					CheckForAnimationUpdate()
 					libtcod.console_flush()
-					if not GetInputEvent(): continue
+					if not GetInputEvent('Attack'): continue
 					
 					key_char = DeKey(chr(key.c).lower())
 					
@@ -10152,7 +10951,7 @@ class Unit:
 						if target.fortified:
 							
 							# possible that fortifications are destroyed by impact
-							roll = GetPercentileRoll()
+							roll = GetPercentileRoll('combat')
 							if roll <= float(effective_fp):
 								target.fortified = False
 								target.terrain = 'Rubble'
@@ -10272,7 +11071,7 @@ class Unit:
 						break
 				
 				if had_acquired_target:
-					roll = GetPercentileRoll()
+					roll = GetPercentileRoll('combat')
 					if roll > profile['final_chance'] * 1.75:
 						for weapon in self.weapon_list:
 							weapon.acquired_target = None
@@ -10301,7 +11100,7 @@ class Unit:
 					# apply roll penalty based on how much original roll failed by
 					difference = profile['roll'] - profile['final_chance']
 					
-					roll = GetPercentileRoll() + difference
+					roll = GetPercentileRoll('combat') + difference
 					
 					if DEBUG:
 						if session.debug['Player Always Penetrated']:
@@ -10406,11 +11205,11 @@ class Unit:
 			'on ' + self.GetName())
 		
 		if not self.spotted and self.owning_player == 1:
-			libtcod.console_blit(LoadXP('unit_unknown.xp'), 0, 0, 0, 0, window_con, 1, 3)
+			libtcod.console_blit(LoadXP('unit_unknown.xp', shared=True), 0, 0, 0, 0, window_con, 1, 3)
 		else:
 			portrait = self.GetStat('portrait')
 			if portrait is not None:
-				libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, window_con, 1, 3)
+				libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, window_con, 1, 3)
 		
 		# list of possible outcomes
 		libtcod.console_print_ex(window_con, 13, 12, libtcod.BKGND_NONE, libtcod.CENTER,
@@ -10520,7 +11319,7 @@ class Unit:
 			Wait(300 + (40 * config['ArmCom2'].getint('message_pause')), allow_skip=True, ignore_animations=True)
 			
 			# do roll
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			
 			if roll <= destroy_odds:
 				text = 'Destroyed'
@@ -10596,7 +11395,7 @@ class Unit:
 		
 		chance = RestrictChance(chance)
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		if roll <= chance:
 			return True
 		return False
@@ -10625,7 +11424,7 @@ class Unit:
 		
 		chance = RestrictChance(chance)
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		if roll <= chance:
 			self.PinMe()
 	
@@ -10684,6 +11483,7 @@ class Unit:
 		# remove from scenario unit list
 		if self in scenario.units:
 			scenario.units.remove(self)
+		scenario.los_table.RemoveUnit(self)
 		
 		# squad member was destroyed, remove from list
 		if self in scenario.player_unit.squad:
@@ -10770,6 +11570,47 @@ class Unit:
 
 
 
+# Hex Geometry: precalculated distances, lines and directions between every pair of hexes on the
+# scenario map, as well as hex rings, rotations, and covered hextants around each hex
+# the scenario map is a disc of hexes of the given radius around 0,0; the general hex functions
+# look up these tables first and only calculate a result for hexes off the scenario map
+class HexGeometry:
+	def __init__(self, radius):
+		
+		self.hex_list = []			# every hex on the scenario map
+		for r in range(radius+1):
+			self.hex_list += CalcHexRing(0, 0, r)
+		
+		self.distances = {}			# keyed by hx1, hy1, hx2, hy2
+		self.lines = {}				# "
+		self.directions = {}			# "
+		for (hx1, hy1) in self.hex_list:
+			for (hx2, hy2) in self.hex_list:
+				key = (hx1, hy1, hx2, hy2)
+				self.distances[key] = CalcHexDistance(hx1, hy1, hx2, hy2)
+				
+				# no line or direction to the same hex
+				if hx1 == hx2 and hy1 == hy2: continue
+				
+				self.lines[key] = tuple(CalcHexLine(hx1, hy1, hx2, hy2))
+				
+				# use hex map console locations as in Scenario.PlotHex()
+				(x1, y1) = (hx1*7, (hy1*6) + (hx1*3))
+				(x2, y2) = (hx2*7, (hy2*6) + (hx2*3))
+				self.directions[key] = GetDirectionForBearing(GetBearing(x1, y1, x2, y2))
+		
+		self.rings = {}				# keyed by hx, hy, radius
+		self.rotations = {}			# keyed by hx, hy, number of rotations
+		self.covered_hexes = {}			# keyed by hx, hy, direction
+		for (hx, hy) in self.hex_list:
+			for r in range(radius+1):
+				self.rings[(hx, hy, r)] = tuple(CalcHexRing(hx, hy, r))
+			for d in range(6):
+				self.rotations[(hx, hy, d)] = CalcRotateHex(hx, hy, d)
+				self.covered_hexes[(hx, hy, d)] = tuple(CalcCoveredHexes(hx, hy, d))
+
+
+
 # MapHex: a single hex on the scenario map
 class MapHex:
 	def __init__(self, hx, hy):
@@ -10779,6 +11620,237 @@ class MapHex:
 
 
 
+# LoS Table: line of sight matrix for all units in a scenario
+# each unit is given a stable slot, and each row of the matrix is stored as a bitmask of the
+# slots to which that unit has LoS; freed slots are reused by later reinforcements
+class LoSTable:
+	def __init__(self):
+		self.units = []				# unit occupying each slot, None if slot is free
+		self.rows = []				# LoS bitmask for each slot
+		self.free_slots = []			# slots freed by units that have left play
+		self.side_masks = {}			# bitmask of occupied slots, keyed by owning player
+	
+	
+	# store rows as packed bytes of a fixed width rather than as a list of integers
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		width = (len(self.rows) + 7) // 8
+		state['rows'] = (width, b''.join(row.to_bytes(width, 'little') for row in self.rows))
+		return state
+	
+	
+	def __setstate__(self, state):
+		(width, data) = state['rows']
+		state['rows'] = [int.from_bytes(data[i:i+width], 'little') for i in range(0, len(data), width)]
+		self.__dict__.update(state)
+	
+	
+	# return the slot for this unit, or None if it is not in the table
+	def GetSlot(self, unit):
+		slot = unit.los_slot
+		if slot is None or slot >= len(self.units): return None
+		if self.units[slot] is not unit: return None
+		return slot
+	
+	
+	# return True if this unit has a slot in the table
+	def Tracks(self, unit):
+		return self.GetSlot(unit) is not None
+	
+	
+	# give a unit a slot in the table, with LoS only to itself; returns the slot
+	def AddUnit(self, unit):
+		slot = self.GetSlot(unit)
+		if slot is not None: return slot
+		
+		if len(self.free_slots) > 0:
+			slot = self.free_slots.pop()
+			self.units[slot] = unit
+		else:
+			slot = len(self.units)
+			self.units.append(unit)
+			self.rows.append(0)
+		
+		unit.los_slot = slot
+		self.rows[slot] = 1 << slot
+		self.side_masks[unit.owning_player] = self.side_masks.get(unit.owning_player, 0) | (1 << slot)
+		return slot
+	
+	
+	# remove a unit from the table and clear its row and column
+	def RemoveUnit(self, unit):
+		slot = self.GetSlot(unit)
+		if slot is None: return
+		
+		bit = 1 << slot
+		row = self.rows[slot] & ~bit
+		while row:
+			other_bit = row & -row
+			self.rows[other_bit.bit_length() - 1] &= ~bit
+			row ^= other_bit
+		
+		self.rows[slot] = 0
+		self.side_masks[unit.owning_player] &= ~bit
+		self.units[slot] = None
+		self.free_slots.append(slot)
+		unit.los_slot = None
+	
+	
+	# set or clear LoS between two units, in both directions
+	def SetLoS(self, unit1, unit2, los):
+		slot1 = self.AddUnit(unit1)
+		slot2 = self.AddUnit(unit2)
+		if los:
+			self.rows[slot1] |= 1 << slot2
+			self.rows[slot2] |= 1 << slot1
+		else:
+			self.rows[slot1] &= ~(1 << slot2)
+			self.rows[slot2] &= ~(1 << slot1)
+	
+	
+	# replace the row and column for a unit: it will have LoS to itself and to the units in
+	# the given list only
+	def SetUnitLoS(self, unit, unit_list):
+		slot = self.AddUnit(unit)
+		bit = 1 << slot
+		
+		row = bit
+		for unit2 in unit_list:
+			row |= 1 << self.AddUnit(unit2)
+		
+		# update the column in every row that has changed
+		changed = (self.rows[slot] ^ row) & ~bit
+		self.rows[slot] = row
+		while changed:
+			other_bit = changed & -changed
+			self.rows[other_bit.bit_length() - 1] ^= bit
+			changed ^= other_bit
+	
+	
+	# return True if unit1 has LoS to unit2
+	def HasLoS(self, unit1, unit2):
+		slot1 = self.GetSlot(unit1)
+		slot2 = self.GetSlot(unit2)
+		if slot1 is None or slot2 is None: return False
+		return bool(self.rows[slot1] & (1 << slot2))
+	
+	
+	# return True if this unit has LoS to any unit on an opposing side
+	def AnyEnemyInLoS(self, unit):
+		slot = self.GetSlot(unit)
+		if slot is None: return False
+		row = self.rows[slot]
+		for (owning_player, mask) in self.side_masks.items():
+			if owning_player == unit.owning_player: continue
+			if row & mask: return True
+		return False
+
+
+
+# Layer Compositor: builds a screen from a stack of layer consoles, keeping track of which
+# areas of the screen have changed so that only those are redrawn
+class LayerCompositor:
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.console = NewConsole(width, height, libtcod.black, libtcod.white)
+		self.layer_list = []		# layers in the order they are drawn
+		self.layers = {}		# layers by console name
+		self.dirty_rects = []		# screen areas to be redrawn: x, y, w, h
+		self.drawn_rects = {}		# areas last drawn to by layers that track their own changes
+	
+	
+	# add a new layer on top of any existing ones, at screen location x, y and with size w, h
+	def AddLayer(self, name, console, x, y, w, h, fg_alpha=1.0, bg_alpha=1.0, always_dirty=False):
+		layer = {
+			'console' : console,
+			'rect' : (x, y, w, h),
+			'fg_alpha' : fg_alpha,
+			'bg_alpha' : bg_alpha,
+			'visible' : True,
+			'always_dirty' : always_dirty
+		}
+		self.layer_list.append(layer)
+		self.layers[name] = layer
+		self.dirty_rects = [(0, 0, self.width, self.height)]
+	
+	
+	# show or hide a layer, marks its area as needing to be redrawn if this has changed
+	def SetVisible(self, name, visible):
+		layer = self.layers[name]
+		if layer['visible'] == visible: return
+		layer['visible'] = visible
+		self.AddDirtyRect(layer['rect'])
+	
+	
+	# mark an area of a layer as needing to be redrawn; defaults to the entire layer
+	def MarkDirty(self, name, x=0, y=0, w=None, h=None):
+		(lx, ly, lw, lh) = self.layers[name]['rect']
+		if w is None: w = lw - x
+		if h is None: h = lh - y
+		self.AddDirtyRect((lx + x, ly + y, w, h))
+	
+	
+	# record the areas of a layer that have just been drawn to; they and any areas that were
+	# drawn to last time are marked as needing to be redrawn
+	def MarkDrawn(self, name, rect_list):
+		for (x, y, w, h) in self.drawn_rects.get(name, []) + rect_list:
+			self.MarkDirty(name, x, y, w, h)
+		self.drawn_rects[name] = rect_list
+	
+	
+	# add an area of the screen to the list to be redrawn, clipped to the screen
+	# if there are too many areas, merge them all into one
+	def AddDirtyRect(self, rect):
+		(x, y, w, h) = rect
+		x1 = max(x, 0)
+		y1 = max(y, 0)
+		x2 = min(x + w, self.width)
+		y2 = min(y + h, self.height)
+		if x2 <= x1 or y2 <= y1: return
+		
+		# already covered by an existing area
+		for (dx, dy, dw, dh) in self.dirty_rects:
+			if dx <= x1 and dy <= y1 and dx + dw >= x2 and dy + dh >= y2:
+				return
+		
+		self.dirty_rects.append((x1, y1, x2 - x1, y2 - y1))
+		if len(self.dirty_rects) <= MAX_DIRTY_RECTS: return
+		
+		x1 = min([dx for (dx, dy, dw, dh) in self.dirty_rects])
+		y1 = min([dy for (dx, dy, dw, dh) in self.dirty_rects])
+		x2 = max([dx + dw for (dx, dy, dw, dh) in self.dirty_rects])
+		y2 = max([dy + dh for (dx, dy, dw, dh) in self.dirty_rects])
+		self.dirty_rects = [(x1, y1, x2 - x1, y2 - y1)]
+	
+	
+	# redraw all the areas of the screen that have changed
+	def Composite(self):
+		
+		for layer in self.layer_list:
+			if layer['always_dirty'] and layer['visible']:
+				self.AddDirtyRect(layer['rect'])
+		
+		for (x, y, w, h) in self.dirty_rects:
+			libtcod.console_rect(self.console, x, y, w, h, True)
+			for layer in self.layer_list:
+				if not layer['visible']: continue
+				
+				# find the part of this layer within the area, if any
+				(lx, ly, lw, lh) = layer['rect']
+				x1 = max(x, lx)
+				y1 = max(y, ly)
+				x2 = min(x + w, lx + lw)
+				y2 = min(y + h, ly + lh)
+				if x2 <= x1 or y2 <= y1: continue
+				
+				libtcod.console_blit(layer['console'], x1 - lx, y1 - ly, x2 - x1, y2 - y1,
+					self.console, x1, y1, layer['fg_alpha'], layer['bg_alpha'])
+		
+		self.dirty_rects = []
+
+
+
 # Scenario: represents a single battle encounter
 class Scenario:
 	def __init__(self, cd_map_hex):
@@ -10791,27 +11863,7 @@ class Scenario:
 		self.class_type_dict = {}			# dictionary of unit types for each class; once set, further units will be of the same type
 		
 		# animation object; keeps track of active animations on the animation console
-		self.animation = {
-			'rain_active' : False,
-			'rain_drops' : [],
-			'snow_active' : False,
-			'snowflakes' : [],
-			'gun_fire_active' : False,
-			'gun_fire_line' : [],
-			'small_arms_fire_action' : False,
-			'small_arms_fire_line' : [],
-			'small_arms_lifetime' : 0,
-			'air_attack' : None,
-			'air_attack_line' : [],
-			'bomb_effect' : None,
-			'bomb_effect_lifetime' : 0,
-			'grenade_effect' : None,
-			'grenade_effect_lifetime' : 0,
-			'ft_effect' : None,
-			'ft_effect_lifetime' : 0,
-			'hex_highlight' : False,
-			'hex_flash' : 0
-		}
+		self.ResetAnimation()
 		
 		# current odds of a random event being triggered
 		self.random_event_chance = BASE_RANDOM_EVENT_CHANCE
@@ -10837,6 +11889,7 @@ class Scenario:
 		self.attack_con_active = False
 		
 		self.units = []						# list of units in play
+		self.los_table = LoSTable()				# line of sight between units in play
 		
 		# turn and phase information
 		self.current_turn = 1					# current scenario turn
@@ -10854,32 +11907,86 @@ class Scenario:
 		self.selected_position = 0				# index of selected position in player unit
 	
 	
-	# return the chance for unit1 to spot unit2
-	def CalcSpotChance(self, unit1, unit2, crewman=None):
-		
-		distance = GetHexDistance(unit1.hx, unit1.hy, unit2.hx, unit2.hy)	
-		chance = SPOT_BASE_CHANCE[distance]
-		
-		# target size
-		size_class = unit2.GetStat('size_class')
-		if size_class is not None:
-			if size_class == 'Small':
-				chance -= 7.0
-			elif size_class == 'Very Small':
-				chance -= 18.0
-			elif size_class == 'Large':
-				chance += 7.0
-			elif size_class == 'Very Large':
-				chance += 18.0
-		
-		# precipitation
-		if campaign_day.weather['Precipitation'] in ['Rain', 'Snow']:
-			chance -= 5.0 * float(distance)
-		elif campaign_day.weather['Precipitation'] in ['Heavy Rain', 'Blizzard']:
-			chance -= 10.0 * float(distance)
-		
-		# smoke concealment
-		smoke = unit1.smoke + unit2.smoke
+	# animation state and console cell index are not saved, and are rebuilt on load
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['animation']
+		del state['hex_map_index']
+		return state
+	
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		SetSavedDefaults(self)
+		self.ResetAnimation()
+		self.hex_map_index = {}
+		self.BuildHexmapDict()
+	
+	
+	# build a LoS table from the LoS that each unit kept for itself in games saved before the
+	# table was added
+	def BuildSavedLoSTable(self):
+		los_table = LoSTable()
+		for unit in self.units:
+			los_table.AddUnit(unit)
+		for unit1 in self.units:
+			for (unit2, los) in unit1.__dict__.pop('los_table', {}).items():
+				if los and los_table.Tracks(unit2):
+					los_table.SetLoS(unit1, unit2, True)
+		return los_table
+	
+	
+	# clear all active animations
+	def ResetAnimation(self):
+		self.animation = {
+			'rain_active' : False,
+			'rain_drops' : [],
+			'snow_active' : False,
+			'snowflakes' : [],
+			'gun_fire_active' : False,
+			'gun_fire_line' : [],
+			'small_arms_fire_action' : False,
+			'small_arms_fire_line' : [],
+			'small_arms_lifetime' : 0,
+			'air_attack' : None,
+			'air_attack_line' : [],
+			'bomb_effect' : None,
+			'bomb_effect_lifetime' : 0,
+			'grenade_effect' : None,
+			'grenade_effect_lifetime' : 0,
+			'ft_effect' : None,
+			'ft_effect_lifetime' : 0,
+			'hex_highlight' : False,
+			'hex_flash' : 0
+		}
+	
+	
+	# return the chance for unit1 to spot unit2
+	def CalcSpotChance(self, unit1, unit2, crewman=None):
+		
+		distance = GetHexDistance(unit1.hx, unit1.hy, unit2.hx, unit2.hy)	
+		chance = SPOT_BASE_CHANCE[distance]
+		
+		# target size
+		size_class = unit2.GetStat('size_class')
+		if size_class is not None:
+			if size_class == 'Small':
+				chance -= 7.0
+			elif size_class == 'Very Small':
+				chance -= 18.0
+			elif size_class == 'Large':
+				chance += 7.0
+			elif size_class == 'Very Large':
+				chance += 18.0
+		
+		# precipitation
+		if campaign_day.weather['Precipitation'] in ['Rain', 'Snow']:
+			chance -= 5.0 * float(distance)
+		elif campaign_day.weather['Precipitation'] in ['Heavy Rain', 'Blizzard']:
+			chance -= 10.0 * float(distance)
+		
+		# smoke concealment
+		smoke = unit1.smoke + unit2.smoke
 		if smoke == 1:
 			chance = chance * 0.75
 		elif smoke == 2:
@@ -10940,8 +12047,7 @@ class Scenario:
 				if unit2.owning_player == owning_player: continue
 				if not unit2.alive: continue
 				if unit2.spotted: continue
-				#if unit2 not in unit1.los_table: continue
-				if not unit1.los_table[unit2]: continue
+				if not self.los_table.HasLoS(unit1, unit2): continue
 				spot_list.append(unit2)
 			
 			# no units possible to spot
@@ -10951,7 +12057,9 @@ class Scenario:
 			for unit2 in spot_list:
 				chance = scenario.CalcSpotChance(unit1, unit2)
 				if chance <= 0.0: continue
-				if GetPercentileRoll() <= chance:
+				roll = GetPercentileRoll('combat')
+				TraceEvent('spot', unit=unit1, target=unit2, chance=chance, roll=roll)
+				if roll <= chance:
 					unit2.SpotMe()
 					scenario.UpdateUnitCon()
 					scenario.UpdateScenarioDisplay()
@@ -11003,7 +12111,7 @@ class Scenario:
 			terrain_mod -= SCENARIO_TERRAIN_EFFECTS[unit2.terrain]['los_mod']
 		
 		chance += terrain_mod
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			return True
 		return False
 	
@@ -11011,69 +12119,45 @@ class Scenario:
 	# do the initial line of sight checks between all units
 	def GenerateLoS(self):
 		
-		def AddLoS(unit1, unit2):
-			unit1.los_table[unit2] = True
-			unit2.los_table[unit1] = True
-		
-		# clear all LoS tables
+		# clear the LoS table and give each unit a slot
+		self.los_table = LoSTable()
 		for unit in self.units:
-			unit.los_table = {}
+			self.los_table.AddUnit(unit)
 		
-		# check each unit against every other
-		for unit1 in self.units:
-			for unit2 in self.units:
-				
-				# already added in opposite direction
-				if unit1 in unit2.los_table: continue
-				
-				# same unit
-				if unit1 == unit2:
-					AddLoS(unit1, unit2)
-					continue
+		# check each unit against every unit after it in the list
+		for i, unit1 in enumerate(self.units):
+			for unit2 in self.units[i+1:]:
 				
 				# same side and same hex
 				if unit1.owning_player == unit2.owning_player and unit1.hx == unit2.hx and unit1.hy == unit2.hy:
-					AddLoS(unit1, unit2)
+					self.los_table.SetLoS(unit1, unit2, True)
 					continue
 				
 				# roll for LoS between the units
 				if self.DoLoSRoll(unit1, unit2):
-					AddLoS(unit1, unit2)
-					continue
-				
-				unit1.los_table[unit2] = False
-				unit2.los_table[unit1] = False
+					self.los_table.SetLoS(unit1, unit2, True)
 
 
-	# add a newly spawned unit to the existing units' LoS tables
+	# add a newly spawned unit to the LoS table
 	# can also regenerated LoS links between this unit and every other unit
 	def GenerateUnitLoS(self, unit1):
 		
-		def AddLoS(unit1, unit2):
-			unit1.los_table[unit2] = True
-			unit2.los_table[unit1] = True
-		
-		unit1.los_table = {}
-		
+		los_list = []
 		for unit2 in self.units:
 			
 			# same unit
-			if unit1 == unit2:
-				AddLoS(unit1, unit2)
-				continue
+			if unit1 == unit2: continue
 			
 			# same side and same hex
 			if unit1.owning_player == unit2.owning_player and unit1.hx == unit2.hx and unit1.hy == unit2.hy:
-				AddLoS(unit1, unit2)
+				los_list.append(unit2)
 				continue
 			
 			# roll for LoS between the units
 			if self.DoLoSRoll(unit1, unit2):
-				AddLoS(unit1, unit2)
-				continue
-			
-			unit1.los_table[unit2] = False
-			unit2.los_table[unit1] = False
+				los_list.append(unit2)
+		
+		self.los_table.SetUnitLoS(unit1, los_list)
 
 	# roll at start of scenario to see whether player has been ambushed
 	def DoAmbushRoll(self):
@@ -11124,7 +12208,7 @@ class Scenario:
 		if chance < 3.0:
 			chance = 3.0
 		
-		if GetPercentileRoll() <= chance:
+		if GetPercentileRoll('combat') <= chance:
 			self.ambush = True
 	
 	
@@ -11160,14 +12244,14 @@ class Scenario:
 	# check for triggering of a random event in a scenario
 	def CheckForRandomEvent(self):
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		
 		if roll > self.random_event_chance:
 			self.random_event_chance += 1.0
 			return
 		
 		# roll for type of event
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		
 		# friendly air attack
 		if roll <= 10.0:
@@ -11185,7 +12269,7 @@ class Scenario:
 		# enemy reinforcement
 		elif roll <= 30.0:
 			if self.enemy_reinforcements > 0:
-				if GetPercentileRoll() <= (float(self.enemy_reinforcements) * 40.0):
+				if GetPercentileRoll('combat') <= (float(self.enemy_reinforcements) * 40.0):
 					return
 			self.enemy_reinforcements += 1
 			self.SpawnEnemyUnits(reinforcement=True)
@@ -11203,7 +12287,7 @@ class Scenario:
 				if unit.ai.recall: continue
 				unit_list.append(unit)
 			if len(unit_list) == 0: return
-			unit = choice(unit_list)
+			unit = GetRNG('combat').choice(unit_list)
 			unit.ai.recall = True
 			if unit.spotted:
 				ShowMessage(unit.GetName() + ' is being recalled from the battle.',
@@ -11215,7 +12299,7 @@ class Scenario:
 			# check for vulnerable targets and select one if any
 			crew_list = self.player_unit.VulnerableCrew()
 			if len(crew_list) == 0: return
-			crew_target = choice(crew_list)
+			crew_target = GetRNG('combat').choice(crew_list)
 			
 			# do attack roll
 			chance = BASE_SNIPER_TK_CHANCE
@@ -11236,7 +12320,7 @@ class Scenario:
 			if chance < 15.0: return
 			
 			# do attack roll
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			
 			# player hit but saved by fate point
 			if roll <= chance and campaign_day.fate_points > 0 and crew_target.current_position in PLAYER_POSITIONS:
@@ -11275,7 +12359,7 @@ class Scenario:
 			if len(unit_list) == 0:
 				return
 			
-			unit = choice(unit_list)
+			unit = GetRNG('combat').choice(unit_list)
 			unit.ImmobilizeMe()
 			if unit.spotted:
 				ShowMessage(unit.GetName() + ' has been immobilized!',
@@ -11290,7 +12374,7 @@ class Scenario:
 				unit_list.append(unit)
 			if len(unit_list) == 0:
 				return
-			unit = choice(unit_list)
+			unit = GetRNG('combat').choice(unit_list)
 			unit.SpotMe()
 			text = unit.GetName() + ' spotted!'
 			ShowMessage(text, portrait=unit.GetStat('portrait'),
@@ -11347,7 +12431,7 @@ class Scenario:
 			libtcod.console_rect(con, 33, 11, 25, 8, True, libtcod.BKGND_SET)
 			portrait = self.player_unit.GetStat('portrait')
 			if portrait is not None:
-				libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, con, 33, 11)
+				libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, con, 33, 11)
 			libtcod.console_set_default_foreground(con, libtcod.white)
 			if self.player_unit.unit_name != '':
 				libtcod.console_print(con, 33, 11, self.player_unit.unit_name)
@@ -11493,7 +12577,7 @@ class Scenario:
 				if 'Gymnast' in position.crewman.skills:
 					modifier -= position.crewman.GetSkillMod(10.0)
 				
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 				
 				# unmodified 97.0-100.0 always fail, otherwise modifier is applied
 				if roll < 97.0:
@@ -11525,7 +12609,7 @@ class Scenario:
 			if weapon.GetStat('name') == 'Flame Thrower':
 				chance = 90.0
 		
-		roll = GetPercentileRoll()
+		roll = GetPercentileRoll('combat')
 		if DEBUG:
 			if session.debug['Player Crew Safe in Bail Out']:
 				roll = chance + 1.0
@@ -11595,7 +12679,7 @@ class Scenario:
 			
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('PlayerBailOut')
 			if not keypress: continue
 			
 			if key.vk == libtcod.KEY_ENTER:
@@ -11609,22 +12693,18 @@ class Scenario:
 		
 		# if not enemy nation set yet, set it now
 		if self.enemy_nation == None:
-			self.enemy_nation = choice(campaign.current_week['enemy_nations'])
+			self.enemy_nation = GetRNG('spawning').choice(campaign.current_week['enemy_nations'])
 		
 		# pointer to unit type list from campaign object
 		unit_type_list = campaign.stats['enemy_unit_list'][self.enemy_nation]
 		
-		# load unit stats for reference from JSON file
-		with open(DATAPATH + 'unit_type_defs.json', encoding='utf8') as data_file:
-			unit_types = json.load(data_file)
-		
 		# determine initial number of enemy units to spawn: 1-4
 		if reinforcement:
 			num_units = 1
 		else:
 			num_units = 4
 			for i in range(3):
-				if libtcod.random_get_int(0, 0, 10) >= self.cd_map_hex.enemy_strength:
+				if GetRNG('spawning').randint(0, 10) >= self.cd_map_hex.enemy_strength:
 					num_units -= 1
 		
 		enemy_unit_list = []
@@ -11635,8 +12715,8 @@ class Scenario:
 			# choose a random unit class
 			unit_class = None
 			while unit_class is None:
-				k, value = choice(list(campaign.stats['enemy_unit_class_odds'].items()))
-				if GetPercentileRoll() <= float(value):
+				k, value = GetRNG('spawning').choice(list(campaign.stats['enemy_unit_class_odds'].items()))
+				if GetPercentileRoll('spawning') <= float(value):
 					unit_class = k
 			
 			# if class unit type has already been set, use that one instead
@@ -11646,19 +12726,13 @@ class Scenario:
 			else:
 				
 				# choose a random unit type within this class
-				type_list = []
-				for unit_id in unit_type_list:
-					# unrecognized unit id
-					if unit_id not in unit_types: continue
-					# not the right class
-					if unit_types[unit_id]['class'] != unit_class: continue
-					type_list.append(unit_id)
+				type_list = unit_type_registry.GetClassListFrom(unit_type_list, unit_class).copy()
 				
 				# no unit types of the required class found
 				if len(type_list) == 0: continue
 				
 				# select unit type: run through shuffled list and roll against rarity if any
-				shuffle(type_list)
+				GetRNG('spawning').shuffle(type_list)
 				
 				selected_unit_id = None
 				for unit_id in type_list:
@@ -11666,13 +12740,13 @@ class Scenario:
 					if libtcod.console_is_window_closed(): sys.exit()
 				
 					# if no rarity factor given, select automatically
-					if 'rarity' not in unit_types[unit_id]:
+					if 'rarity' not in unit_type_registry.GetStats(unit_id):
 						selected_unit_id = unit_id
 						break
 					
 					# roll against rarity for current date
 					rarity = None
-					for date, chance in unit_types[unit_id]['rarity'].items():
+					for date, chance in unit_type_registry.GetStats(unit_id)['rarity'].items():
 						
 						# select the earliest rarity factor
 						if rarity is None:
@@ -11695,7 +12769,7 @@ class Scenario:
 						continue
 					
 					# roll againt rarity rarting
-					if GetPercentileRoll() <= float(rarity):
+					if GetPercentileRoll('spawning') <= float(rarity):
 						selected_unit_id = unit_id
 						break
 				
@@ -11710,16 +12784,17 @@ class Scenario:
 		for unit_id in enemy_unit_list:
 	
 			# determine spawn location
-			distance = libtcod.random_get_int(0, 1, 3)
+			distance = GetRNG('spawning').randint(1, 3)
 			
 			if distance == 1:
-				if GetPercentileRoll() <= 65.0:
+				if GetPercentileRoll('spawning') <= 65.0:
 					distance += 1
-			if unit_types[unit_id]['category'] == 'Infantry':
-				if GetPercentileRoll() <= 75.0:
+			unit_category = unit_type_registry.GetStats(unit_id)['category']
+			if unit_category == 'Infantry':
+				if GetPercentileRoll('spawning') <= 75.0:
 					distance -= 1
-			elif unit_types[unit_id]['category'] == 'Vehicle':
-				if GetPercentileRoll() <= 60.0:
+			elif unit_category == 'Vehicle':
+				if GetPercentileRoll('spawning') <= 60.0:
 					distance += 1
 			
 			if distance < 1:
@@ -11728,7 +12803,7 @@ class Scenario:
 				distance = 3
 			
 			hex_list = GetHexRing(0, 0, distance)
-			shuffle(hex_list)
+			GetRNG('spawning').shuffle(hex_list)
 			
 			# choose a random hex in which to spawn
 			for (hx, hy) in hex_list:
@@ -11736,7 +12811,7 @@ class Scenario:
 				# if player spotted enemy units first, unlikely that they will spawn behind the player
 				if not self.ambush:
 					if GetDirectionToward(hx, hy, 0, 0) in [5, 0, 1]:
-						if GetPercentileRoll() <= 85.0: continue
+						if GetPercentileRoll('spawning') <= 85.0: continue
 				break
 			
 			# create the unit
@@ -11759,7 +12834,7 @@ class Scenario:
 					direction = GetDirectionToward(unit.hx, unit.hy, 0, 0)
 				else:
 					# random facing
-					direction = libtcod.random_get_int(0, 0, 5)
+					direction = GetRNG('spawning').randint(0, 5)
 				unit.facing = direction
 				if 'turret' in unit.stats:
 					unit.turret_facing = direction
@@ -11776,7 +12851,7 @@ class Scenario:
 					chance2 = 10.0
 					chance3 = 15.0
 				
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('spawning')
 				
 				if roll <= chance1:
 					unit.fortified = True
@@ -11799,11 +12874,11 @@ class Scenario:
 			if unit.GetStat('transport') is not None:
 				
 				# FUTURE: trucks and APCs will have different rolls here
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('spawning')
 				if roll <= 60.0:
-					unit.transport = choice(unit.GetStat('transport'))
+					unit.transport = GetRNG('spawning').choice(unit.GetStat('transport'))
 				else:
-					unit.cargo = choice(['Ammo', 'Food', 'Supplies'])
+					unit.cargo = GetRNG('spawning').choice(['Ammo', 'Food', 'Supplies'])
 			
 			# reinforcements need to be added to the LoS table
 			if reinforcement:
@@ -11817,7 +12892,8 @@ class Scenario:
 	# given a combination of an attacker, weapon, and target, see if this would be a
 	# valid attack; if not, return a text description of why not
 	# if ignore_facing is true, we don't check whether weapon is facing correct direction
-	def CheckAttack(self, attacker, weapon, target, ignore_facing=False):
+	# if ammo_type is set, will check that ammo type rather than the one currently loaded
+	def CheckAttack(self, attacker, weapon, target, ignore_facing=False, ammo_type=None):
 		
 		# check that proper crew command has been set if player is attacking
 		if attacker == self.player_unit:
@@ -11862,7 +12938,7 @@ class Scenario:
 				return 'Cannot initiate Close Combat when Pinned'
 		else:
 			# no LoS
-			if not attacker.los_table[target]:
+			if not scenario.los_table.HasLoS(attacker, target):
 				return 'No Line of Sight to Target'
 		
 		# if we're not ignoring facing,
@@ -11874,20 +12950,22 @@ class Scenario:
 		# check that current ammo is available and this ammo would affect the target
 		if weapon.GetStat('type') == 'Gun':
 			
-			if weapon.ammo_type is None:
+			if ammo_type is None:
+				ammo_type = weapon.ammo_type
+			if ammo_type is None:
 				return 'No ammo loaded'
 			
 			# check that at least one shell of required ammo is available
 			ammo_avail = False
 			if weapon.using_rr:
-				if weapon.ready_rack[weapon.ammo_type] > 0:
+				if weapon.ready_rack[ammo_type] > 0:
 					ammo_avail = True
-			if weapon.ammo_stores[weapon.ammo_type] > 0:
+			if weapon.ammo_stores[ammo_type] > 0:
 				ammo_avail = True
 			if not ammo_avail:
 				return 'No more ammo of the selected type'
 			
-			if weapon.ammo_type == 'AP' and target.GetStat('category') in ['Infantry', 'Gun']:
+			if ammo_type == 'AP' and target.GetStat('category') in ['Infantry', 'Gun']:
 				return 'AP has no effect on target'
 		
 		# check firing group restrictions
@@ -11921,76 +12999,120 @@ class Scenario:
 	
 	# generate a profile for a given attack
 	# if pivot or turret_rotate are set to True, will override actual attacker status
-	def CalcAttack(self, attacker, weapon, target, pivot=False, turret_rotate=False):
+	# if ammo_type is set, will use that ammo type rather than the one currently loaded
+	def CalcAttack(self, attacker, weapon, target, pivot=False, turret_rotate=False, ammo_type=None):
 		
 		profile = {}
 		profile['attacker'] = attacker
 		profile['weapon'] = weapon
-		profile['ammo_type'] = weapon.ammo_type
+		if ammo_type is None:
+			ammo_type = weapon.ammo_type
+		profile['ammo_type'] = ammo_type
 		profile['target'] = target
 		profile['result'] = ''		# placeholder for text rescription of result
-				
+		profile['modifier_list'] = []
+		
+		# calculate the chance of success and fill in the base chance and modifiers
+		final_chance = self.CalcAttackChance(attacker, weapon, target, pivot=pivot,
+			turret_rotate=turret_rotate, ammo_type=ammo_type, profile=profile)
+		if final_chance is None:
+			print('ERROR: Weapon type not recognized: ' + weapon.stats['name'])
+			return None
+		profile['final_chance'] = final_chance
+		
+		# base critical hit chance
+		profile['critical_hit'] = CRITICAL_HIT
+		if profile['type'] == 'Point Fire' and profile['crewman'] is not None:
+			if 'Knows Weak Spots' in profile['crewman'].skills:
+				if weapon.GetStat('type') == 'Gun' and target.GetStat('armour') is not None:
+					profile['critical_hit'] += profile['crewman'].GetSkillMod(2.0)
+		
+		# calculate additional outcomes for Area Fire
+		if profile['type'] == 'Area Fire':
+			profile['effective_fp'] = 0		# placeholder for effective fp
+			total_modifier = 0.0
+			for (desc, mod) in profile['modifier_list']:
+				total_modifier += mod
+			profile['full_effect'] = RestrictChance((profile['base_chance'] + 
+				total_modifier) * FP_FULL_EFFECT)
+			profile['critical_effect'] = RestrictChance((profile['base_chance'] + 
+				total_modifier) * FP_CRIT_EFFECT)
+		
+		return profile
+	
+	
+	# determine crewman operating weapon:
+	# need to find a match between positions that can fire the weapon,
+	# and who is on the correct command
+	def GetAttackCrewman(self, attacker, weapon):
+		position_list = weapon.GetStat('fired_by')
+		if position_list is None:
+			return None
+		weapon_type = weapon.GetStat('type')
+		if weapon_type == 'Gun':
+			command_req = 'Operate Gun'
+		elif weapon_type in MG_WEAPONS:
+			command_req = 'Operate MG'
+		else:
+			return None
+		for position in attacker.positions_list:
+			if position.crewman is None: continue
+			if position.name not in position_list: continue
+			if position.crewman.current_cmd != command_req: continue
+			return position.crewman
+		return None
+	
+	
+	# calculate the final chance of success for a given attack, or None if the weapon type is
+	# not recognized; has no side effects, so can be used to score possible attacks
+	# if a profile is given, the attack type, firing crewman, base chance, and modifier
+	# descriptions are added to it for display
+	def CalcAttackChance(self, attacker, weapon, target, pivot=False, turret_rotate=False,
+		ammo_type=None, profile=None):
+		
+		if ammo_type is None:
+			ammo_type = weapon.ammo_type
+		
 		# determine attack type
 		weapon_type = weapon.GetStat('type')
 		if weapon_type == 'Gun':
-			profile['type'] = 'Point Fire'
+			attack_type = 'Point Fire'
 		elif weapon_type == 'Small Arms' or weapon_type in MG_WEAPONS:
-			profile['type'] = 'Area Fire'
-			profile['effective_fp'] = 0		# placeholder for effective fp
+			attack_type = 'Area Fire'
 		elif weapon_type == 'Close Combat':
-			profile['type'] = 'Close Combat'
+			attack_type = 'Close Combat'
 		else:
-			print('ERROR: Weapon type not recognized: ' + weapon.stats['name'])
 			return None
 		
-		# determine crewman operating weapon:
-		# need to find a match between positions that can fire the weapon,
-		# and who is on the correct command
-		profile['crewman'] = None
-		if weapon.GetStat('fired_by') is not None:
-			
-			if weapon.GetStat('type') == 'Gun':
-				command_req = 'Operate Gun'
-			elif weapon.GetStat('type') in MG_WEAPONS:
-				command_req = 'Operate MG'
-			for position in attacker.positions_list:
-				if position.crewman is None: continue
-				if position.name in weapon.stats['fired_by']:
-					if position.crewman.current_cmd != command_req: continue
-					profile['crewman'] = position.crewman
-					break
-		
-		# calculate distance to target
-		distance = GetHexDistance(attacker.hx, attacker.hy, target.hx, target.hy)
+		firing_crewman = self.GetAttackCrewman(attacker, weapon)
 		
-		# list of modifiers
+		# add up the modifiers, and record them if a profile is being built
 		# [maximum displayable modifier description length is 18 characters]
+		total_modifier = 0.0
+		weather_mod = 0.0
+		def AddModifier(text, mod):
+			nonlocal total_modifier
+			total_modifier += mod
+			if profile is not None:
+				profile['modifier_list'].append((text, mod))
 		
-		modifier_list = []
-		
-		# base critical hit chance
-		profile['critical_hit'] = CRITICAL_HIT
+		# calculate distance to target
+		distance = GetHexDistance(attacker.hx, attacker.hy, target.hx, target.hy)
 		
 		# point fire attacks (eg. large guns)
-		if profile['type'] == 'Point Fire':
-			
-			# calculate critical hit chance modifier
-			if profile['crewman'] is not None:
-				if 'Knows Weak Spots' in profile['crewman'].skills:
-					if weapon_type == 'Gun' and target.GetStat('armour') is not None:
-						profile['critical_hit'] += profile['crewman'].GetSkillMod(2.0)
+		if attack_type == 'Point Fire':
 			
 			# calculate base success chance
 			
 			# possible to fire HE at unspotted targets
 			if not target.spotted:
 				# use infantry chance as base chance
-				profile['base_chance'] = PF_BASE_CHANCE[distance][1]
+				base_chance = PF_BASE_CHANCE[distance][1]
 			else:
 				if target.GetStat('category') == 'Vehicle':
-					profile['base_chance'] = PF_BASE_CHANCE[distance][0]
+					base_chance = PF_BASE_CHANCE[distance][0]
 				else:
-					profile['base_chance'] = PF_BASE_CHANCE[distance][1]
+					base_chance = PF_BASE_CHANCE[distance][1]
 		
 			# calculate modifiers and build list of descriptions
 			
@@ -11998,18 +13120,18 @@ class Scenario:
 			
 			# attacker is moving
 			if attacker.moving:
-				modifier_list.append(('Attacker Moving', -60.0))
+				AddModifier('Attacker Moving', -60.0)
 			
 			# attacker pivoted
 			elif pivot or attacker.facing != attacker.previous_facing:
 				if weapon.GetStat('turntable') is not None:
-					modifier_list.append(('Attacker Pivoted', -15.0))
+					AddModifier('Attacker Pivoted', -15.0)
 				else:
-					modifier_list.append(('Attacker Pivoted', -35.0))
+					AddModifier('Attacker Pivoted', -35.0)
 			
 			# player or player squad member attacker pivoted
 			elif self.player_pivot != 0 and (attacker == scenario.player_unit or attacker in scenario.player_unit.squad):
-				modifier_list.append(('Attacker Pivoted', -35.0))
+				AddModifier('Attacker Pivoted', -35.0)
 
 			# weapon has turret rotated
 			elif weapon.GetStat('mount') == 'Turret':
@@ -12020,34 +13142,38 @@ class Scenario:
 						mod = -10.0
 					else:
 						mod = -20.0
-					modifier_list.append(('Turret Rotated', mod))
+					AddModifier('Turret Rotated', mod)
 			
 			# attacker pinned or reduced
 			if attacker.pinned:
-				modifier_list.append(('Attacker Pinned', -60.0))
+				AddModifier('Attacker Pinned', -60.0)
 			elif attacker.reduced:
-				modifier_list.append(('Attacker Reduced', -40.0))
+				AddModifier('Attacker Reduced', -40.0)
 			
 			# precipitation effects
 			if campaign_day.weather['Precipitation'] == 'Rain':
-				modifier_list.append(('Rain', -5.0 * float(distance)))
+				weather_mod = -5.0 * float(distance)
+				AddModifier('Rain', weather_mod)
 			elif campaign_day.weather['Precipitation'] == 'Snow':
-				modifier_list.append(('Snow', -10.0 * float(distance)))
+				weather_mod = -10.0 * float(distance)
+				AddModifier('Snow', weather_mod)
 			elif campaign_day.weather['Precipitation'] == 'Heavy Rain':
-				modifier_list.append(('Heavy Rain', -15.0 * float(distance)))
+				weather_mod = -15.0 * float(distance)
+				AddModifier('Heavy Rain', weather_mod)
 			elif campaign_day.weather['Precipitation'] == 'Blizzard':
-				modifier_list.append(('Blizzard', -20.0 * float(distance)))
+				weather_mod = -20.0 * float(distance)
+				AddModifier('Blizzard', weather_mod)
 			
 			# smoke
 			total_smoke = attacker.smoke + target.smoke
 			if total_smoke >= 2:
-				modifier_list.append(('Smoke', -50.0))
+				AddModifier('Smoke', -50.0)
 			elif total_smoke == 1:
-				modifier_list.append(('Smoke', -25.0))
+				AddModifier('Smoke', -25.0)
 			
 			# unspotted target
 			if not target.spotted:
-				modifier_list.append(('Unspotted Target', -20.0))
+				AddModifier('Unspotted Target', -20.0)
 			
 			# spotted target
 			else:
@@ -12059,7 +13185,7 @@ class Scenario:
 						text = 'Acquired Target'
 						if level == 1:
 							text += '+'
-						modifier_list.append((text, AC_BONUS[distance][level]))
+						AddModifier(text, AC_BONUS[distance][level])
 				
 				# target is moving
 				if target.moving:
@@ -12084,7 +13210,7 @@ class Scenario:
 						mod = 0.0
 					
 					if mod != 0.0:
-						modifier_list.append(('Target Moving', mod))
+						AddModifier('Target Moving', mod)
 				
 				# target size
 				size_class = target.GetStat('size_class')
@@ -12092,42 +13218,42 @@ class Scenario:
 					if size_class != 'Normal':
 						text = size_class + ' Target'
 						mod = PF_SIZE_MOD[size_class]
-						modifier_list.append((text, mod))
+						AddModifier(text, mod)
 				
 				# target is on overrun
 				if target.overrun:
 					
 					# point blank range
 					if attacker.hx == 0 and attacker.hy == -1:
-						modifier_list.append(('Point Blank Range', 20.0))
+						AddModifier('Point Blank Range', 20.0)
 				
 				else:
 				
 					# target terrain
 					tem = target.GetTEM()
 					if tem != 0.0:
-						modifier_list.append((target.terrain, tem))
+						AddModifier(target.terrain, tem)
 			
 			# long / short-barreled gun
 			long_range = weapon.GetStat('long_range')
 			if long_range is not None:
 				if long_range == 'S' and distance > 1:
-					modifier_list.append(('Short Gun', -12.0))
+					AddModifier('Short Gun', -12.0)
 				
 				elif long_range == 'L' and distance > 1:
-					modifier_list.append(('Long Gun', 12.0))
+					AddModifier('Long Gun', 12.0)
 				
 				elif long_range == 'LL':
 					if distance == 1:
-						modifier_list.append(('Long Gun', 12.0))
+						AddModifier('Long Gun', 12.0)
 					elif distance >= 2:
-						modifier_list.append(('Long Gun', 24.0))
+						AddModifier('Long Gun', 24.0)
 			
 			if weapon_type == 'Gun':
 				
 				# NEW: APCR/APDS ammo
-				if profile['ammo_type'] in ['APCR', 'APDS'] and distance == 3:
-					modifier_list.append(profile['ammo_type'], -12.0)
+				if ammo_type in ['APCR', 'APDS'] and distance == 3:
+					AddModifier(ammo_type, -12.0)
 				
 				# smaller-calibre gun at longer range
 				calibre_mod = 0
@@ -12146,10 +13272,10 @@ class Scenario:
 					elif distance == 3:
 						calibre_mod -= 2
 				if calibre_mod < 0:
-					modifier_list.append(('Small Calibre', (8.0 * calibre_mod)))
+					AddModifier('Small Calibre', (8.0 * calibre_mod))
 		
 		# area fire
-		elif profile['type'] == 'Area Fire':
+		elif attack_type == 'Area Fire':
 			
 			# set flag if this is a valid overrun attack
 			overrun_attack = False
@@ -12163,7 +13289,8 @@ class Scenario:
 			if distance == 0:
 				fp = fp * 2
 			
-			profile['base_fp'] = fp
+			if profile is not None:
+				profile['base_fp'] = fp
 			
 			# calculate base effect chance
 			if target.GetStat('category') == 'Vehicle':
@@ -12172,47 +13299,44 @@ class Scenario:
 				base_chance = INF_FP_BASE_CHANCE
 			for i in range(2, fp + 1):
 				base_chance += FP_CHANCE_STEP * (FP_CHANCE_STEP_MOD ** (i-1)) 
-			profile['base_chance'] = round(base_chance, 1)
-			
-			# store the rounded base chance so we can use it later for modifiers
-			base_chance = profile['base_chance']
+			base_chance = round(base_chance, 1)
 			
 			# calculate modifiers
 			
 			# overrun attack
 			if overrun_attack:
-				modifier_list.append(('Overrun Attack', base_chance))
+				AddModifier('Overrun Attack', base_chance)
 			
 			else:
 			
 				# attacker moving
 				if attacker.moving:
 					mod = round(base_chance / 2.0, 1)
-					modifier_list.append(('Attacker Moving', 0.0 - mod))
+					AddModifier('Attacker Moving', 0.0 - mod)
 				
 				# attacker pivoted
 				elif attacker.facing != attacker.previous_facing:
 					mod = round(base_chance / 3.0, 1)
-					modifier_list.append(('Attacker Pivoted', 0.0 - mod))
+					AddModifier('Attacker Pivoted', 0.0 - mod)
 	
 				# player attacker pivoted
 				elif attacker == scenario.player_unit and self.player_pivot != 0:
 					mod = round(base_chance / 3.0, 1)
-					modifier_list.append(('Attacker Pivoted', 0.0 - mod))
+					AddModifier('Attacker Pivoted', 0.0 - mod)
 	
 				# weapon turret rotated
 				elif weapon.GetStat('mount') == 'Turret':
 					if attacker.turret_facing != attacker.previous_turret_facing:
 						mod = round(base_chance / 4.0, 1)
-						modifier_list.append(('Turret Rotated', 0.0 - mod))
+						AddModifier('Turret Rotated', 0.0 - mod)
 			
 			# attacker pinned or reduced
 			if attacker.pinned:
 				mod = round(base_chance / 2.0, 1)
-				modifier_list.append(('Attacker Pinned', 0.0 - mod))
+				AddModifier('Attacker Pinned', 0.0 - mod)
 			elif attacker.reduced:
 				mod = round(base_chance / 3.0, 1)
-				modifier_list.append(('Attacker Reduced', 0.0 - mod))
+				AddModifier('Attacker Reduced', 0.0 - mod)
 			
 			# smoke
 			total_smoke = attacker.smoke + target.smoke
@@ -12221,10 +13345,10 @@ class Scenario:
 					mod = round(base_chance / 2.0, 1)
 				else:
 					mod = round(base_chance / 3.0, 1)
-				modifier_list.append(('Smoke', 0.0 - mod))
+				AddModifier('Smoke', 0.0 - mod)
 			
 			if not target.spotted:
-				modifier_list.append(('Unspotted Target', -20.0))
+				AddModifier('Unspotted Target', -20.0)
 			else:
 				
 				# check to see if MG has acquired target
@@ -12237,15 +13361,15 @@ class Scenario:
 						text = 'Acquired Target'
 						if level == 1:
 							text += '+'
-						modifier_list.append((text, mod))
+						AddModifier(text, mod)
 			
 				# target is infantry and moving
 				if target.moving and target.GetStat('category') == 'Infantry':
 					mod = round(base_chance / 2.0, 1)
-					modifier_list.append(('Infantry Moving', mod))
+					AddModifier('Infantry Moving', mod)
 				else:
 					if target.GetStat('class') == 'Team':
-						modifier_list.append(('Small Team', -20.0))
+						AddModifier('Small Team', -20.0)
 				
 				# target size
 				size_class = target.GetStat('size_class')
@@ -12253,53 +13377,53 @@ class Scenario:
 					if size_class != 'Normal':
 						text = size_class + ' Target'
 						mod = PF_SIZE_MOD[size_class]
-						modifier_list.append((text, mod))
+						AddModifier(text, mod)
 				
 				# gun shield
 				if not overrun_attack and target.GetStat('gun_shield') is not None:
 					if GetFacing(attacker, target) == 'Front':
-						modifier_list.append(('Gun Shield', -15.0))
+						AddModifier('Gun Shield', -15.0)
 				
 			# fortified, entrenched, or dug-in
 			if target.fortified:
-				modifier_list.append(('Target Fortified', -50.0))
+				AddModifier('Target Fortified', -50.0)
 			else:
 				
 				if target.entrenched:
 					if overrun_attack:
-						modifier_list.append(('Target Entrenched', -20.0))
+						AddModifier('Target Entrenched', -20.0)
 					else:
-						modifier_list.append(('Target Entrenched', -30.0))
+						AddModifier('Target Entrenched', -30.0)
 				elif target.dug_in:
 					if overrun_attack:
-						modifier_list.append(('Target Dug-in', -5.0))
+						AddModifier('Target Dug-in', -5.0)
 					else:
-						modifier_list.append(('Target Dug-in', -15.0))
+						AddModifier('Target Dug-in', -15.0)
 		
 		# close combat attacks (eg. grenades, demo charges, etc.)
-		elif profile['type'] == 'Close Combat':
+		elif attack_type == 'Close Combat':
 			
 			# determine base success chance
 			if target.GetStat('category') == 'Vehicle':
-				profile['base_chance'] = PF_BASE_CHANCE[0][0]
+				base_chance = PF_BASE_CHANCE[0][0]
 			else:
-				profile['base_chance'] = PF_BASE_CHANCE[0][1]
+				base_chance = PF_BASE_CHANCE[0][1]
 			
 			# calculate modifiers
 			
 			# attacker has been reduced
 			if attacker.reduced:
-				modifier_list.append(('Attacker Reduced', -40.0))
+				AddModifier('Attacker Reduced', -40.0)
 			
 			# smoke in target location
 			if target.smoke >= 2:
-				modifier_list.append(('Smoke', -25.0))
+				AddModifier('Smoke', -25.0)
 			elif target.smoke == 1:
-				modifier_list.append(('Smoke', -10.0))
+				AddModifier('Smoke', -10.0)
 			
 			# target is a moving vehicle
 			if target.moving and target.GetStat('category') == 'Vehicle':
-				modifier_list.append(('Moving Target', -30.0))
+				AddModifier('Moving Target', -30.0)
 			
 			# target size
 			size_class = target.GetStat('size_class')
@@ -12307,15 +13431,15 @@ class Scenario:
 				if size_class != 'Normal':
 					text = size_class + ' Target'
 					mod = PF_SIZE_MOD[size_class]
-					modifier_list.append((text, mod))
+					AddModifier(text, mod)
 			
 			# target terrain
 			tem = target.GetTEM()
 			if tem != 0.0:
-				modifier_list.append((target.terrain, tem))
+				AddModifier(target.terrain, tem)
 			
 			if target.fortified:
-				modifier_list.append(('Target Fortified', -20.0))
+				AddModifier('Target Fortified', -20.0)
 		
 		# check for Commander directing fire
 		# FUTURE: may be possible for other positions as well (Commander/Driver?)
@@ -12329,80 +13453,65 @@ class Scenario:
 				mod = crewman.GetSkillMod(mod)
 				
 				if mod > 0.0:
-					modifier_list.append(('Cmdr Direction', mod))
+					AddModifier('Cmdr Direction', mod)
 				
 					# check for skill modifiers
 					if 'Fire Spotter' in crewman.skills:
 						mod = crewman.GetSkillMod(3.0)
-						modifier_list.append(('Fire Spotter', mod))
+						AddModifier('Fire Spotter', mod)
 					
 					if 'MG Spotter' in crewman.skills:
 						if weapon_type in MG_WEAPONS:
 							mod = crewman.GetSkillMod(7.0)
-							modifier_list.append(('MG Spotter', mod))
+							AddModifier('MG Spotter', mod)
 					
 					if 'Gun Spotter' in crewman.skills:
 						if weapon_type == 'Gun':
 							mod = crewman.GetSkillMod(7.0)
-							modifier_list.append(('Gun Spotter', mod))
+							AddModifier('Gun Spotter', mod)
 					
 				break
 		
 		# check for firing crew skills
-		if profile['crewman'] is not None:
+		if firing_crewman is not None:
 			
 			# NEW: check for operating crewman in untrained position
-			if profile['crewman'].UntrainedPosition():
-				modifier_list.append(('Untrained Position', -50.0))
+			if firing_crewman.UntrainedPosition():
+				AddModifier('Untrained Position', -50.0)
 			
 			else:
 				if weapon_type == 'Gun':
-					if 'Crack Shot' in profile['crewman'].skills:
-						mod = profile['crewman'].GetSkillMod(3.0)
-						modifier_list.append(('Crack Shot', mod))
-					if target.moving and 'Target Tracker' in profile['crewman'].skills:
-						mod = profile['crewman'].GetSkillMod(7.0)
-						modifier_list.append(('Target Tracker', mod))
-					if distance == 3 and 'Sniper' in profile['crewman'].skills:
-						mod = profile['crewman'].GetSkillMod(7.0)
-						modifier_list.append(('Sniper', mod))
+					if 'Crack Shot' in firing_crewman.skills:
+						mod = firing_crewman.GetSkillMod(3.0)
+						AddModifier('Crack Shot', mod)
+					if target.moving and 'Target Tracker' in firing_crewman.skills:
+						mod = firing_crewman.GetSkillMod(7.0)
+						AddModifier('Target Tracker', mod)
+					if distance == 3 and 'Sniper' in firing_crewman.skills:
+						mod = firing_crewman.GetSkillMod(7.0)
+						AddModifier('Sniper', mod)
 					
 					# skill for firing in precepitation
-					if campaign_day.weather['Precipitation'] in ['Rain', 'Snow', 'Heavy Rain', 'Blizzard'] and 'Target Focus' in profile['crewman'].skills:
-						for (text, mod) in modifier_list:
-							if text in ['Rain', 'Snow', 'Heavy Rain', 'Blizzard']:
-								break
-						skill_mod = profile['crewman'].GetSkillMod(8.0)
-						if skill_mod > abs(mod):
-							skill_mod = abs(mod)
-						modifier_list.append(('Target Focus', skill_mod))
+					if campaign_day.weather['Precipitation'] in ['Rain', 'Snow', 'Heavy Rain', 'Blizzard'] and 'Target Focus' in firing_crewman.skills:
+						skill_mod = firing_crewman.GetSkillMod(8.0)
+						if skill_mod > abs(weather_mod):
+							skill_mod = abs(weather_mod)
+						AddModifier('Target Focus', skill_mod)
 			
 			# check for injury modifiers
-			for (k, v) in profile['crewman'].injury.items():
+			for (k, v) in firing_crewman.injury.items():
 				if k not in ['Right Arm & Hand', 'Left Arm & Hand']: continue
 				if v is None: continue
 				if v not in ['Heavy', 'Serious', 'Critical']: continue
-				modifier_list.append(('Arm/Hand Injury', -15.0))	
+				AddModifier('Arm/Hand Injury', -15.0)
 		
-		# save the list of modifiers
-		profile['modifier_list'] = modifier_list[:]
-		
-		# calculate total modifier
-		total_modifier = 0.0
-		for (desc, mod) in modifier_list:
-			total_modifier += mod
+		if profile is not None:
+			profile['type'] = attack_type
+			profile['crewman'] = firing_crewman
+			profile['base_chance'] = base_chance
 		
 		# calculate final chance of success
-		profile['final_chance'] = RestrictChance(profile['base_chance'] + total_modifier)
-		
-		# calculate additional outcomes for Area Fire
-		if profile['type'] == 'Area Fire':
-			profile['full_effect'] = RestrictChance((profile['base_chance'] + 
-				total_modifier) * FP_FULL_EFFECT)
-			profile['critical_effect'] = RestrictChance((profile['base_chance'] + 
-				total_modifier) * FP_CRIT_EFFECT)
-		
-		return profile
+		return RestrictChance(base_chance + total_modifier)
 	
 	
 	# takes an attack profile and generates a profile for an armour penetration attempt
@@ -12794,9 +13903,9 @@ class Scenario:
 			if attacker_spotted:
 				portrait = profile['attacker'].GetStat('portrait')
 				if portrait is not None:
-					libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, attack_con, 1, 2)
+					libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, attack_con, 1, 2)
 			else:
-				libtcod.console_blit(LoadXP('unit_unknown.xp'), 0, 0, 0, 0, attack_con, 1, 2)
+				libtcod.console_blit(LoadXP('unit_unknown.xp', shared=True), 0, 0, 0, 0, attack_con, 1, 2)
 		
 		# attack description
 		if profile['type'] == 'ap':
@@ -12830,9 +13939,9 @@ class Scenario:
 		if target_spotted:
 			portrait = profile['target'].GetStat('portrait')
 			if portrait is not None:
-				libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, attack_con, 1, 13)
+				libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, attack_con, 1, 13)
 		else:
-			libtcod.console_blit(LoadXP('unit_unknown.xp'), 0, 0, 0, 0, attack_con, 1, 13)
+			libtcod.console_blit(LoadXP('unit_unknown.xp', shared=True), 0, 0, 0, 0, attack_con, 1, 13)
 		
 		# base chance
 		text = 'Base '
@@ -13012,10 +14121,10 @@ class Scenario:
 		
 			# don't animate percentage rolls if player is not involved
 			if profile['attacker'] != scenario.player_unit and profile['target'] != scenario.player_unit:
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 			else:
 				for i in range(6):
-					roll = GetPercentileRoll()
+					roll = GetPercentileRoll('combat')
 					
 					# modifiers applied to the final roll, the one that counts
 					if i == 5:
@@ -13035,7 +14144,7 @@ class Scenario:
 											
 											# apply fate point
 											campaign_day.fate_points -= 1
-											roll = profile['final_chance'] + float(libtcod.random_get_int(0, 10, 500)) / 10.0
+											roll = profile['final_chance'] + float(GetRNG('combat').randint(10, 500)) / 10.0
 											if roll > 100.0:
 												roll = 100.0
 								
@@ -13044,7 +14153,7 @@ class Scenario:
 									
 									# apply fate point
 									campaign_day.fate_points -= 1
-									roll = profile['final_chance'] + float(libtcod.random_get_int(0, 10, 500)) / 10.0
+									roll = profile['final_chance'] + float(GetRNG('combat').randint(10, 500)) / 10.0
 									if roll > 100.0:
 										roll = 100.0
 					
@@ -13052,13 +14161,13 @@ class Scenario:
 						if DEBUG:
 							if profile['attacker'] == scenario.player_unit and session.debug['Player Always Hits']:
 								while roll >= profile['final_chance']:
-									roll = GetPercentileRoll()
+									roll = GetPercentileRoll('combat')
 							elif profile['target'] == scenario.player_unit and profile['type'] == 'ap' and session.debug['Player Always Penetrated']:
 								while roll >= profile['final_chance']:
-									roll = GetPercentileRoll()
+									roll = GetPercentileRoll('combat')
 							elif profile['target'] == scenario.player_unit and profile['type'] != 'ap' and session.debug['AI Hates Player']:	
 								while roll >= profile['final_chance']:
-									roll = GetPercentileRoll()
+									roll = GetPercentileRoll('combat')
 					
 					# clear any previous text
 					libtcod.console_print_ex(attack_con, 13, 49, libtcod.BKGND_NONE,
@@ -13080,7 +14189,7 @@ class Scenario:
 			profile['roll'] = roll
 				
 			# determine location hit on target (not always used)
-			location_roll = GetPercentileRoll()
+			location_roll = GetPercentileRoll('combat')
 			
 			if location_roll <= 75.0:
 				profile['location'] = 'Hull'
@@ -13150,6 +14259,15 @@ class Scenario:
 		
 		profile['result'] = result_text
 		
+		if profile.get('weapon') is None:
+			weapon_name = None
+		else:
+			weapon_name = profile['weapon'].GetStat('name')
+		TraceEvent('attack', attack_type=profile['type'], attacker=profile['attacker'],
+			target=profile['target'], weapon=weapon_name, ammo_type=profile.get('ammo_type'),
+			location=profile.get('location'), base_chance=profile.get('base_chance'),
+			final_chance=profile['final_chance'], roll=profile.get('roll'), result=result_text)
+		
 		# if player is not involved, we can return here
 		if profile['attacker'] != scenario.player_unit and profile['target'] != scenario.player_unit:
 			return profile
@@ -13173,7 +14291,7 @@ class Scenario:
 			# FUTURE: possibly allow AI units to maintain RoF?
 			if profile['attacker'] == scenario.player_unit:
 				
-				if GetPercentileRoll() <= profile['weapon'].GetRoFChance():
+				if GetPercentileRoll('combat') <= profile['weapon'].GetRoFChance():
 					profile['weapon'].maintained_rof = True
 				else:
 					profile['weapon'].maintained_rof = False
@@ -13276,7 +14394,7 @@ class Scenario:
 		
 		# check for air attack first
 		if campaign_day.air_support_request:
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			granted = False
 			if DEBUG:
 				if session.debug['Support Requests Always Granted']:
@@ -13299,7 +14417,7 @@ class Scenario:
 		
 		# check for artillery attack
 		if campaign_day.arty_support_request:
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			
 			# determine national skill modifier if any
 			if campaign.CheckForNationalSkill('Centralized Fire'):
@@ -13379,7 +14497,7 @@ class Scenario:
 				modifier += unit.GetTEM()
 				
 				# not spotted
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 				if roll > RestrictChance(chance + round(modifier * 0.25, 2)):
 					continue
 				
@@ -13393,7 +14511,7 @@ class Scenario:
 		
 		
 		# roll for number of planes
-		roll = libtcod.random_get_int(0, 1, 10)
+		roll = GetRNG('combat').randint(1, 10)
 		if roll <= 5:
 			num_planes = 1
 		elif roll <= 8:
@@ -13403,9 +14521,9 @@ class Scenario:
 		
 		# determine type of plane
 		if player_target:
-			plane_id = choice(campaign.stats['enemy_air_support'])
+			plane_id = GetRNG('combat').choice(campaign.stats['enemy_air_support'])
 		else:
-			plane_id = choice(campaign.stats['player_air_support'])
+			plane_id = GetRNG('combat').choice(campaign.stats['player_air_support'])
 		
 		# display message
 		text = str(num_planes) + ' ' + plane_id + ' arrive'
@@ -13484,7 +14602,7 @@ class Scenario:
 				# find a target unit in the target hex
 				if len(map_hex.unit_stack) == 0:
 					continue
-				target = choice(map_hex.unit_stack)
+				target = GetRNG('combat').choice(map_hex.unit_stack)
 			
 				# calculate basic to-effect score required
 				if not target.spotted:
@@ -13508,7 +14626,7 @@ class Scenario:
 					chance -= 15.0
 				
 				chance = RestrictChance(int(chance / 2))
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 				
 				if roll > chance: continue
 				
@@ -13521,7 +14639,7 @@ class Scenario:
 				
 				# roll for direct hit / near miss
 				direct_hit = False
-				if GetPercentileRoll() <= DIRECT_HIT_CHANCE:
+				if GetPercentileRoll('combat') <= DIRECT_HIT_CHANCE:
 					direct_hit = True
 				
 				# infantry or gun target
@@ -13576,7 +14694,7 @@ class Scenario:
 					profile['result'] = ''
 					
 					# determine location hit
-					if GetPercentileRoll() <= 50.0:
+					if GetPercentileRoll('combat') <= 50.0:
 						profile['location'] = 'Hull'
 					else:
 						profile['location'] = 'Turret'
@@ -13590,7 +14708,7 @@ class Scenario:
 							profile['final_chance'] = 100.0
 					
 					# do AP roll
-					roll = GetPercentileRoll()
+					roll = GetPercentileRoll('combat')
 					
 					# no penetration
 					if roll > profile['final_chance']:
@@ -13649,8 +14767,8 @@ class Scenario:
 			
 			(x, y) = self.PlotHex(map_hex.hx, map_hex.hy)
 			for i in range(3):
-				xm = 3 - libtcod.random_get_int(0, 0, 6)
-				ym = 3 - libtcod.random_get_int(0, 0, 6)
+				xm = 3 - GetRNG('combat').randint(0, 6)
+				ym = 3 - GetRNG('combat').randint(0, 6)
 				PlaySoundFor(None, 'he_explosion')
 				# create bomb animation
 				self.animation['bomb_effect'] = (x+xm, y+ym)
@@ -13664,9 +14782,9 @@ class Scenario:
 		
 		# spawn gun unit and determine effective FP
 		if player_target:
-			unit_id = choice(campaign.stats['enemy_arty_support'])
+			unit_id = GetRNG('combat').choice(campaign.stats['enemy_arty_support'])
 		else:
-			unit_id = choice(campaign.stats['player_arty_support'])
+			unit_id = GetRNG('combat').choice(campaign.stats['player_arty_support'])
 		gun_unit = Unit(unit_id)
 		gun_calibre = int(gun_unit.weapon_list[0].GetStat('calibre'))
 		
@@ -13708,7 +14826,7 @@ class Scenario:
 				# FUTURE: apply any further modifiers here
 				
 				chance = RestrictChance(int(chance / 2))
-				roll = GetPercentileRoll()
+				roll = GetPercentileRoll('combat')
 				
 				# apply national skill modifiers if any
 				roll += skill_mod
@@ -13727,7 +14845,7 @@ class Scenario:
 				
 				# roll for direct hit / near miss
 				direct_hit = False
-				if GetPercentileRoll() <= DIRECT_HIT_CHANCE:
+				if GetPercentileRoll('combat') <= DIRECT_HIT_CHANCE:
 					direct_hit = True
 				
 				# infantry or gun target hit
@@ -13781,7 +14899,7 @@ class Scenario:
 					profile['result'] = ''
 					
 					# determine location hit
-					if GetPercentileRoll() <= 50.0:
+					if GetPercentileRoll('combat') <= 50.0:
 						profile['location'] = 'Hull'
 					else:
 						profile['location'] = 'Turret'
@@ -13795,7 +14913,7 @@ class Scenario:
 							profile['final_chance'] = 100.0
 					
 					# do AP roll
-					roll = GetPercentileRoll()
+					roll = GetPercentileRoll('combat')
 					
 					# no penetration
 					if roll > profile['final_chance']:
@@ -13858,7 +14976,7 @@ class Scenario:
 				chance = scenario.player_unit.forward_move_chance
 			else:
 				chance = scenario.player_unit.reverse_move_chance
-			roll = GetPercentileRoll()
+			roll = GetPercentileRoll('combat')
 			
 			# check for crew action modifier
 			for position in ['Commander', 'Commander/Gunner']:
@@ -13889,6 +15007,8 @@ class Scenario:
 			if DEBUG:
 				if session.debug['Player Always Moves']:
 					roll = 1.0
+			
+			TraceEvent('move', unit=self.player_unit, forward=forward, chance=chance, roll=roll)
 		
 			# move was not successful
 			if roll > chance:
@@ -14140,7 +15260,7 @@ class Scenario:
 			libtcod.console_flush()
 			
 			# get keyboard and/or mouse event
-			if not GetInputEvent(): continue
+			if not GetInputEvent('ShowUnitInfoWindow'): continue
 			
 			if key.vk == libtcod.KEY_ESCAPE:
 				exit = True
@@ -14153,6 +15273,9 @@ class Scenario:
 	# advance to next phase/turn and do automatic events
 	def AdvanceToNextPhase(self):
 		
+		if session.profiler is not None:
+			session.profiler.EndPhase(self.phase)
+		
 		# do end of phase actions for player
 		
 		# end of player turn, switching to enemy turn
@@ -14244,6 +15367,7 @@ class Scenario:
 				
 				# clear GUI console and refresh screen
 				libtcod.console_clear(gui_con)
+				scenario_compositor.MarkDirty('gui_con')
 				self.UpdateScenarioDisplay()
 				libtcod.console_flush()
 				
@@ -14471,6 +15595,7 @@ class Scenario:
 	# 18x12
 	def UpdateContextCon(self):
 		libtcod.console_clear(context_con)
+		scenario_compositor.MarkDirty('context_con')
 		
 		# if we're advancing to next phase automatically, don't display anything here
 		if self.advance_phase: return
@@ -14640,12 +15765,14 @@ class Scenario:
 	# update player unit info console
 	def UpdatePlayerInfoCon(self):
 		libtcod.console_clear(player_info_con)
+		scenario_compositor.MarkDirty('player_info_con')
 		scenario.player_unit.DisplayMyInfo(player_info_con, 0, 0)
 	
 	
 	# update the player crew info console
 	def UpdateCrewInfoCon(self):
 		libtcod.console_clear(crew_con)
+		scenario_compositor.MarkDirty('crew_con')
 		
 		y = 0
 		i = 0
@@ -14732,6 +15859,7 @@ class Scenario:
 	# update player command console 25x12
 	def UpdateCmdCon(self):
 		libtcod.console_clear(cmd_menu_con)
+		scenario_compositor.MarkDirty('cmd_menu_con')
 		
 		# player not active
 		if scenario.active_player == 1: return
@@ -14849,6 +15977,7 @@ class Scenario:
 	def UpdateHexmapCon(self):
 		
 		libtcod.console_clear(hexmap_con)
+		scenario_compositor.MarkDirty('hexmap_con')
 		
 		# select base hex console image to use
 		if campaign_day.weather['Ground'] in ['Snow', 'Heavy Snow']:
@@ -14871,6 +16000,7 @@ class Scenario:
 		
 		libtcod.console_set_default_background(unit_con, KEY_COLOR)
 		libtcod.console_clear(unit_con)
+		scenario_compositor.MarkDirty('unit_con')
 		for map_hex in self.map_hexes:
 			
 			# too far away
@@ -14914,6 +16044,7 @@ class Scenario:
 	def UpdateGuiCon(self):
 		
 		libtcod.console_clear(gui_con)
+		scenario_compositor.MarkDirty('gui_con')
 				
 		# display field of view if in command phase
 		if self.phase == PHASE_COMMAND:
@@ -14949,6 +16080,7 @@ class Scenario:
 	# 61x5
 	def UpdateUnitInfoCon(self):
 		libtcod.console_clear(unit_info_con)
+		scenario_compositor.MarkDirty('unit_info_con')
 		
 		# check that cursor is in map area and on a map hex
 		x = mouse.cx - 32
@@ -14991,7 +16123,7 @@ class Scenario:
 			libtcod.console_print(unit_info_con, 30, 2, 'Smoke lvl ' + str(unit.smoke))
 		
 		# LoS blocked
-		if not self.player_unit.los_table[unit]:
+		if not self.los_table.HasLoS(self.player_unit, unit):
 			libtcod.console_set_default_background(unit_info_con, libtcod.grey)
 			libtcod.console_rect(unit_info_con, 20, 0, 21, 1, False, libtcod.BKGND_SET)
 			libtcod.console_set_default_background(unit_info_con, libtcod.darkest_grey)
@@ -15101,9 +16233,9 @@ class Scenario:
 			if campaign_day.weather['Precipitation'] == 'Heavy Rain':
 				num = 8
 			for i in range(num):
-				x = libtcod.random_get_int(0, 4, 50)
-				y = libtcod.random_get_int(0, 0, 38)
-				lifespan = libtcod.random_get_int(0, 1, 5)
+				x = GetRNG('cosmetic').randint(4, 50)
+				y = GetRNG('cosmetic').randint(0, 38)
+				lifespan = GetRNG('cosmetic').randint(1, 5)
 				self.animation['rain_drops'].append((x, y, 4))
 		
 		# set up snow if any
@@ -15116,9 +16248,9 @@ class Scenario:
 			else:
 				num = 16
 			for i in range(num):
-				x = libtcod.random_get_int(0, 4, 50)
-				y = libtcod.random_get_int(0, 0, 37)
-				lifespan = libtcod.random_get_int(0, 4, 10)
+				x = GetRNG('cosmetic').randint(4, 50)
+				y = GetRNG('cosmetic').randint(0, 37)
+				lifespan = GetRNG('cosmetic').randint(4, 10)
 				self.animation['snowflakes'].append((x, y, lifespan))
 	
 	
@@ -15126,6 +16258,7 @@ class Scenario:
 	def UpdateAnimCon(self):
 		
 		libtcod.console_clear(anim_con)
+		drawn_rects = []		# screen areas drawn to this frame
 		
 		# update rain display
 		if self.animation['rain_active']:
@@ -15136,9 +16269,9 @@ class Scenario:
 				
 				# respawn if finished
 				if lifespan == 0:
-					x = libtcod.random_get_int(0, 4, 50)
-					y = libtcod.random_get_int(0, 0, 37)
-					lifespan = libtcod.random_get_int(0, 1, 5)
+					x = GetRNG('cosmetic').randint(4, 50)
+					y = GetRNG('cosmetic').randint(0, 37)
+					lifespan = GetRNG('cosmetic').randint(1, 5)
 				else:
 					y += 2
 					lifespan -= 1
@@ -15157,6 +16290,7 @@ class Scenario:
 					char = 124
 				libtcod.console_put_char_ex(anim_con, x, y, char, libtcod.light_blue,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update snow display
 		if self.animation['snow_active']:
@@ -15167,11 +16301,11 @@ class Scenario:
 				
 				# respawn if finished
 				if lifespan == 0:
-					x = libtcod.random_get_int(0, 4, 50)
-					y = libtcod.random_get_int(0, 0, 37)
-					lifespan = libtcod.random_get_int(0, 4, 10)
+					x = GetRNG('cosmetic').randint(4, 50)
+					y = GetRNG('cosmetic').randint(0, 37)
+					lifespan = GetRNG('cosmetic').randint(4, 10)
 				else:
-					x += choice([-1, 0, 1])
+					x += GetRNG('cosmetic').choice([-1, 0, 1])
 					y += 1
 					lifespan -= 1
 				
@@ -15185,6 +16319,7 @@ class Scenario:
 				
 				libtcod.console_put_char_ex(anim_con, x, y, 249, libtcod.white,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update airplane animation if any
 		if self.animation['air_attack'] is not None:
@@ -15198,6 +16333,7 @@ class Scenario:
 			else:
 				(x,y) = self.animation['air_attack_line'][0]
 				libtcod.console_blit(self.animation['air_attack'], 0, 0, 0, 0, anim_con, x-1, y)
+				drawn_rects.append((x-1, y, 3, 3))
 		
 		# update gun fire animation if any
 		if self.animation['gun_fire_active']:
@@ -15213,6 +16349,7 @@ class Scenario:
 				(x,y) = self.animation['gun_fire_line'][0]
 				libtcod.console_put_char_ex(anim_con, x, y, 250, libtcod.white,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update small arms fire if any
 		if self.animation['small_arms_fire_action']:
@@ -15221,9 +16358,10 @@ class Scenario:
 				self.animation['small_arms_fire_action'] = None
 			else:
 				self.animation['small_arms_lifetime'] -= 1
-				(x,y) = choice(self.animation['small_arms_fire_line'][1:])
+				(x,y) = GetRNG('cosmetic').choice(self.animation['small_arms_fire_line'][1:])
 				libtcod.console_put_char_ex(anim_con, x, y, 250, libtcod.yellow,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update bomb/explosion animation if any
 		if self.animation['bomb_effect'] is not None:
@@ -15242,6 +16380,7 @@ class Scenario:
 				
 				libtcod.console_put_char_ex(anim_con, x, y, 42, col,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update grenade effect if any
 		if self.animation['grenade_effect'] is not None:
@@ -15251,11 +16390,12 @@ class Scenario:
 			else:
 				self.animation['grenade_effect_lifetime'] -= 1
 				(x,y) = self.animation['grenade_effect']
-				x += libtcod.random_get_int(0, -1, 1)
-				y += libtcod.random_get_int(0, -1, 1)
-				col = choice([libtcod.red, libtcod.yellow, libtcod.black])
+				x += GetRNG('cosmetic').randint(-1, 1)
+				y += GetRNG('cosmetic').randint(-1, 1)
+				col = GetRNG('cosmetic').choice([libtcod.red, libtcod.yellow, libtcod.black])
 				libtcod.console_put_char_ex(anim_con, x, y, 250, col,
 					libtcod.black)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update flamethrower effect if any
 		if self.animation['ft_effect'] is not None:
@@ -15265,12 +16405,13 @@ class Scenario:
 			else:
 				self.animation['ft_effect_lifetime'] -= 1
 				(x,y) = self.animation['ft_effect']
-				x += libtcod.random_get_int(0, -1, 1)
-				y += libtcod.random_get_int(0, -1, 1)
-				fg_col = choice([libtcod.light_red, libtcod.light_yellow, libtcod.grey])
-				bg_col = choice([libtcod.red, libtcod.yellow, libtcod.black])
+				x += GetRNG('cosmetic').randint(-1, 1)
+				y += GetRNG('cosmetic').randint(-1, 1)
+				fg_col = GetRNG('cosmetic').choice([libtcod.light_red, libtcod.light_yellow, libtcod.grey])
+				bg_col = GetRNG('cosmetic').choice([libtcod.red, libtcod.yellow, libtcod.black])
 				libtcod.console_put_char_ex(anim_con, x, y, 177, fg_col,
 					bg_col)
+				drawn_rects.append((x, y, 1, 1))
 		
 		# update hex highlight if any
 		if self.animation['hex_highlight']:
@@ -15289,46 +16430,36 @@ class Scenario:
 				for (xm,ym) in HEX_EDGE_CELLS[direction]:
 					libtcod.console_put_char_ex(anim_con, x+xm, y+ym,
 						char, libtcod.light_blue, libtcod.black)
+					drawn_rects.append((x+xm, y+ym, 1, 1))
+		
+		# only the areas drawn to last frame and this frame need to be redrawn
+		scenario_compositor.MarkDrawn('anim_con', drawn_rects)
 		
 		# reset update timer
 		session.anim_timer = time.time()
 		
 	
 	# draw all scenario consoles to the screen
+	# only the parts of layer consoles that have changed since the last time are recomposited
 	def UpdateScenarioDisplay(self):
-		libtcod.console_clear(con)
 		
-		# left column
-		if self.attack_con_active:
-			libtcod.console_blit(attack_con, 0, 0, 0, 0, con, 0, 0)
-		else:
-			libtcod.console_blit(bkg_console, 0, 0, 0, 0, con, 0, 0)
-			libtcod.console_blit(player_info_con, 0, 0, 0, 0, con, 1, 1)
-			libtcod.console_blit(crew_con, 0, 0, 0, 0, con, 1, 21)
-			libtcod.console_blit(cmd_menu_con, 0, 0, 0, 0, con, 1, 47)
-		
-		# main map display
-		libtcod.console_blit(hexmap_con, 0, 0, 0, 0, con, 32, 9)
-		libtcod.console_blit(unit_con, 0, 0, 0, 0, con, 32, 9, 1.0, 1.0)
-		libtcod.console_blit(gui_con, 0, 0, 0, 0, con, 32, 9, 1.0, 0.0)
-		libtcod.console_blit(anim_con, 0, 0, 0, 0, con, 32, 9, 1.0, 0.0)
-		
-		# consoles around the edge of map
-		libtcod.console_blit(context_con, 0, 0, 0, 0, con, 28, 1)
-		libtcod.console_blit(time_con, 0, 0, 0, 0, con, 48, 1)
-		libtcod.console_blit(scen_weather_con, 0, 0, 0, 0, con, 71, 1)
-		libtcod.console_blit(unit_info_con, 0, 0, 0, 0, con, 28, 54)
+		# left column shows either the attack console or the player unit info
+		scenario_compositor.SetVisible('attack_con', self.attack_con_active)
+		for name in ['bkg_console', 'player_info_con', 'crew_con', 'cmd_menu_con']:
+			scenario_compositor.SetVisible(name, not self.attack_con_active)
+		
+		scenario_compositor.Composite()
 		
+		libtcod.console_blit(scenario_compositor.console, 0, 0, 0, 0, con, 0, 0)
 		libtcod.console_blit(con, 0, 0, 0, 0, 0, 0, 0)
 	
 	
-	# main input loop for scenarios
-	def DoScenarioLoop(self):
+	# set up and load scenario consoles, and the compositor that draws them to the screen
+	def InitConsoles(self):
 		
-		# set up and load scenario consoles
 		global bkg_console, crew_con, cmd_menu_con, scen_weather_con
 		global player_info_con, context_con, time_con, hexmap_con, unit_con, gui_con
-		global anim_con, attack_con, unit_info_con
+		global anim_con, attack_con, unit_info_con, scenario_compositor
 		
 		# background outline console for left column
 		bkg_console = LoadXP('bkg.xp')
@@ -15346,6 +16477,30 @@ class Scenario:
 		anim_con = NewConsole(53, 43, KEY_COLOR, libtcod.white, key_colour=True)
 		attack_con = NewConsole(27, 60, libtcod.black, libtcod.white)
 		
+		# set up the layers of the scenario screen, in the order they are drawn
+		# the attack console is redrawn in many steps as an attack is resolved, and the time and
+		# weather consoles are shared with the campaign day display, so they are always redrawn
+		scenario_compositor = LayerCompositor(WINDOW_WIDTH, WINDOW_HEIGHT)
+		scenario_compositor.AddLayer('attack_con', attack_con, 0, 0, 27, 60, always_dirty=True)
+		scenario_compositor.AddLayer('bkg_console', bkg_console, 0, 0, 27, 60)
+		scenario_compositor.AddLayer('player_info_con', player_info_con, 1, 1, 25, 18)
+		scenario_compositor.AddLayer('crew_con', crew_con, 1, 21, 25, 24)
+		scenario_compositor.AddLayer('cmd_menu_con', cmd_menu_con, 1, 47, 25, 12)
+		scenario_compositor.AddLayer('hexmap_con', hexmap_con, 32, 9, 53, 43)
+		scenario_compositor.AddLayer('unit_con', unit_con, 32, 9, 53, 43, 1.0, 1.0)
+		scenario_compositor.AddLayer('gui_con', gui_con, 32, 9, 53, 43, 1.0, 0.0)
+		scenario_compositor.AddLayer('anim_con', anim_con, 32, 9, 53, 43, 1.0, 0.0)
+		scenario_compositor.AddLayer('context_con', context_con, 28, 1, 18, 12)
+		scenario_compositor.AddLayer('time_con', time_con, 48, 1, 21, 6, always_dirty=True)
+		scenario_compositor.AddLayer('scen_weather_con', scen_weather_con, 71, 1, 18, 12, always_dirty=True)
+		scenario_compositor.AddLayer('unit_info_con', unit_info_con, 28, 54, 61, 5)
+	
+	
+	# main input loop for scenarios
+	def DoScenarioLoop(self):
+		
+		self.InitConsoles()
+		
 		# we're starting a new scenario
 		if not self.init_complete:
 		
@@ -15456,11 +16611,11 @@ class Scenario:
 				continue
 			
 			# check for animation update
-			if time.time() - session.anim_timer >= 0.20:
+			if not headless and time.time() - session.anim_timer >= 0.20:
 				self.UpdateAnimCon()
 				self.UpdateScenarioDisplay()
 			
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('DoScenarioLoop')
 			
 			##### Mouse Commands #####
 			
@@ -15754,6 +16909,590 @@ class Scenario:
 					
 
 
+# Null Renderer: stands in for the libtcod module when the game is run headless; colours,
+# constants, key and mouse holders, and random number functions are passed through to
+# libtcod, while console and system functions do nothing and return None
+class NullRenderer:
+	def __init__(self, module):
+		self.module = module
+	
+	
+	# look up a libtcod attribute, replacing any console or system function with a null one
+	# the result is stored so that each name only needs to be looked up once
+	def __getattr__(self, name):
+		value = getattr(self.module, name)
+		if callable(value) and name.startswith(('console_', 'sys_', 'image_')):
+			value = lambda *args, **kwargs: None
+		setattr(self, name, value)
+		return value
+	
+	
+	# colours read back from consoles are compared to libtcod colours, which can't be compared
+	# to None, so every cell reads as black
+	def console_get_char_background(self, con, x, y):
+		return self.module.black
+	
+	
+	def console_get_char_foreground(self, con, x, y):
+		return self.module.black
+	
+	
+	# there are no frames to wait for
+	def WaitForFrame(self):
+		return
+
+
+
+# Frame Scheduler: stands in for the libtcod module when there is a game window; everything is
+# passed through, but drawing to the root console is tracked so that the screen is only flushed
+# when something has changed, and input loops sleep until the next frame instead of spinning
+class FrameScheduler:
+	def __init__(self, module):
+		self.module = module
+		self.dirty = True			# root console has been drawn to since the last flush
+		self.last_flush = 0.0			# time of the last flush
+		self.frame_start = 0.0			# time that the current frame started
+		self.frame_time = 1.0 / LIMIT_FPS
+		self.work_time = 0.0			# time spent on the last frame before waiting
+	
+	
+	# look up a libtcod attribute, replacing any console function with one that notes when
+	# it draws to the root console
+	def __getattr__(self, name):
+		value = getattr(self.module, name)
+		if callable(value) and name.startswith('console_'):
+			value = self.GetDrawFunction(name, value)
+		setattr(self, name, value)
+		return value
+	
+	
+	# return a version of a console function that marks the screen as changed if it draws
+	# to the root console
+	def GetDrawFunction(self, name, function):
+		
+		# blit draws to its destination console, everything else to its first console
+		if name == 'console_blit':
+			con_index = 5
+		else:
+			con_index = 0
+		
+		def DrawFunction(*args, **kwargs):
+			if len(args) > con_index and args[con_index] == 0:
+				self.dirty = True
+			return function(*args, **kwargs)
+		return DrawFunction
+	
+	
+	# flush the root console to the screen, but only if it has changed or has not been
+	# refreshed for a while
+	def console_flush(self):
+		if not self.dirty:
+			if time.perf_counter() - self.last_flush < MAX_REDRAW_INTERVAL:
+				return
+		if session.profiler is not None:
+			if session.profiler.show_overlay:
+				session.profiler.DrawOverlay(self.module, self.work_time)
+		self.module.console_flush()
+		self.dirty = False
+		self.last_flush = time.perf_counter()
+	
+	
+	# sleep for whatever is left of the current frame, called by input loops before checking
+	# for a new event so that they run at most LIMIT_FPS times per second
+	def WaitForFrame(self):
+		self.work_time = time.perf_counter() - self.frame_start
+		wait_time = self.frame_start + self.frame_time - time.perf_counter()
+		if wait_time > 0.0:
+			time.sleep(wait_time)
+		self.frame_start = time.perf_counter()
+
+
+
+# Auto Player Policy: makes all the player's choices when the game is run headless; accepts
+# the default in every menu, loads the default ammo, keeps the crew on weapon and spotting
+# commands, fires whenever an attack is possible, and travels toward enemy-held zones
+class AutoPlayerPolicy:
+	def __init__(self, days=None):
+		self.days = days			# number of campaign days to play, None for all
+		self.context = None			# name of the input loop that last asked for a key
+		self.context_keys = 0			# number of keys given to that loop in a row
+		self.shots_tried = 0			# weapon and target selections tried this shooting phase
+		self.ammo_tried = 0			# ammo types tried for the current selection
+		self.crew_list = []			# every crewman who has served in the player unit
+		self.day_vp = {}			# VP earned on each completed combat day
+	
+	
+	# return a key code and character for a character key, optionally mapped to the
+	# current keyboard layout
+	def CharKey(self, key_char, mapped=True):
+		if mapped:
+			key_char = EnKey(key_char)
+		return (libtcod.KEY_CHAR, ord(key_char))
+	
+	
+	# return the key code and character for the next key press, given the name of the
+	# input loop that is asking for it
+	def GetKey(self, context):
+		
+		if context == self.context:
+			self.context_keys += 1
+		else:
+			self.context = context
+			self.context_keys = 0
+		
+		# keep track of everyone who serves in the player unit
+		for position in campaign.player_unit.positions_list:
+			if position.crewman is None: continue
+			if position.crewman in self.crew_list: continue
+			self.crew_list.append(position.crewman)
+		
+		if context == 'DoCampaignCalendarLoop':
+			return self.GetCalendarKey()
+		elif context == 'DoCampaignDayLoop':
+			return self.GetCampaignDayKey()
+		elif context == 'DoScenarioLoop':
+			return self.GetScenarioKey()
+		elif context == 'AmmoReloadMenu':
+			return self.GetAmmoReloadKey()
+		
+		# notifications: confirm if asked, otherwise continue
+		elif context == 'ShowNotification':
+			if self.context_keys % 2 == 0:
+				return self.CharKey('y', mapped=False)
+			return (libtcod.KEY_ENTER, 13)
+		
+		# game menu is only opened by this policy in order to quit
+		elif context == 'ShowGameMenu':
+			return self.CharKey('q', mapped=False)
+		
+		# any other menu: accept with Enter, or back out with Escape if Enter does not close it
+		if self.context_keys >= 10 and self.context_keys % 2 == 1:
+			return (libtcod.KEY_ESCAPE, 27)
+		return (libtcod.KEY_ENTER, 13)
+	
+	
+	# campaign calendar: start or proceed to the next day, quitting once the day limit is reached
+	def GetCalendarKey(self):
+		if campaign_day.ended:
+			self.day_vp[campaign.today] = campaign_day.day_vp
+		if self.days is not None and campaign_day.ended:
+			if len(campaign.logs) + 1 >= self.days:
+				return (libtcod.KEY_ESCAPE, 27)
+		if campaign.active_calendar_menu != 1:
+			return self.CharKey('1')
+		return (libtcod.KEY_ENTER, 13)
+	
+	
+	# ammo load menu: replace the load of each gun with the default, then proceed
+	def GetAmmoReloadKey(self):
+		gun_num = 0
+		for weapon in campaign.player_unit.weapon_list:
+			if weapon.GetStat('type') == 'Gun':
+				gun_num += 1
+		if self.context_keys < gun_num * 2:
+			if self.context_keys % 2 == 0:
+				return self.CharKey('x')
+			return self.CharKey('q')
+		return (libtcod.KEY_ENTER, 13)
+	
+	
+	# campaign day map: travel toward enemy-held zones, or wait if there are none to reach
+	def GetCampaignDayKey(self):
+		if campaign_day.active_menu != 3:
+			return self.CharKey('3')
+		direction = self.GetTravelDirection()
+		if direction is None:
+			return self.CharKey('w')
+		if campaign_day.selected_direction != direction:
+			return self.CharKey(CD_TRAVEL_CMDS[direction][0])
+		return (libtcod.KEY_ENTER, 13)
+	
+	
+	# choose a direction of travel on the campaign day map that brings the player closer to
+	# an enemy-held zone; returns None if there is no such direction
+	def GetTravelDirection(self):
+		
+		enemy_hexes = []
+		for (hx, hy), map_hex in campaign_day.map_hexes.items():
+			if map_hex.controlled_by == 1:
+				enemy_hexes.append((hx, hy))
+		if len(enemy_hexes) == 0: return None
+		
+		def GetEnemyDistance(hx1, hy1):
+			return min([GetCDHexDistance(hx1, hy1, hx2, hy2) for (hx2, hy2) in enemy_hexes])
+		
+		(hx1, hy1) = campaign_day.player_unit_location
+		best_distance = GetEnemyDistance(hx1, hy1)
+		best_direction = None
+		for direction in range(6):
+			(hx2, hy2) = campaign_day.GetAdjacentCDHex(hx1, hy1, direction)
+			if (hx2, hy2) not in campaign_day.map_hexes: continue
+			if campaign_day.CheckTravel(hx1, hy1, hx2, hy2) != '': continue
+			distance = GetEnemyDistance(hx2, hy2)
+			if distance < best_distance:
+				best_distance = distance
+				best_direction = direction
+		return best_direction
+	
+	
+	# scenario: set crew commands, fire at any possible target, otherwise advance the phase
+	def GetScenarioKey(self):
+		
+		if scenario.phase == PHASE_COMMAND:
+			self.shots_tried = 0
+			self.ammo_tried = 0
+			for i, position in enumerate(scenario.player_unit.positions_list):
+				if position.crewman is None: continue
+				cmd = self.GetCrewCommand(position.crewman)
+				if position.crewman.current_cmd == cmd: continue
+				if scenario.selected_position != i:
+					return self.CharKey('s')
+				return self.CharKey('d')
+			return (libtcod.KEY_SPACE, 32)
+		
+		if scenario.phase != PHASE_SHOOTING:
+			return (libtcod.KEY_SPACE, 32)
+		
+		weapon = scenario.selected_weapon
+		result = 'No target selected'
+		if weapon is not None and weapon.selected_target is not None:
+			result = scenario.CheckAttack(scenario.player_unit, weapon, weapon.selected_target)
+			if result == '':
+				return self.CharKey('f')
+			
+			# try the other ammo types for this weapon and target
+			if result in ['AP has no effect on target', 'No more ammo of the selected type']:
+				if self.ammo_tried < len(weapon.stats['ammo_type_list']) - 1:
+					self.ammo_tried += 1
+					return self.CharKey('c')
+		self.ammo_tried = 0
+		
+		# try each target with each weapon before ending the phase
+		target_num = len(scenario.target_list)
+		weapon_num = len(scenario.player_unit.weapon_list)
+		if target_num == 0 or self.shots_tried >= (target_num + 1) * weapon_num:
+			return (libtcod.KEY_SPACE, 32)
+		self.shots_tried += 1
+		if self.shots_tried % (target_num + 1) == 0:
+			return self.CharKey('s')
+		return self.CharKey('d')
+	
+	
+	# return the command that a crewman should be on for this turn
+	def GetCrewCommand(self, crewman):
+		for cmd in ['Attempt Unbog', 'Operate Gun', 'Reload', 'Operate MG', 'Spot']:
+			if cmd in crewman.cmd_list:
+				return cmd
+		return crewman.current_cmd
+
+
+
+# Scripted Player Policy: gives the game a fixed list of key presses when it is run headless,
+# then hands over to another policy once the list has been used up
+class ScriptedPlayerPolicy:
+	def __init__(self, key_list, fallback=None):
+		self.key_list = key_list		# list of key codes and characters
+		self.next_key = 0			# index of the next key to give
+		if fallback is None:
+			fallback = AutoPlayerPolicy()
+		self.fallback = fallback
+	
+	
+	# return the key code and character for the next key press
+	def GetKey(self, context):
+		if self.next_key < len(self.key_list):
+			self.next_key += 1
+			return self.key_list[self.next_key - 1]
+		return self.fallback.GetKey(context)
+
+
+
+# Quit Player Policy: quits to the main menu as quickly as possible, used once a replay has
+# run out of recorded key presses
+class QuitPlayerPolicy:
+	def __init__(self):
+		self.context = None
+		self.context_keys = 0
+	
+	
+	# return Escape to back out of any menu, Q to quit from the game menu, and Enter if
+	# Escape has not worked
+	def GetKey(self, context):
+		if context == self.context:
+			self.context_keys += 1
+		else:
+			self.context = context
+			self.context_keys = 0
+		if context == 'ShowGameMenu':
+			return (libtcod.KEY_CHAR, ord('q'))
+		if self.context_keys % 2 == 1:
+			return (libtcod.KEY_ENTER, 13)
+		return (libtcod.KEY_ESCAPE, 27)
+
+
+
+# Input Recorder: records every key press used by the game from the start of a new campaign,
+# along with the campaign seed, so that the campaign can be replayed exactly
+class InputRecorder:
+	def __init__(self, filename):
+		self.filename = filename
+		self.log = None
+		
+		# make sure the recording is written even if the game window is closed
+		atexit.register(self.Stop)
+	
+	
+	# start a new recording for a campaign with the given seed
+	def Start(self, rng_seed):
+		self.log = {
+			'version' : VERSION,
+			'seed' : rng_seed,
+			'keyboard' : config['ArmCom2'].getint('keyboard'),
+			'keys' : []
+		}
+	
+	
+	# record the key press that has just been read by an input loop
+	# key presses that only skip a wait are not recorded, since waits are skipped in a replay, and
+	# mouse input other than cursor movement is ignored while recording, see GetInputEvent()
+	def RecordKey(self, context):
+		if self.log is None: return
+		if context == 'Wait': return
+		key_char = key.c
+		if key.shift:
+			key_char = ord(chr(key_char).upper())
+		self.log['keys'].append(key.vk)
+		self.log['keys'].append(key_char)
+	
+	
+	# finish the current recording and write it to file, unless it is being discarded
+	def Stop(self, discard=False):
+		if self.log is None: return
+		if not discard:
+			with gzip.open(self.filename, 'wt', encoding='utf8') as f:
+				json.dump(self.log, f, separators=(',', ':'))
+		self.log = None
+
+
+
+# Function Timer: wraps functions and methods to record how many times they are called and how
+# long they take; used to time the phases of a replay
+class FunctionTimer:
+	def __init__(self):
+		self.timings = {}			# name: [calls, total seconds, longest call, last call]
+		self.wrapped = []			# owners, attribute names and original functions
+	
+	
+	# replace a function or method with a version that is timed
+	# owner is a class, or this module for a general function
+	def Wrap(self, owner, name, label=None):
+		if label is None:
+			label = name
+		original = getattr(owner, name)
+		timing = [0, 0.0, 0.0, 0.0]
+		self.timings[label] = timing
+		
+		def TimedFunction(*args, **kwargs):
+			start_time = time.perf_counter()
+			try:
+				return original(*args, **kwargs)
+			finally:
+				elapsed = time.perf_counter() - start_time
+				timing[0] += 1
+				timing[1] += elapsed
+				if elapsed > timing[2]:
+					timing[2] = elapsed
+				timing[3] = elapsed
+		
+		setattr(owner, name, TimedFunction)
+		self.wrapped.append((owner, name, original))
+	
+	
+	# restore all the original functions and methods
+	def UnwrapAll(self):
+		for (owner, name, original) in reversed(self.wrapped):
+			setattr(owner, name, original)
+		self.wrapped = []
+	
+	
+	# return a dictionary of timing results for each function
+	def GetResults(self):
+		results = {}
+		for label, (calls, total, longest, last) in self.timings.items():
+			results[label] = {
+				'calls' : calls,
+				'total' : round(total, 4),
+				'mean_ms' : round(total * 1000.0 / calls, 3) if calls > 0 else 0.0,
+				'max_ms' : round(longest * 1000.0, 3),
+				'last_ms' : round(last * 1000.0, 3)
+			}
+		return results
+	
+	
+	# return a list of labels and timings of the functions that have taken the most total time
+	def GetHotspots(self, num):
+		timing_list = []
+		for label, timing in self.timings.items():
+			if timing[0] == 0: continue
+			timing_list.append((label, timing))
+		timing_list.sort(key=lambda x: x[1][1], reverse=True)
+		return timing_list[:num]
+
+
+
+# Profiler: times the functions in PROFILED_FUNCTIONS for the whole session in debug mode, and
+# records how long each scenario phase took to play the last time it was played; can also draw
+# these timings on screen, and run a full cProfile of the session
+class Profiler:
+	def __init__(self):
+		self.timer = FunctionTimer()
+		for (owner_name, name) in PROFILED_FUNCTIONS:
+			if owner_name is None:
+				self.timer.Wrap(sys.modules[__name__], name)
+			else:
+				self.timer.Wrap(globals()[owner_name], name, label=owner_name + '.' + name)
+		
+		self.phase_times = {}			# seconds taken by each scenario phase
+		self.phase_start = time.perf_counter()	# time that the current phase started
+		self.show_overlay = False		# timing overlay is displayed
+		self.overlay_con = None			# console for timing overlay
+		self.session_profile = None		# cProfile of the session, once started
+	
+	
+	# record the end of a scenario phase and the start of the next
+	def EndPhase(self, phase):
+		now = time.perf_counter()
+		self.phase_times[SCEN_PHASE_NAMES[phase]] = now - self.phase_start
+		self.phase_start = now
+	
+	
+	# start a cProfile of the session if not already running, otherwise write what has been
+	# recorded so far to a file; returns the filename, or None if the profile was just started
+	def StartOrDumpSessionProfile(self):
+		if self.session_profile is None:
+			self.session_profile = cProfile.Profile()
+			self.session_profile.enable()
+			return None
+		filename = 'ArmCom2_Profile_' + datetime.now().strftime("%Y-%m-%d_%H_%M_%S") + '.pstats'
+		self.session_profile.disable()
+		self.session_profile.dump_stats(filename)
+		self.session_profile.enable()
+		return filename
+	
+	
+	# draw the timing overlay to the top right of the root console
+	# module is the libtcod module itself, so that drawing the overlay doesn't count as a change
+	# to the screen
+	def DrawOverlay(self, module, frame_time):
+		width = 34
+		height = 5 + len(SCEN_PHASE_NAMES) + PROFILE_OVERLAY_HOTSPOTS
+		if self.overlay_con is None:
+			self.overlay_con = module.console_new(width, height)
+		con = self.overlay_con
+		module.console_set_default_background(con, libtcod.darkest_grey)
+		module.console_set_default_foreground(con, libtcod.white)
+		module.console_clear(con)
+		
+		module.console_print(con, 1, 0, 'Frame: ' + str(round(frame_time * 1000.0, 1)) + ' ms')
+		
+		y = 2
+		module.console_set_default_foreground(con, libtcod.light_blue)
+		module.console_print(con, 1, y, 'Last Phase Times (ms)')
+		module.console_set_default_foreground(con, libtcod.light_grey)
+		for phase_name in SCEN_PHASE_NAMES:
+			y += 1
+			if phase_name not in self.phase_times: continue
+			module.console_print(con, 1, y, phase_name)
+			module.console_print_ex(con, width-2, y, libtcod.BKGND_NONE, libtcod.RIGHT,
+				str(round(self.phase_times[phase_name] * 1000.0, 1)))
+		
+		y += 2
+		module.console_set_default_foreground(con, libtcod.light_blue)
+		module.console_print(con, 1, y, 'Hotspots (total ms/calls)')
+		module.console_set_default_foreground(con, libtcod.light_grey)
+		for (label, timing) in self.timer.GetHotspots(PROFILE_OVERLAY_HOTSPOTS):
+			y += 1
+			module.console_print(con, 1, y, label[:21])
+			module.console_print_ex(con, width-2, y, libtcod.BKGND_NONE, libtcod.RIGHT,
+				str(int(timing[1] * 1000.0)) + '/' + str(timing[0]))
+		
+		module.console_blit(con, 0, 0, 0, 0, 0, WINDOW_WIDTH-width, 0, 1.0, 0.8)
+
+
+
+# Event Trace: writes a stream of game events, one JSON object per line, so that many battles
+# can be analyzed later; events are held in a fixed-size ring buffer and written by a
+# background thread so that the game never waits on the file; if the writer falls behind, the
+# oldest events are dropped and a count of them is written in their place
+class EventTrace:
+	def __init__(self, filename, max_events=EVENT_TRACE_BUFFER_SIZE):
+		self.filename = filename
+		self.events = deque(maxlen=max_events)
+		self.dropped = 0			# events lost since the last write
+		self.lock = threading.Lock()
+		self.wake = threading.Event()
+		self.stopping = False
+		if filename.endswith('.gz'):
+			self.file = gzip.open(filename, 'wt', encoding='utf8')
+		else:
+			self.file = open(filename, 'w', encoding='utf8')
+		self.thread = threading.Thread(target=self.WriteLoop, name='EventTrace', daemon=True)
+		self.thread.start()
+		
+		# make sure buffered events are written even if the game window is closed
+		atexit.register(self.Close)
+	
+	
+	# add an event to the buffer, waking the writer early if the buffer is half full
+	def Add(self, event):
+		with self.lock:
+			if len(self.events) == self.events.maxlen:
+				self.dropped += 1
+			self.events.append(event)
+			filling = len(self.events) >= self.events.maxlen // 2
+		if filling:
+			self.wake.set()
+	
+	
+	# remove and return all buffered events, preceded by a record of any that were dropped
+	def TakeEvents(self):
+		with self.lock:
+			event_list = list(self.events)
+			self.events.clear()
+			if self.dropped > 0:
+				event_list.insert(0, {'type' : 'dropped', 't' : round(time.time(), 3),
+					'count' : self.dropped})
+				self.dropped = 0
+		return event_list
+	
+	
+	# write buffered events at regular intervals until the trace is closed, run by the
+	# writer thread
+	def WriteLoop(self):
+		while True:
+			self.wake.wait(EVENT_TRACE_WRITE_INTERVAL)
+			self.wake.clear()
+			stopping = self.stopping
+			event_list = self.TakeEvents()
+			if len(event_list) > 0:
+				lines = [json.dumps(event, separators=(',', ':'), default=str) for event in event_list]
+				self.file.write('\n'.join(lines) + '\n')
+				self.file.flush()
+			if stopping: return
+	
+	
+	# write any remaining events and close the file
+	def Close(self):
+		if self.file is None: return
+		self.stopping = True
+		self.wake.set()
+		self.thread.join()
+		self.file.close()
+		self.file = None
+		atexit.unregister(self.Close)
+
+
+
 ##########################################################################################
 #                                  General Functions                                     #
 ##########################################################################################	
@@ -15930,7 +17669,7 @@ def ShowSkillMenu(crewman):
 			
 			if libtcod.console_is_window_closed(): sys.exit()
 			libtcod.console_flush()
-			keypress = GetInputEvent()
+			keypress = GetInputEvent('ShowSkillMenu')
 			
 			if not keypress: continue
 			
@@ -16037,7 +17776,8 @@ def DisplayTimeInfo(console):
 	text = str(campaign_day.day_clock['hour']).zfill(2) + ':' + str(campaign_day.day_clock['minute']).zfill(2)
 	libtcod.console_print_ex(console, 10, 1, libtcod.BKGND_NONE, libtcod.CENTER, text)
 	
-	if scenario is None: return
+	# no scenario, or saved scenario not loaded yet
+	if scenario is None or isinstance(scenario, SavedScenario): return
 	
 	# current phase
 	libtcod.console_set_default_foreground(console, SCEN_PHASE_COL[scenario.phase])
@@ -16077,7 +17817,7 @@ def DisplayWeatherInfo(console):
 		# clear
 		num = 0
 	
-	cell_list = (sample(list(range(18)), 18) + sample(list(range(18)), 18))
+	cell_list = (GetRNG('cosmetic').sample(list(range(18)), 18) + GetRNG('cosmetic').sample(list(range(18)), 18))
 	for i in range(num):
 		libtcod.console_set_char_background(console, cell_list[i], 0, libtcod.dark_grey,
 			libtcod.BKGND_SET)
@@ -16111,8 +17851,8 @@ def DisplayWeatherInfo(console):
 		num = 0
 	
 	for i in range(num):
-		x = libtcod.random_get_int(0, 0, 18)
-		y = libtcod.random_get_int(0, 2, 7)
+		x = GetRNG('cosmetic').randint(0, 18)
+		y = GetRNG('cosmetic').randint(2, 7)
 		libtcod.console_put_char(console, x, y, char)
 	
 	if campaign_day.weather['Precipitation'] != 'None':
@@ -16220,7 +17960,7 @@ def ShowMessage(text, longer_pause=False, portrait=None, cd_highlight=None, scen
 	if portrait is not None:
 		libtcod.console_set_default_background(session.msg_con, PORTRAIT_BG_COL)
 		libtcod.console_rect(session.msg_con, 1, 1, 25, 8, True, libtcod.BKGND_SET)
-		libtcod.console_blit(LoadXP(portrait), 0, 0, 0, 0, session.msg_con, 1, 1)
+		libtcod.console_blit(LoadXP(portrait, shared=True), 0, 0, 0, 0, session.msg_con, 1, 1)
 		libtcod.console_set_default_background(session.msg_con, libtcod.black)
 	
 	# display message
@@ -16266,9 +18006,23 @@ def ShowMessage(text, longer_pause=False, portrait=None, cd_highlight=None, scen
 
 
 # get keyboard and/or mouse event; returns False if no new key press
-def GetInputEvent():
+# context is the name of the input loop asking for the event; if running headless or replaying,
+# the key press comes from the player policy instead
+def GetInputEvent(context):
+	if session.player_policy is not None:
+		(key.vk, key.c) = session.player_policy.GetKey(context)
+		return True
+	libtcod.WaitForFrame()
 	event = libtcod.sys_check_for_event(libtcod.EVENT_KEY_RELEASE|libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE,
 		key, mouse)
+	
+	# mouse clicks and wheel movements are not recorded, so they are ignored while recording;
+	# moving the cursor only changes what is displayed
+	if session.recorder is not None and session.recorder.log is not None:
+		mouse.rbutton_pressed = False
+		mouse.wheel_up = False
+		mouse.wheel_down = False
+	
 	if session.key_down:
 		if event != libtcod.EVENT_KEY_RELEASE:
 			return False
@@ -16276,6 +18030,8 @@ def GetInputEvent():
 	if event != libtcod.EVENT_KEY_PRESS:
 		return False
 	session.key_down = True
+	if session.recorder is not None:
+		session.recorder.RecordKey(context)
 	return True
 
 
@@ -16292,6 +18048,9 @@ def FlushKeyboardEvents():
 # wait for a specified amount of miliseconds, refreshing the screen in the meantime
 def Wait(wait_time, allow_skip=False, ignore_animations=False):
 	
+	# no need to wait if nobody is watching or if replaying at full speed
+	if headless or session.player_policy is not None: return
+	
 	# check for debug fast mode
 	if DEBUG:
 		if session.debug['Fast Mode']:
@@ -16306,7 +18065,7 @@ def Wait(wait_time, allow_skip=False, ignore_animations=False):
 			CheckForAnimationUpdate()
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('Wait'): continue
 		
 		if allow_skip:
 			if key.vk == libtcod.KEY_ENTER:
@@ -16328,7 +18087,7 @@ def WaitForContinue(allow_cancel=False, ignore_animations=False):
 		
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('WaitForContinue'): continue
 		
 		if key.vk == libtcod.KEY_BACKSPACE and allow_cancel:
 			end_pause = True
@@ -16342,6 +18101,13 @@ def WaitForContinue(allow_cancel=False, ignore_animations=False):
 
 # check for animation frame update and console update
 def CheckForAnimationUpdate():
+	
+	# nothing is drawn when headless, so any animation being waited on is finished at once
+	if headless:
+		if scenario is not None and not isinstance(scenario, SavedScenario):
+			scenario.ResetAnimation()
+		return
+	
 	if scenario is not None:
 		if scenario.init_complete:
 			if time.time() - session.anim_timer >= ANIM_UPDATE_TIMER:
@@ -16360,121 +18126,125 @@ def CheckForAnimationUpdate():
 		libtcod.console_blit(session.msg_con, 0, 0, 0, 0, 0, x, y)
 
 
-# load a console image from an .xp file
-def LoadXP(filename):
+# load a console image from an .xp file, via the image cache
+# if shared is True, returns the cached console itself, which must only be blitted from and
+# only before the next call to LoadXP()
+def LoadXP(filename, shared=False):
+	if headless: return None
 	# make sure that required file exists and, if not, return a placeholder console
-	if not os.path.exists(DATAPATH + filename):
+	if not xp_cache.Exists(filename):
 		console = libtcod.console_new(1, 1)
 		libtcod.console_put_char_ex(console, 0, 0, '?', libtcod.red, libtcod.black)
 		return console
-	xp_file = gzip.open(DATAPATH + filename)
-	raw_data = xp_file.read()
-	xp_file.close()
-	xp_data = xp_loader.load_xp_string(raw_data)
-	console = libtcod.console_new(xp_data['width'], xp_data['height'])
-	xp_loader.load_layer_to_console(console, xp_data['layer_data'][0])
-	return console
+	return xp_cache.GetConsole(filename, shared=shared)
 
 
 # returns a path from one campaign day hex zone to another
 # can be set to be blocked by river crossings and/or enemy-held zones
-# based on function from ArmCom 1, which was based on:
-# http://stackoverflow.com/questions/4159331/python-speed-up-an-a-star-pathfinding-algorithm
+# A* search using a binary heap for the open list; pathfinding info is kept locally rather than
+# on the zone hexes, and results are cached until zone control or rivers change
+# based on:
 # http://www.policyalmanac.org/games/aStarTutorial.htm
 def GetHexPath(hx1, hy1, hx2, hy2, rivers_block=True, enemy_zones_block=False):
 	
-	# retrace a set of nodes and return the best path
-	def RetracePath(end_node):
-		path = []
-		node = end_node
-		done = False
-		while not done:
-			path.append((node.hx, node.hy))
-			if node.parent is None: break	# we've reached the end
-			node = node.parent	
-		path.reverse()
-		return path
+	global hex_path_cache_day
 	
 	# sanity check
 	if campaign_day is None:
 		print('ERROR: Tried to generate a hex path without a campaign day object!')
 		return []
 	
-	# clear any old pathfinding info
-	for (hx, hy) in CAMPAIGN_DAY_HEXES:
-		campaign_day.map_hexes[(hx,hy)].ClearPathInfo()
-	
-	node1 = campaign_day.map_hexes[(hx1, hy1)]
-	node2 = campaign_day.map_hexes[(hx2, hy2)]
-	open_list = set()	# contains the nodes that may be traversed by the path
-	closed_list = set()	# contains the nodes that will be traversed by the path
-	start = node1
-	start.h = GetHexDistance(node1.hx, node1.hy, node2.hx, node2.hy)
-	start.f = start.g + start.h
-	end = node2
-	open_list.add(start)		# add the start node to the open list
+	# cached paths are only good for the campaign day map that they were generated on
+	if hex_path_cache_day is not campaign_day:
+		ClearHexPathCache()
+		hex_path_cache_day = campaign_day
 	
+	cache_key = (hx1, hy1, hx2, hy2, rivers_block, enemy_zones_block)
+	if cache_key in hex_path_cache:
+		return hex_path_cache[cache_key].copy()
+	
+	start = CD_HEX_INDEX[(hx1, hy1)]
+	end = CD_HEX_INDEX[(hx2, hy2)]
+	distances = CD_HEX_DISTANCE[end]
+	
+	# pathfinding info for each zone, by zone index
+	g_scores = [None] * len(CAMPAIGN_DAY_HEXES)	# cost of best known path to zone
+	parents = [-1] * len(CAMPAIGN_DAY_HEXES)	# previous zone on best known path
+	closed_list = [False] * len(CAMPAIGN_DAY_HEXES)	# zone has already been expanded
+	g_scores[start] = 0
+	
+	# open list entries are (f score, order added, zone index); order added breaks ties so that
+	# zones with equal f scores are expanded first in, first out
+	open_list = [(distances[start], 0, start)]
+	order = 0
+	
+	path = []
 	while open_list:
 		
-		# grab the node with the best H value from the list of open nodes
-		current = sorted(open_list, key=lambda inst:inst.f)[0]
+		# grab the zone with the best f score from the open list
+		(f, i, current) = heapq.heappop(open_list)
+		
+		# skip entries for zones that were later reached by a better path
+		if closed_list[current]: continue
 		
-		# we've reached our destination
+		# we've reached our destination: retrace the path back to the start
 		if current == end:
-			return RetracePath(current)
+			while current != -1:
+				path.append(CAMPAIGN_DAY_HEXES[current])
+				current = parents[current]
+			path.reverse()
+			break
 		
-		# move this node from the open to the closed list
-		open_list.remove(current)
-		closed_list.add(current)
+		closed_list[current] = True
+		current_hex = campaign_day.map_hexes[CAMPAIGN_DAY_HEXES[current]]
 		
-		# add the nodes connected to this one to the open list
+		# add the zones connected to this one to the open list
 		for direction in range(6):
 			
-			# get the hex coordinates in this direction
-			hx, hy = campaign_day.GetAdjacentCDHex(current.hx, current.hy, direction)
+			node = CD_HEX_NEIGHBOURS[current][direction]
 			
 			# no map hex exists here, skip
-			if (hx, hy) not in CAMPAIGN_DAY_HEXES: continue
+			if node == -1: continue
 			
-			node = campaign_day.map_hexes[(hx,hy)]
+			# ignore zones on closed list
+			if closed_list[node]: continue
 			
-			# ignore nodes on closed list
-			if node in closed_list: continue
+			map_hex = campaign_day.map_hexes[CAMPAIGN_DAY_HEXES[node]]
 			
 			# check for route blocking both ways
 			if rivers_block:
-				if direction in campaign_day.map_hexes[(current.hx, current.hy)].rivers:
-					if direction not in campaign_day.map_hexes[(current.hx, current.hy)].bridges:
+				if direction in current_hex.rivers:
+					if direction not in current_hex.bridges:
 						continue
-				if ConstrainDir(direction + 3) in campaign_day.map_hexes[(hx, hy)].rivers:
-					if ConstrainDir(direction + 3) not in campaign_day.map_hexes[(hx, hy)].bridges:
+				if ConstrainDir(direction + 3) in map_hex.rivers:
+					if ConstrainDir(direction + 3) not in map_hex.bridges:
 						continue
 			
 			if enemy_zones_block:
-				if node.controlled_by == 1:
+				if map_hex.controlled_by == 1:
 					continue
 			
 			# not really used yet
 			cost = 1
 			
-			g = current.g + cost
+			g = g_scores[current] + cost
 			
-			# if not in open list, add it
-			if node not in open_list:
-				node.g = g
-				node.h = GetHexDistance(node.hx, node.hy, node2.hx, node2.hy)
-				node.f = node.g + node.h
-				node.parent = current
-				open_list.add(node)
-			# if already in open list, check to see if can make a better path
-			else:
-				if g < node.g:
-					node.parent = current
-					node.g = g
-					node.f = node.g + node.h
+			# add to the open list if not yet reached, or if this is a better path
+			if g_scores[node] is None or g < g_scores[node]:
+				g_scores[node] = g
+				parents[node] = current
+				order += 1
+				heapq.heappush(open_list, (g + distances[node], order, node))
 	
-	# no path possible
-	return []
+	# if no path possible, this will be an empty list
+	hex_path_cache[cache_key] = path
+	return path.copy()
+
+
+# clear all cached campaign day hex paths; must be called whenever zone control or rivers and
+# bridges change on the campaign day map
+def ClearHexPathCache():
+	hex_path_cache.clear()
 
 
 # Bresenham's Line Algorithm (based on an implementation on the roguebasin wiki)
@@ -16538,8 +18308,24 @@ def GetCubeCoords(hx, hy):
 	return (x, y, z)
 
 
+# returns distance in zones between two zones on the campaign day map, using the precalculated
+# distance table if both are on the map
+def GetCDHexDistance(hx1, hy1, hx2, hy2):
+	if (hx1, hy1) in CD_HEX_INDEX and (hx2, hy2) in CD_HEX_INDEX:
+		return CD_HEX_DISTANCE[CD_HEX_INDEX[(hx1, hy1)]][CD_HEX_INDEX[(hx2, hy2)]]
+	return GetHexDistance(hx1, hy1, hx2, hy2)
+
+
 # returns distance in hexes between two hexes
 def GetHexDistance(hx1, hy1, hx2, hy2):
+	key = (hx1, hy1, hx2, hy2)
+	if key in hex_geometry.distances:
+		return hex_geometry.distances[key]
+	return CalcHexDistance(hx1, hy1, hx2, hy2)
+
+
+# calculates distance in hexes between two hexes
+def CalcHexDistance(hx1, hy1, hx2, hy2):
 	(x1, y1, z1) = GetCubeCoords(hx1, hy1)
 	(x2, y2, z2) = GetCubeCoords(hx2, hy2)
 	return int((abs(x1-x2) + abs(y1-y2) + abs(z1-z2)) / 2)
@@ -16547,6 +18333,14 @@ def GetHexDistance(hx1, hy1, hx2, hy2):
 
 # rotates a hex location around 0,0 clockwise r times
 def RotateHex(hx, hy, r):
+	key = (hx, hy, r)
+	if key in hex_geometry.rotations:
+		return hex_geometry.rotations[key]
+	return CalcRotateHex(hx, hy, r)
+
+
+# calculates a hex location rotated around 0,0 clockwise r times
+def CalcRotateHex(hx, hy, r):
 	# convert to cube coords
 	(xx, yy, zz) = GetCubeCoords(hx, hy)
 	for r in range(r):
@@ -16580,8 +18374,16 @@ def GetDirectionalArrow(direction):
 
 
 # return a list of hexes along a line from hex1 to hex2
-# adapted from http://www.redblobgames.com/grids/hexagons/implementation.html#line-drawing
 def GetHexLine(hx1, hy1, hx2, hy2):
+	key = (hx1, hy1, hx2, hy2)
+	if key in hex_geometry.lines:
+		return list(hex_geometry.lines[key])
+	return CalcHexLine(hx1, hy1, hx2, hy2)
+
+
+# calculates a list of hexes along a line from hex1 to hex2
+# adapted from http://www.redblobgames.com/grids/hexagons/implementation.html#line-drawing
+def CalcHexLine(hx1, hy1, hx2, hy2):
 	
 	def Lerp(a, b, t):
 		a = float(a)
@@ -16625,6 +18427,14 @@ def GetHexLine(hx1, hy1, hx2, hy2):
 
 # returns a ring of hexes around a center point for a given radius
 def GetHexRing(hx, hy, radius):
+	key = (hx, hy, radius)
+	if key in hex_geometry.rings:
+		return list(hex_geometry.rings[key])
+	return CalcHexRing(hx, hy, radius)
+
+
+# calculates a ring of hexes around a center point for a given radius
+def CalcHexRing(hx, hy, radius):
 	if radius == 0: return [(hx, hy)]
 	hex_list = []
 	# get starting point
@@ -16651,11 +18461,16 @@ def GetDirectionToAdjacent(hx1, hy1, hx2, hy2):
 
 # returns the best facing to point in the direction of the target hex
 def GetDirectionToward(hx1, hy1, hx2, hy2):
-	
+	key = (hx1, hy1, hx2, hy2)
+	if key in hex_geometry.directions:
+		return hex_geometry.directions[key]
 	(x1, y1) = scenario.PlotHex(hx1, hy1)
 	(x2, y2) = scenario.PlotHex(hx2, hy2)
-	bearing = GetBearing(x1, y1, x2, y2)
-	
+	return GetDirectionForBearing(GetBearing(x1, y1, x2, y2))
+
+
+# returns the facing that best points toward a given compass bearing
+def GetDirectionForBearing(bearing):
 	if bearing >= 330 or bearing <= 30:
 		return 0
 	elif bearing <= 90:
@@ -16672,12 +18487,20 @@ def GetDirectionToward(hx1, hy1, hx2, hy2):
 # return a list of hexes covered by the given hextant in direction d from hx, hy
 # max range is 3
 def GetCoveredHexes(hx, hy, d):
+	key = (hx, hy, d)
+	if key in hex_geometry.covered_hexes:
+		return list(hex_geometry.covered_hexes[key])
+	return CalcCoveredHexes(hx, hy, d)
+
+
+# calculates a list of hexes covered by the given hextant in direction d from hx, hy
+def CalcCoveredHexes(hx, hy, d):
 	hex_list = []
 	hex_list.append((hx, hy))
 	for i in range(2):
 		(hx, hy) = GetAdjacentHex(hx, hy, d)
 	hex_list.append((hx, hy))
-	hex_list += GetHexRing(hx, hy, 1)
+	hex_list += CalcHexRing(hx, hy, 1)
 	return hex_list
 
 
@@ -16716,8 +18539,36 @@ def GetFacing(attacker, target, turret_facing=False):
 
 
 # return a random float between 0.0 and 100.0
-def GetPercentileRoll():
-	return float(libtcod.random_get_int(0, 0, 1000)) / 10.0
+def GetPercentileRoll(stream):
+	return float(GetRNG(stream).randint(0, 1000)) / 10.0
+
+
+# return the named random number stream, from the current campaign if any
+def GetRNG(stream):
+	if campaign is not None:
+		return campaign.rng.streams[stream]
+	return session.rng.streams[stream]
+
+
+# add an event to the event trace if one is being written, along with the time, the campaign
+# date and time of day, and the scenario turn and phase
+# units are recorded by their unit type, owning player, and map location at the time
+def TraceEvent(event_type, **fields):
+	if session.trace is None: return
+	event = {'type' : event_type, 't' : round(time.time(), 3)}
+	if campaign is not None:
+		event['date'] = campaign.today
+	if campaign_day is not None:
+		event['clock'] = str(campaign_day.day_clock['hour']).zfill(2) + ':' + str(campaign_day.day_clock['minute']).zfill(2)
+	if scenario is not None and not isinstance(scenario, SavedScenario):
+		event['turn'] = scenario.current_turn
+		event['phase'] = SCEN_PHASE_NAMES[scenario.phase]
+	for name, value in fields.items():
+		if isinstance(value, Unit):
+			value = {'unit_id' : value.unit_id, 'player' : value.owning_player,
+				'hx' : value.hx, 'hy' : value.hy}
+		event[name] = value
+	session.trace.Add(event)
 
 
 # return a percentage chance based on a given 2d6 score
@@ -16756,18 +18607,63 @@ def RestrictChance(chance):
 def SaveGame():
 	if DEBUG:
 		if session.debug['Suspend Save']: return
-	path = SAVEPATH + campaign.filename + os.sep
-	if not os.path.isdir(path): os.mkdir(path)
-	save = shelve.open(path + 'savegame', 'n')
-	save['campaign'] = campaign
-	save['campaign_day'] = campaign_day
-	save['scenario'] = scenario
-	save['version'] = VERSION
-	save['datetime'] = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
-	save.close()
-
-
-# load a saved game
+	if headless: return
+	save_writer.Save(campaign.filename, campaign, campaign_day, scenario)
+
+
+# return a summary of a saved campaign for the load campaign menu, so that the menu doesn't
+# have to load the whole campaign object
+def GetSavedGameInfo(saved_campaign, version, saved_datetime):
+	info = {}
+	info['version'] = version
+	info['datetime'] = saved_datetime
+	info['campaign_name'] = saved_campaign.stats['name']
+	info['total_vp'] = saved_campaign.player_vp
+	info['date'] = saved_campaign.today
+	info['player_unit_id'] = saved_campaign.player_unit.unit_id
+	info['player_unit_name'] = saved_campaign.player_unit.unit_name
+	return info
+
+
+# read the summary of a saved campaign, returns None if the save is missing essential information
+# games saved before summaries were added have one generated from the full campaign and stored
+def LoadSavedGameInfo(directory):
+	
+	filename = SAVEPATH + directory + os.sep + SAVE_FILE
+	if os.path.exists(filename):
+		try:
+			header = save_writer.ReadHeader(filename)
+		except SavedGameError as e:
+			print('ERROR: ' + directory + ': ' + str(e))
+			return None
+		info = header['info']
+		info['schema'] = header['schema']
+		return info
+	
+	# game saved in the older format
+	with shelve.open(SAVEPATH + directory + os.sep + 'savegame', flag='r') as save:
+		
+		# check to see if save file has essential information
+		if 'version' not in save: return None
+		
+		saved_version = save['version']
+		info = save.get('info')
+	
+	# older saves have no schema, and can only be loaded if they come from a compatible game
+	# version, in which case they are treated as schema 0
+	if CheckSavedGameVersion(saved_version) != '':
+		return None
+	
+	# only unpickle the campaign and store its summary if the save can be loaded
+	if info is None:
+		with shelve.open(SAVEPATH + directory + os.sep + 'savegame') as save:
+			info = GetSavedGameInfo(save['campaign'], save['version'], save['datetime'])
+			save['info'] = info
+	info['schema'] = 0
+	return info
+
+
+# load a saved game, returns False if the saved game is damaged and could not be loaded
 def LoadGame(directory):
 	global campaign, campaign_day, scenario
 	
@@ -16776,11 +18672,50 @@ def LoadGame(directory):
 		'Loading...')
 	libtcod.console_flush()
 	
-	save = shelve.open(SAVEPATH + directory + os.sep + 'savegame')
-	campaign = save['campaign']
-	campaign_day = save['campaign_day']
-	scenario = save['scenario']
-	save.close()
+	# make sure that any save in progress has been written
+	save_writer.Wait()
+	
+	filename = SAVEPATH + directory + os.sep + SAVE_FILE
+	try:
+		if os.path.exists(filename):
+			sections = save_writer.Read(filename)
+		
+		# game saved in the older format
+		else:
+			try:
+				with shelve.open(SAVEPATH + directory + os.sep + 'savegame', flag='r') as save:
+					sections = {
+						'game' : (save['campaign'], save['campaign_day']),
+						'scenario' : save['scenario']
+					}
+			except Exception as e:
+				raise SavedGameError('Saved game could not be read: ' + str(e))
+	
+	except SavedGameError as e:
+		print('ERROR: ' + directory + ': ' + str(e))
+		ShowNotification('Saved campaign ' + directory + ' is damaged and cannot be loaded.')
+		return False
+	
+	(campaign, campaign_day) = sections['game']
+	scenario = sections['scenario']
+	for name in SAVE_HISTORY_SECTIONS:
+		if name in sections:
+			setattr(campaign, name, sections[name])
+	
+	return True
+
+
+# check whether a saved game can be loaded; its schema must be no newer than the current one
+def CheckSavedGameCompatible(game_info):
+	return game_info['schema'] <= SAVE_SCHEMA_VERSION
+
+
+# give an object loaded from a saved game the default value of any attribute that has been
+# added to its class since the game was saved
+def SetSavedDefaults(obj):
+	for (name, GetDefault) in SAVED_ATTRIBUTE_DEFAULTS[type(obj).__name__].items():
+		if name not in obj.__dict__:
+			setattr(obj, name, GetDefault(obj))
 
 
 # check the saved game to see if it is compatible with the current game version
@@ -16802,10 +18737,11 @@ def CheckSavedGameVersion(saved_version):
 
 # remove a saved game
 def EraseGame(directory):
-	os.remove(SAVEPATH + directory + os.sep + 'savegame.dat')
-	os.remove(SAVEPATH + directory + os.sep + 'savegame.dir')
-	os.remove(SAVEPATH + directory + os.sep + 'savegame.bak')
-	os.remove(SAVEPATH + directory)
+	save_writer.Wait()
+	for filename in [SAVE_FILE, SAVE_FILE + '.tmp', 'savegame.dat', 'savegame.dir', 'savegame.bak']:
+		if os.path.exists(SAVEPATH + directory + os.sep + filename):
+			os.remove(SAVEPATH + directory + os.sep + filename)
+	os.rmdir(SAVEPATH + directory)
 	
 
 # try to load game settings from config file
@@ -16886,7 +18822,7 @@ def ShowNotification(text, confirm=False):
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
 		
-		if not GetInputEvent(): continue
+		if not GetInputEvent('ShowNotification'): continue
 		key_char = chr(key.c).lower()
 		
 		if confirm:
@@ -16987,7 +18923,7 @@ def ShowSwapPositionMenu():
 	while not exit_menu:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('ShowSwapPositionMenu'): continue
 		
 		# quit menu
 		if key.vk == libtcod.KEY_ESCAPE:
@@ -17128,7 +19064,7 @@ def ShowGameMenu():
 	while not exit_menu:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('ShowGameMenu'): continue
 		
 		if key.vk == libtcod.KEY_ESCAPE:
 			exit_menu = True
@@ -17327,7 +19263,7 @@ def ShowTextInputMenu(prompt, original_text, max_length, string_list):
 	while not exit_menu:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('ShowTextInputMenu'): continue
 		
 		# ignore shift key being pressed
 		if key.vk == libtcod.KEY_SHIFT:
@@ -17348,7 +19284,7 @@ def ShowTextInputMenu(prompt, original_text, max_length, string_list):
 		# select random string from list if any
 		elif key.vk == libtcod.KEY_TAB:
 			if len(string_list) == 0: continue
-			text = choice(string_list)
+			text = GetRNG('cosmetic').choice(string_list)
 		
 		# clear string
 		elif key.vk == libtcod.KEY_DELETE:
@@ -17414,7 +19350,7 @@ def GetOption(option_list):
 	while not exit_menu:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('GetOption'): continue
 		
 		if key.vk == libtcod.KEY_ESCAPE:
 			exit_menu = True
@@ -17462,7 +19398,7 @@ def ShowDebugMenu():
 		x = 50
 		y = 8
 		libtcod.console_set_default_foreground(con, ACTION_KEY_COL)
-		for xm in range(7):
+		for xm in range(len(DEBUG_OPTIONS)):
 			libtcod.console_print(con, x, y+(xm*2), str(xm+1))
 		
 		libtcod.console_set_default_foreground(con, libtcod.light_grey)
@@ -17497,7 +19433,7 @@ def ShowDebugMenu():
 	while not exit_menu:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('ShowDebugMenu'): continue
 		
 		if key.vk == libtcod.KEY_ESCAPE:
 			exit_menu = True
@@ -17604,6 +19540,20 @@ def ShowDebugMenu():
 			DisplayWeatherInfo(cd_weather_con)
 			campaign_day.InitAnimations()
 			exit_menu = True
+		
+		elif text == 'Toggle Timing Overlay':
+			if session.profiler is None: continue
+			session.profiler.show_overlay = not session.profiler.show_overlay
+			exit_menu = True
+		
+		elif text == 'Start/Dump Session Profile':
+			if session.profiler is None: continue
+			filename = session.profiler.StartOrDumpSessionProfile()
+			if filename is None:
+				ShowMessage('Session profile started, select again to write it to a file')
+			else:
+				ShowMessage('Session profile written to ' + filename)
+			exit_menu = True
 	
 	# re-draw original root console
 	libtcod.console_blit(temp_con, 0, 0, 0, 0, 0, 0, 0)
@@ -17731,6 +19681,8 @@ def LoadCampaignMenu(continue_most_recent):
 			'Current VP')
 		libtcod.console_print_ex(con, 74, y+6, libtcod.BKGND_NONE, libtcod.CENTER,
 			'Current Date')
+		libtcod.console_print_ex(con, 74, y+9, libtcod.BKGND_NONE, libtcod.CENTER,
+			'Player Tank')
 		
 		libtcod.console_set_default_foreground(con, libtcod.light_grey)
 		libtcod.console_print_ex(con, 74, y+1, libtcod.BKGND_NONE, libtcod.CENTER,
@@ -17739,6 +19691,11 @@ def LoadCampaignMenu(continue_most_recent):
 			str(selected_save['total_vp']))
 		libtcod.console_print_ex(con, 74, y+7, libtcod.BKGND_NONE, libtcod.CENTER,
 			str(selected_save['date']))
+		text = selected_save['player_unit_id']
+		if selected_save['player_unit_name'] != '':
+			text = selected_save['player_unit_name'] + ' (' + text + ')'
+		libtcod.console_print_ex(con, 74, y+10, libtcod.BKGND_NONE, libtcod.CENTER,
+			text)
 		
 		
 		# display key commands
@@ -17759,23 +19716,14 @@ def LoadCampaignMenu(continue_most_recent):
 	for directory in os.listdir(SAVEPATH):
 		if not os.path.isdir(SAVEPATH + directory): continue
 		
-		game_info = {}
+		game_info = LoadSavedGameInfo(directory)
+		if game_info is None: continue
 		
-		with shelve.open(SAVEPATH + directory + os.sep + 'savegame') as save:
-			
-			# check to see if save file has essential information
-			if 'version' not in save: continue
-			
-			# check for saved game version compatibility
-			if CheckSavedGameVersion(save['version']) != '':
-				continue
-			
-			game_info['directory'] = directory
-			game_info['datetime'] = save['datetime']
-			game_info['campaign_name'] = save['campaign'].stats['name']
-			game_info['total_vp'] = save['campaign'].player_vp
-			game_info['date'] = save['campaign'].today
+		# check for saved game compatibility
+		if not CheckSavedGameCompatible(game_info):
+			continue
 		
+		game_info['directory'] = directory
 		saved_game_list.append(game_info)
 	
 	# make sure there's at least one saved game
@@ -17785,10 +19733,12 @@ def LoadCampaignMenu(continue_most_recent):
 	# sort by most recently saved
 	saved_game_list = sorted(saved_game_list, key=lambda k: k['datetime'], reverse=True)
 	
-	# if we're continuing, load the most recently saved and return
+	# if we're continuing, load the most recently saved and return, skipping any that are damaged
 	if continue_most_recent:
-		LoadGame(saved_game_list[0]['directory'])
-		return True
+		for game_info in saved_game_list:
+			if LoadGame(game_info['directory']):
+				return True
+		return False
 	
 	# otherwise, show menu and get player input
 	
@@ -17798,11 +19748,10 @@ def LoadCampaignMenu(continue_most_recent):
 	# draw menu screen for first time
 	UpdateLoadCampaignScreen(selected_save)
 		
-	exit_menu = False
-	while not exit_menu:
+	while True:
 		if libtcod.console_is_window_closed(): sys.exit()
 		libtcod.console_flush()
-		if not GetInputEvent(): continue
+		if not GetInputEvent('LoadCampaignMenu'): continue
 		
 		# return to main menu without loading a game
 		if key.vk == libtcod.KEY_ESCAPE:
@@ -17810,7 +19759,16 @@ def LoadCampaignMenu(continue_most_recent):
 		
 		# proceed with loading selected campaign
 		elif key.vk == libtcod.KEY_ENTER:
-			exit_menu = True
+			if LoadGame(selected_save['directory']):
+				return True
+			
+			# saved game is damaged, remove it from the list
+			saved_game_list.remove(selected_save)
+			if len(saved_game_list) == 0:
+				return False
+			selected_save = saved_game_list[0]
+			UpdateLoadCampaignScreen(selected_save)
+			continue
 		
 		key_char = DeKey(chr(key.c).lower())
 		
@@ -17831,10 +19789,6 @@ def LoadCampaignMenu(continue_most_recent):
 					selected_save = saved_game_list[i+1]
 			UpdateLoadCampaignScreen(selected_save)
 			continue
-	
-	# load the game and return
-	LoadGame(selected_save['directory'])
-	return True
 
 
 
@@ -17843,13 +19797,12 @@ def LoadCampaignMenu(continue_most_recent):
 #                                     Sound Effects                                      #
 ##########################################################################################
 
-# play a given sample
-def PlaySound(sound_name):
-	sample = mixer.Mix_LoadWAV((SOUNDPATH + sound_name + '.ogg').encode('ascii'))
-	if sample is None:
-		print('ERROR: Sound not found: ' + sound_name)
-		return
-	mixer.Mix_PlayChannel(-1, sample, 0)
+# play a given sample; if all channels are busy, a sound of lower or equal priority will be
+# stopped to make room for it, otherwise it will not be played
+def PlaySound(sound_name, priority=1):
+	if headless: return
+	if session.sound_bank is None: return
+	session.sound_bank.Play(sound_name, priority)
 
 
 # select and play a sound effect for a given situation
@@ -17859,96 +19812,99 @@ def PlaySoundFor(obj, action):
 	if not config['ArmCom2'].getboolean('sounds_enabled'):
 		return
 	
+	# sounds with a higher priority can cut off lower ones if all channels are busy
+	priority = SOUND_PRIORITIES.get(action, 1)
+	
 	if action == 'fire':
 		if obj.GetStat('type') == 'Gun':
 			
 			if obj.GetStat('name') == 'AT Rifle':
-				PlaySound('at_rifle_firing')
+				PlaySound('at_rifle_firing', priority)
 				return
 			
 			# temp - used for all large guns for now
-			PlaySound('37mm_firing_0' + str(libtcod.random_get_int(0, 0, 3)))
+			PlaySound('37mm_firing_0' + str(GetRNG('cosmetic').randint(0, 3)), priority)
 			return
 			
 		if obj.stats['type'] in MG_WEAPONS:
-			PlaySound('zb_53_mg_00')
+			PlaySound('zb_53_mg_00', priority)
 			return
 		
 		if obj.GetStat('name') == 'Rifles':
-			PlaySound('rifle_fire_0' + str(libtcod.random_get_int(0, 0, 3)))
+			PlaySound('rifle_fire_0' + str(GetRNG('cosmetic').randint(0, 3)), priority)
 			return
 		
 		if obj.GetStat('name') == 'Grenades':
-			PlaySound('grenades')
+			PlaySound('grenades', priority)
 			return
 		if obj.GetStat('name') == 'Flame Thrower':
-			PlaySound('flamethrower')
+			PlaySound('flamethrower', priority)
 			return
 		
 	
 	elif action == 'he_explosion':
-		PlaySound('37mm_he_explosion_0' + str(libtcod.random_get_int(0, 0, 1)))
+		PlaySound('37mm_he_explosion_0' + str(GetRNG('cosmetic').randint(0, 1)), priority)
 		return
 	
 	elif action == 'armour_save':
-		PlaySound('armour_save_0' + str(libtcod.random_get_int(0, 0, 1)))
+		PlaySound('armour_save_0' + str(GetRNG('cosmetic').randint(0, 1)), priority)
 		return
 	
 	elif action == 'vehicle_explosion':
-		PlaySound('vehicle_explosion_00')
+		PlaySound('vehicle_explosion_00', priority)
 		return
 	
 	elif action == 'movement':
 		if obj.GetStat('movement_class') in ['Wheeled', 'Fast Wheeled']:
-			PlaySound('wheeled_moving_0' + str(libtcod.random_get_int(0, 0, 2)))
+			PlaySound('wheeled_moving_0' + str(GetRNG('cosmetic').randint(0, 2)), priority)
 			return
 		
 		elif obj.GetStat('class') in ['Tankette', 'Light Tank', 'Medium Tank', 'Heavy Tank', 'Half-Tracked']:
-			PlaySound('light_tank_moving_0' + str(libtcod.random_get_int(0, 0, 2)))
+			PlaySound('light_tank_moving_0' + str(GetRNG('cosmetic').randint(0, 2)), priority)
 			return
 	
 	elif action == 'plane_incoming':
-		PlaySound('plane_incoming_00')
+		PlaySound('plane_incoming_00', priority)
 		return
 	
 	elif action == 'stuka_divebomb':
-		PlaySound('stuka_divebomb_00')
+		PlaySound('stuka_divebomb_00', priority)
 		return
 	
 	elif action == 'ricochet':
-		PlaySound('ricochet')
+		PlaySound('ricochet', priority)
 		return
 	
 	elif action == 'sniper_hit':
-		PlaySound('sniper_hit')
+		PlaySound('sniper_hit', priority)
 		return
 	
 	elif action == 'move_1_shell':
-		PlaySound('shell_move_1')
+		PlaySound('shell_move_1', priority)
 		return
 	
 	elif action == 'move_10_shell':
-		PlaySound('shell_move_10')
+		PlaySound('shell_move_10', priority)
 		return
 	
 	elif action == 'add skill':
-		PlaySound('add_skill')
+		PlaySound('add_skill', priority)
 		return
 	
 	elif action == 'command_select':
-		PlaySound('command_select')
+		PlaySound('command_select', priority)
 		return
 	
 	elif action == 'smoke':
-		PlaySound('smoke')
+		PlaySound('smoke', priority)
 		return
 	
 	elif action == 'hatch':
-		PlaySound('hatch')
+		PlaySound('hatch', priority)
 		return
 	
 	elif action == 'hull_down_save':
-		PlaySound('hull_down_save')
+		PlaySound('hull_down_save', priority)
 		return
 	
 	print ('ERROR: Could not determine which sound to play for action: ' + action)
@@ -17956,46 +19912,399 @@ def PlaySoundFor(obj, action):
 
 
 
+##########################################################################################
+#                                  Headless Simulation                                   #
+##########################################################################################
+
+# start a new campaign, allowing the player to select a campaign and their tank
+# returns False if the player cancelled
+def StartNewCampaign(rng_seed=None):
+	
+	global campaign, campaign_day, scenario
+	
+	# create a new campaign object and allow player to select a campaign
+	campaign = Campaign(rng_seed=rng_seed)
+	if session.recorder is not None:
+		session.recorder.Start(campaign.rng.seed)
+	if not campaign.CampaignSelectionMenu():
+		campaign = None
+		if session.recorder is not None:
+			session.recorder.Stop(discard=True)
+		return False
+	
+	# allow player to select their tank and set their tank name
+	(unit_id, tank_name) = campaign.TankSelectionMenu()
+	
+	# create the player unit
+	campaign.player_unit = Unit(unit_id)
+	campaign.player_unit.unit_name = tank_name
+	campaign.player_unit.nation = campaign.stats['player_nation']
+	campaign.player_unit.GenerateNewPersonnel()
+	campaign.player_unit.ClearGunAmmo()
+	
+	# create a new campaign day
+	campaign_day = CampaignDay()
+	for (hx, hy) in CAMPAIGN_DAY_HEXES:
+		campaign_day.map_hexes[(hx,hy)].CalcCaptureVP()
+	campaign_day.GenerateRoads()
+	campaign_day.GenerateRivers()
+	campaign.AddJournal('Start of day')
+	
+	# placeholder for the currently active scenario
+	scenario = None
+	
+	return True
+
+
+# replay a campaign recorded by an input recorder at full speed, timing the main phases of play
+# returns a dictionary of timing results
+def ReplayCampaign(filename):
+	
+	with gzip.open(filename, 'rt', encoding='utf8') as f:
+		log = json.load(f)
+	if log['version'] != VERSION:
+		print('Warning: recording was made with version ' + log['version'])
+	
+	# use the same keyboard layout as the recording
+	config['ArmCom2']['keyboard'] = str(log['keyboard'])
+	GenerateKeyboards()
+	
+	key_list = []
+	for i in range(0, len(log['keys']), 2):
+		key_list.append((log['keys'][i], log['keys'][i+1]))
+	session.player_policy = ScriptedPlayerPolicy(key_list, fallback=QuitPlayerPolicy())
+	session.exiting = False
+	
+	timer = FunctionTimer()
+	timer.Wrap(Scenario, 'AdvanceToNextPhase')
+	timer.Wrap(AI, 'DoActivation', label='AI.DoActivation')
+	timer.Wrap(CampaignDay, 'UpdateCDMapCon')
+	timer.Wrap(sys.modules[__name__], 'SaveGame')
+	
+	start_time = time.perf_counter()
+	try:
+		if StartNewCampaign(rng_seed=log['seed']):
+			campaign.DoCampaignCalendarLoop()
+	finally:
+		timer.UnwrapAll()
+		session.player_policy = None
+	
+	results = timer.GetResults()
+	results['Total'] = {'calls' : 1, 'total' : round(time.perf_counter() - start_time, 4)}
+	return results
+
+
+# run a new campaign without a game window, using a player policy for all of the player's
+# choices; returns once the campaign has ended or the policy has quit
+def RunHeadlessCampaign(campaign_filename, unit_id, rng_seed, player_policy=None):
+	
+	global campaign, campaign_day, scenario
+	
+	if player_policy is None:
+		player_policy = AutoPlayerPolicy()
+	session.player_policy = player_policy
+	session.exiting = False
+	
+	# set up the campaign as if selected from the main menu, all of its random number streams
+	# are derived from the seed so the same seed and policy will always play the same campaign
+	campaign = Campaign(rng_seed=rng_seed)
+	campaign.LoadCampaign(campaign_filename)
+	campaign.GetTankSelectionList()
+	
+	campaign.player_unit = Unit(unit_id)
+	campaign.player_unit.nation = campaign.stats['player_nation']
+	campaign.player_unit.GenerateNewPersonnel()
+	campaign.player_unit.ClearGunAmmo()
+	
+	campaign_day = CampaignDay()
+	for (hx, hy) in CAMPAIGN_DAY_HEXES:
+		campaign_day.map_hexes[(hx,hy)].CalcCaptureVP()
+	campaign_day.GenerateRoads()
+	campaign_day.GenerateRivers()
+	campaign.AddJournal('Start of day')
+	scenario = None
+	
+	TraceEvent('campaign_start', campaign=campaign_filename, unit_id=unit_id, seed=rng_seed)
+	
+	campaign.DoCampaignCalendarLoop()
+	
+	# record the final day if the policy quit before proceeding to the next one
+	if campaign_day.ended and campaign.today not in campaign.logs:
+		campaign.LogDayRecords()
+
+
+# run a single campaign of a batch, called in a worker process
+# returns a dictionary of results for the campaign
+def RunBatchCampaign(run_options):
+	
+	(campaign_filename, unit_id, rng_seed, days, trace_filename) = run_options
+	
+	# each campaign writes its own event trace, named after its seed
+	session.trace = None
+	if trace_filename is not None:
+		(root, ext) = os.path.splitext(trace_filename)
+		if ext == '.gz':
+			(root, inner_ext) = os.path.splitext(root)
+			ext = inner_ext + ext
+		session.trace = EventTrace(root + '_' + str(rng_seed) + ext)
+	
+	player_policy = AutoPlayerPolicy(days=days)
+	start_time = time.time()
+	RunHeadlessCampaign(campaign_filename, unit_id, rng_seed, player_policy=player_policy)
+	
+	if session.trace is not None:
+		session.trace.Close()
+		session.trace = None
+	
+	# add the final day if the campaign ended before the policy saw it
+	if campaign_day.ended:
+		player_policy.day_vp[campaign.today] = campaign_day.day_vp
+	
+	crew_kia = 0
+	for crewman in player_policy.crew_list:
+		if not crewman.alive:
+			crew_kia += 1
+	
+	results = {}
+	results['seed'] = rng_seed
+	results['days_completed'] = len(campaign.logs)
+	results['player_vp'] = campaign.player_vp
+	results['day_vp'] = [player_policy.day_vp.get(day, 0) for day in campaign.logs]
+	results['survived'] = not campaign.player_oob
+	results['records'] = campaign.records.copy()
+	results['crew_kia'] = crew_kia
+	results['time'] = round(time.time() - start_time, 2)
+	return results
+
+
+# run a batch of headless campaigns with consecutive random number seeds, spread over a pool
+# of worker processes, and write a summary of the results to a JSON file
+def RunCampaignBatch(campaign_filename, unit_id, runs, first_seed=0, days=None, processes=None,
+	output_filename='batch_results.json', trace_filename=None):
+	
+	run_list = []
+	for rng_seed in range(first_seed, first_seed + runs):
+		run_list.append((campaign_filename, unit_id, rng_seed, days, trace_filename))
+	
+	start_time = time.time()
+	results_list = []
+	with multiprocessing.Pool(processes) as pool:
+		for results in pool.imap_unordered(RunBatchCampaign, run_list):
+			results_list.append(results)
+			print('Run ' + str(len(results_list)) + '/' + str(runs) + ' (seed ' +
+				str(results['seed']) + '): ' + str(results['days_completed']) +
+				' days, ' + str(results['player_vp']) + ' VP')
+	results_list.sort(key=lambda x: x['seed'])
+	
+	# combine results from all runs
+	total_days = sum([results['days_completed'] for results in results_list])
+	total_vp = sum([results['player_vp'] for results in results_list])
+	summary = {}
+	summary['campaign'] = campaign_filename
+	summary['unit_id'] = unit_id
+	summary['version'] = VERSION
+	summary['runs'] = runs
+	summary['days_completed'] = total_days
+	summary['average_days_completed'] = round(total_days / runs, 2)
+	summary['vp_per_day'] = 0.0
+	if total_days > 0:
+		summary['vp_per_day'] = round(total_vp / total_days, 2)
+	summary['survival_rate'] = round(len([results for results in results_list if results['survived']]) / runs, 3)
+	summary['records'] = {}
+	for text in RECORD_LIST:
+		summary['records'][text] = sum([results['records'][text] for results in results_list])
+	summary['crew_kia'] = sum([results['crew_kia'] for results in results_list])
+	summary['time'] = round(time.time() - start_time, 2)
+	summary['run_list'] = results_list
+	
+	with open(output_filename, 'w', encoding='utf8') as f:
+		json.dump(summary, f, indent=1)
+	
+	return summary
+
+
+# build the parser for command line options
+def GetCommandLineParser():
+	parser = argparse.ArgumentParser(description=NAME)
+	parser.add_argument('--headless', action='store_true', help='run without a game window')
+	parser.add_argument('campaign', nargs='?', help='campaign file in the campaigns folder')
+	parser.add_argument('unit_id', nargs='?', help='player tank unit type')
+	parser.add_argument('--seed', type=int, default=0, help='random number seed')
+	parser.add_argument('--days', type=int, help='number of combat days to play')
+	parser.add_argument('--keys', help='file of key presses to play before the automatic policy takes over')
+	parser.add_argument('--batch', type=int, metavar='RUNS', help='number of campaigns to run, one seed each')
+	parser.add_argument('--processes', type=int, help='number of worker processes for a batch, default is one per core')
+	parser.add_argument('--output', help='results file for a batch or replay')
+	parser.add_argument('--record', metavar='FILE', help='record key presses of each new campaign')
+	parser.add_argument('--replay', metavar='FILE', help='replay a recorded campaign at full speed')
+	parser.add_argument('--trace', metavar='FILE', help='write game events to a JSON Lines file, one file per campaign in a batch')
+	return parser
+
+
+# parse command line options and run a headless campaign, a batch of campaigns, or a replay
+def RunFromCommandLine(args):
+	
+	parser = GetCommandLineParser()
+	options = parser.parse_args(args)
+	
+	if options.replay is not None:
+		results = ReplayCampaign(options.replay)
+		for label, timing in results.items():
+			text = label + ': ' + str(timing['calls']) + ' calls, ' + str(timing['total']) + ' s'
+			if 'mean_ms' in timing:
+				text += ', mean ' + str(timing['mean_ms']) + ' ms, max ' + str(timing['max_ms']) + ' ms'
+			print(text)
+		if options.output is not None:
+			with open(options.output, 'w', encoding='utf8') as f:
+				json.dump(results, f, indent=1)
+		return 0
+	
+	if options.campaign is None or options.unit_id is None:
+		parser.error('a campaign file and player unit are required')
+	
+	# make sure that the campaign and player unit are valid
+	if not os.path.exists(CAMPAIGNPATH + options.campaign):
+		parser.error('campaign file not found: ' + options.campaign)
+	with open(CAMPAIGNPATH + options.campaign, encoding='utf8') as data_file:
+		campaign_stats = json.load(data_file)
+	if options.unit_id not in campaign_stats['player_unit_list']:
+		parser.error(options.unit_id + ' is not a player unit in this campaign')
+	
+	if options.batch is not None:
+		if options.output is None:
+			options.output = 'batch_results.json'
+		summary = RunCampaignBatch(options.campaign, options.unit_id, options.batch,
+			first_seed=options.seed, days=options.days, processes=options.processes,
+			output_filename=options.output, trace_filename=options.trace)
+		print('Days completed: ' + str(summary['days_completed']))
+		print('VP per day: ' + str(summary['vp_per_day']))
+		print('Survival rate: ' + str(summary['survival_rate']))
+		print('Crew KIA: ' + str(summary['crew_kia']))
+		print('Time: ' + str(summary['time']) + ' seconds')
+		print('Summary written to ' + options.output)
+		return 0
+	
+	player_policy = AutoPlayerPolicy(days=options.days)
+	if options.keys is not None:
+		key_names = {
+			'enter' : (libtcod.KEY_ENTER, 13),
+			'space' : (libtcod.KEY_SPACE, 32),
+			'esc' : (libtcod.KEY_ESCAPE, 27),
+			'bksp' : (libtcod.KEY_BACKSPACE, 8)
+		}
+		key_list = []
+		with open(options.keys, encoding='utf8') as data_file:
+			for name in data_file.read().split():
+				if name in key_names:
+					key_list.append(key_names[name])
+				else:
+					key_list.append((libtcod.KEY_CHAR, ord(name)))
+		player_policy = ScriptedPlayerPolicy(key_list, fallback=player_policy)
+	
+	start_time = time.time()
+	RunHeadlessCampaign(options.campaign, options.unit_id, options.seed, player_policy=player_policy)
+	
+	print('Days played: ' + str(len(campaign.logs)))
+	print('Player VP: ' + str(campaign.player_vp))
+	print('Player tank survived: ' + str(campaign.player_unit.alive))
+	print('Time: ' + str(round(time.time() - start_time, 2)) + ' seconds')
+	return 0
+
+
+
 ##########################################################################################
 #                                      Main Script                                       #
 ##########################################################################################
 
 global main_title, main_theme
-global campaign, campaign_day, scenario, session
+global campaign, campaign_day, scenario, session, xp_cache, unit_type_registry
+global hex_path_cache, hex_path_cache_day, hex_geometry
 global keyboard_decode, keyboard_encode
+global headless, command_options
+
+# if this is a worker process of a frozen build, run the worker instead of the game
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
 
 print('Starting ' + NAME + ' version ' + VERSION)	# startup message
 
+# read command line options, or use the defaults if this script has been imported by another one
+if __name__ == '__main__':
+	command_options = GetCommandLineParser().parse_args(sys.argv[1:])
+else:
+	command_options = GetCommandLineParser().parse_args([])
+
+# run without a game window if asked to on the command line, or if this script has been
+# imported by another one
+headless = __name__ != '__main__' or command_options.headless
+
 # try to load game settings from config file, will create a new file if none present
 LoadCFG()
 
-# determine font to use based on settings file
-if config['ArmCom2'].getboolean('large_display_font'):
-	fontname = 'c64_16x16_ext.png'
+# replace all display functions with null ones
+if headless:
+	libtcod = NullRenderer(libtcod)
+
 else:
-	fontname = 'c64_8x8_ext.png'
-
-# set up custom font and create the root console
-libtcod.console_set_custom_font(DATAPATH+fontname, libtcod.FONT_LAYOUT_ASCII_INROW, 16, 18)
-WINDOW_NAME = NAME + ' - ' + VERSION
-if DEBUG: WINDOW_NAME += ' DEBUG'
-libtcod.console_init_root(WINDOW_WIDTH, WINDOW_HEIGHT, WINDOW_NAME, fullscreen=False, renderer=RENDERER, vsync=True)
-libtcod.sys_set_fps(LIMIT_FPS)
-libtcod.console_set_default_background(0, libtcod.black)
-libtcod.console_set_default_foreground(0, libtcod.white)
-libtcod.console_clear(0)
-
-# display loading screen
-libtcod.console_print_ex(0, WINDOW_XM, WINDOW_YM, libtcod.BKGND_NONE, libtcod.CENTER,
-	'Loading...')
-libtcod.console_flush()
+	
+	# determine font to use based on settings file
+	if config['ArmCom2'].getboolean('large_display_font'):
+		fontname = 'c64_16x16_ext.png'
+	else:
+		fontname = 'c64_8x8_ext.png'
+	
+	# set up custom font and create the root console
+	libtcod.console_set_custom_font(DATAPATH+fontname, libtcod.FONT_LAYOUT_ASCII_INROW, 16, 18)
+	WINDOW_NAME = NAME + ' - ' + VERSION
+	if DEBUG: WINDOW_NAME += ' DEBUG'
+	libtcod.console_init_root(WINDOW_WIDTH, WINDOW_HEIGHT, WINDOW_NAME, fullscreen=False, renderer=RENDERER, vsync=True)
+	libtcod.sys_set_fps(LIMIT_FPS)
+	libtcod.console_set_default_background(0, libtcod.black)
+	libtcod.console_set_default_foreground(0, libtcod.white)
+	libtcod.console_clear(0)
+	
+	# display loading screen
+	libtcod.console_print_ex(0, WINDOW_XM, WINDOW_YM, libtcod.BKGND_NONE, libtcod.CENTER,
+		'Loading...')
+	libtcod.console_flush()
+	
+	# only redraw the screen when something has changed, and don't let input loops spin
+	libtcod = FrameScheduler(libtcod)
+
+# create the .xp image cache
+xp_cache = XPCache(XP_CACHE_SIZE)
+
+# create the cache for campaign day map zone images
+cd_tile_cache = TerrainTileCache(CD_TILE_CACHE_SIZE)
+
+# create the background saved game writer
+save_writer = SaveWriter()
+
+# precalculate hex geometry for the scenario map
+hex_geometry = HexGeometry(4)
+
+# create the cache for campaign day hex paths, and record which campaign day it belongs to
+hex_path_cache = {}
+hex_path_cache_day = None
+
+# load unit type definitions
+unit_type_registry = UnitTypeRegistry()
+
+# no campaign in progress yet
+campaign = None
+campaign_day = None
+scenario = None
 
 # create new session object
 session = Session()
 
+# time the slowest parts of the game in debug mode
+if DEBUG and not headless:
+	session.profiler = Profiler()
+
 # try to init sound mixer and load sounds if successful
 main_theme = None
-if config['ArmCom2'].getboolean('sounds_enabled'):
+if not headless and config['ArmCom2'].getboolean('sounds_enabled'):
 	if session.InitMixer():
 		session.LoadMainTheme()
 	else:
@@ -18028,10 +20337,22 @@ mouse = libtcod.Mouse()
 key = libtcod.Key()
 
 # start up steamworks
-if STEAM_ON:
+if STEAM_ON and not headless:
 	steamworks = STEAMWORKS()
 	steamworks.initialize()
 
+# start recording new campaigns if asked to
+if command_options.record is not None:
+	session.recorder = InputRecorder(command_options.record)
+
+# start writing game events if asked to; each campaign in a batch writes its own trace
+if command_options.trace is not None and command_options.batch is None:
+	session.trace = EventTrace(command_options.trace)
+
+# if run headless or as a replay from the command line, play through and exit
+if __name__ == '__main__' and (headless or command_options.replay is not None):
+	sys.exit(RunFromCommandLine(sys.argv[1:]))
+
 
 ##########################################################################################
 #                                        Main Menu                                       #
@@ -18095,7 +20416,7 @@ gradient_x = WINDOW_WIDTH + 5
 def UpdateMainTitleCon(options_menu_active):
 	
 	no_saved_games = False
-	if len(os.listdir(SAVEPATH)) == 0:
+	if not os.path.isdir(SAVEPATH) or len(os.listdir(SAVEPATH)) == 0:
 		no_saved_games = True
 	
 	libtcod.console_blit(main_title, 0, 0, 0, 0, con, 0, 0)
@@ -18154,8 +20475,9 @@ options_menu_active = False
 # draw the main title console to the screen for the first time
 UpdateMainTitleCon(options_menu_active)
 
-# Main Menu loop
-exit_game = False
+# Main Menu loop; the game is headless here only if it has been imported by another script,
+# in which case there is no menu to show
+exit_game = headless
 
 while not exit_game:
 	
@@ -18169,7 +20491,7 @@ while not exit_game:
 	
 	libtcod.console_flush()
 	
-	if not GetInputEvent(): continue
+	if not GetInputEvent('MainMenu'): continue
 	
 	key_char = chr(key.c).lower()
 	
@@ -18209,35 +20531,10 @@ while not exit_game:
 			
 			# start a new campaign
 			else:
-				
-				# create a new campaign object and allow player to select a campaign
-				campaign = Campaign()
-				if not campaign.CampaignSelectionMenu():
-					campaign = None
+				if not StartNewCampaign():
 					UpdateMainTitleCon(options_menu_active)
 					continue
 				
-				# allow player to select their tank and set their tank name
-				(unit_id, tank_name) = campaign.TankSelectionMenu()
-				
-				# create the player unit
-				campaign.player_unit = Unit(unit_id)
-				campaign.player_unit.unit_name = tank_name
-				campaign.player_unit.nation = campaign.stats['player_nation']
-				campaign.player_unit.GenerateNewPersonnel()
-				campaign.player_unit.ClearGunAmmo()
-				
-				# create a new campaign day
-				campaign_day = CampaignDay()
-				for (hx, hy) in CAMPAIGN_DAY_HEXES:
-					campaign_day.map_hexes[(hx,hy)].CalcCaptureVP()
-				campaign_day.GenerateRoads()
-				campaign_day.GenerateRivers()
-				campaign.AddJournal('Start of day')
-				
-				# placeholder for the currently active scenario
-				scenario = None
-				
 			# pause main theme if loaded
 			if main_theme is not None:
 				mixer.Mix_PauseMusic()
@@ -18245,6 +20542,10 @@ while not exit_game:
 			# go to campaign calendar loop
 			campaign.DoCampaignCalendarLoop()
 			
+			# finish recording if any
+			if session.recorder is not None:
+				session.recorder.Stop()
+			
 			# reset exiting flag
 			session.exiting = False
 			
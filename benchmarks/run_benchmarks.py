@@ -0,0 +1,464 @@
+# -*- coding: UTF-8 -*-
+##########################################################################################
+#                                                                                        #
+#                         Armoured Commander II - Rules Benchmarks                       #
+#                                                                                        #
+##########################################################################################
+#
+#    Times the slowest parts of the rules engine on synthetic scenarios and campaign days,
+#    writes the results to a JSON file, and compares them against a stored baseline.
+#    Runs without a game window.
+#
+#    python benchmarks/run_benchmarks.py --units 4 12 --nation Germany --precipitation Rain
+#    python benchmarks/run_benchmarks.py --save-baseline
+#
+#    This file is part of Armoured Commander II, and is covered under the same license.
+#
+##########################################################################################
+
+import os, sys
+import argparse
+import json
+import gzip
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+# the game looks for its data files relative to the working directory, so run from the game
+# folder; results files given on the command line are relative to where this was started
+LAUNCHPATH = os.getcwd()
+ROOTPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOTPATH)
+sys.path.insert(0, ROOTPATH)
+
+# importing the game runs it without a game window
+import armcom2 as game
+import xp_loader
+
+BASELINE_FILE = os.path.join(ROOTPATH, 'benchmarks', 'baseline.json')	# default stored baseline
+RESULTS_FILE = 'benchmark_results.json'				# default results file
+REGRESSION_THRESHOLD = 0.2					# fraction slower than the baseline that counts as a regression
+BENCHMARK_DIRECTORY = 'benchmark'				# saved game directory used for save and load timings
+
+
+##########################################################################################
+#                                   Synthetic States                                     #
+##########################################################################################
+
+# set up a new campaign with the given seed and player unit, as if started from the main menu
+def BuildCampaign(options, rng_seed):
+	game.session.player_policy = game.AutoPlayerPolicy()
+	game.session.exiting = False
+	game.scenario = None
+
+	game.campaign = game.Campaign(rng_seed=rng_seed)
+	game.campaign.LoadCampaign(options.campaign)
+	game.campaign.player_unit = game.Unit(options.unit_id)
+	game.campaign.player_unit.nation = game.campaign.stats['player_nation']
+	game.campaign.player_unit.GenerateNewPersonnel()
+	return game.campaign
+
+
+# set up a new campaign day, with the given weather, and optionally generate its roads and rivers
+def BuildCampaignDay(options, rng_seed, roads=True, rivers=True):
+	BuildCampaign(options, rng_seed)
+	game.campaign_day = game.CampaignDay()
+	for (hx, hy) in game.CAMPAIGN_DAY_HEXES:
+		game.campaign_day.map_hexes[(hx,hy)].CalcCaptureVP()
+	if roads:
+		game.campaign_day.GenerateRoads()
+	if rivers:
+		game.campaign_day.GenerateRivers()
+
+	if options.precipitation is not None:
+		game.campaign_day.weather['Precipitation'] = options.precipitation
+	if options.ground is not None:
+		game.campaign_day.weather['Ground'] = options.ground
+	if options.fog is not None:
+		game.campaign_day.weather['Fog'] = options.fog
+	return game.campaign_day
+
+
+# set up a new scenario in the player's current zone, with the player unit and squad in the
+# centre hex and the given number of enemy units of the selected nation around them
+def BuildScenario(options, rng_seed, num_units):
+	BuildCampaignDay(options, rng_seed)
+	campaign = game.campaign
+	campaign_day = game.campaign_day
+
+	scenario = game.Scenario(campaign_day.map_hexes[campaign_day.player_unit_location])
+	game.scenario = scenario
+	scenario.InitConsoles()
+
+	# set up player unit and squad as at the start of a scenario
+	scenario.player_unit = campaign.player_unit
+	scenario.player_unit.ResetMe()
+	scenario.player_unit.facing = 0
+	scenario.player_unit.turret_facing = 0
+	scenario.player_unit.squad = []
+	scenario.player_unit.SpawnAt(0, 0)
+	for position in scenario.player_unit.positions_list:
+		if position.crewman is None: continue
+		position.crewman.current_cmd = 'Spot'
+	for unit in campaign_day.player_squad:
+		unit.ResetMe()
+		unit.facing = 0
+		unit.turret_facing = 0
+		unit.SpawnAt(0, 0)
+		scenario.player_unit.squad.append(unit)
+
+	# spawn enemy units, facing the player
+	if options.nation is not None:
+		scenario.enemy_nation = options.nation
+	else:
+		scenario.enemy_nation = campaign.current_week['enemy_nations'][0]
+	unit_type_list = campaign.stats['enemy_unit_list'][scenario.enemy_nation]
+	hex_list = []
+	for distance in range(1, 4):
+		hex_list.extend(game.GetHexRing(0, 0, distance))
+
+	for i in range(num_units):
+		unit = game.Unit(game.GetRNG('spawning').choice(unit_type_list))
+		unit.owning_player = 1
+		unit.nation = scenario.enemy_nation
+		unit.ai = game.AI(unit)
+		unit.GenerateNewPersonnel()
+		(hx, hy) = game.GetRNG('spawning').choice(hex_list)
+		unit.SpawnAt(hx, hy)
+		if unit.GetStat('category') == 'Gun':
+			unit.deployed = True
+		if unit.GetStat('category') != 'Infantry':
+			unit.facing = game.GetDirectionToward(hx, hy, 0, 0)
+			if 'turret' in unit.stats:
+				unit.turret_facing = unit.facing
+
+	scenario.GenerateLoS()
+	for unit in scenario.units:
+		for weapon in unit.weapon_list:
+			weapon.UpdateCoveredHexes()
+	scenario.player_unit.BuildCmdLists()
+	scenario.player_unit.ResetForNewTurn(skip_smoke=True)
+	for unit in scenario.player_unit.squad:
+		unit.BuildCmdLists()
+		unit.ResetForNewTurn(skip_smoke=True)
+	scenario.init_complete = True
+
+	return scenario
+
+
+# return a list of all possible attacks in the current scenario, as attacker, weapon, target,
+# and ammo type
+def GetAttackList(scenario):
+	attack_list = []
+	for attacker in scenario.units:
+		for weapon in attacker.weapon_list:
+			for target in scenario.units:
+				if target.owning_player == attacker.owning_player: continue
+				if weapon.GetStat('type') == 'Gun':
+					ammo_list = weapon.stats['ammo_type_list']
+				else:
+					ammo_list = [None]
+				for ammo_type in ammo_list:
+					if scenario.CheckAttack(attacker, weapon, target, ignore_facing=True,
+						ammo_type=ammo_type) != '':
+						continue
+					attack_list.append((attacker, weapon, target, ammo_type))
+	return attack_list
+
+
+# return a list of to-hit profiles for all possible gun attacks with AP ammo on armoured
+# targets, one for each hit location, ready for armour penetration to be calculated
+def GetAPProfileList(scenario):
+	profile_list = []
+	for (attacker, weapon, target, ammo_type) in GetAttackList(scenario):
+		if target.GetStat('armour') is None: continue
+		if weapon.GetStat('type') != 'Gun' or ammo_type != 'AP': continue
+		profile = scenario.CalcAttack(attacker, weapon, target, ammo_type=ammo_type)
+		if profile is None: continue
+		for location in ['Hull', 'Turret']:
+			profile_list.append(dict(profile, location=location))
+	return profile_list
+
+
+##########################################################################################
+#                                       Benchmarks                                       #
+##########################################################################################
+
+# each benchmark has a setup function that builds a fresh state for each run, and a function
+# whose run time is measured on that state
+
+def DoGenerateLoS(scenario):
+	scenario.GenerateLoS()
+
+
+def DoAISpotChecks(scenario):
+	scenario.DoAISpotChecks(0)
+	scenario.DoAISpotChecks(1)
+
+
+# every enemy unit chooses and carries out its best attack on the player and squad
+def DoBestAttacks(scenario):
+	for unit in scenario.units:
+		if unit.owning_player != 1: continue
+		if not unit.alive: continue
+		target_list = []
+		for target in scenario.units:
+			if target.owning_player == 1: continue
+			if not target.alive: continue
+			target_list.append(target)
+		unit.ai.DoBestAttack(target_list)
+
+
+def DoCalcAttacks(state):
+	(scenario, attack_list) = state
+	for (attacker, weapon, target, ammo_type) in attack_list:
+		scenario.CalcAttack(attacker, weapon, target, ammo_type=ammo_type)
+
+
+def DoCalcAPs(state):
+	(scenario, profile_list) = state
+	for profile in profile_list:
+		scenario.CalcAP(profile)
+
+
+# find paths from the player zone to every other zone on the campaign day map, with an empty path cache
+def DoGetHexPaths(campaign_day):
+	(hx1, hy1) = campaign_day.player_unit_location
+	for (hx2, hy2) in game.CAMPAIGN_DAY_HEXES:
+		game.GetHexPath(hx1, hy1, hx2, hy2)
+		game.GetHexPath(hx1, hy1, hx2, hy2, enemy_zones_block=True)
+
+
+def DoLoadXPStrings(raw_data_list):
+	for raw_data in raw_data_list:
+		xp_loader.load_xp_string(raw_data, cells=False)
+
+
+# write a saved game and wait for it to be written to disk
+def DoSaveGame(scenario):
+	game.save_writer.Save(BENCHMARK_DIRECTORY, game.campaign, game.campaign_day, scenario)
+	game.save_writer.Wait()
+
+
+# read a saved game, including the scenario that would otherwise be loaded when first used
+def DoLoadGame(scenario):
+	game.LoadGame(BENCHMARK_DIRECTORY)
+	if isinstance(game.scenario, game.SavedScenario):
+		game.scenario.Load()
+
+
+# return a list of benchmarks to run as name, setup function, and timed function
+# scenario benchmarks are run once for each number of enemy units
+def GetBenchmarkList(options):
+
+	def ReadXPFiles(rng_seed):
+		raw_data_list = []
+		for filename in sorted(os.listdir(game.DATAPATH)):
+			if not filename.endswith('.xp'): continue
+			with gzip.open(game.DATAPATH + filename) as xp_file:
+				raw_data_list.append(xp_file.read())
+		return raw_data_list
+
+	def BuildCalendarCampaign(rng_seed):
+		return BuildCampaign(options, rng_seed)
+
+	def BuildRoadsDay(rng_seed):
+		return BuildCampaignDay(options, rng_seed, roads=False, rivers=False)
+
+	def BuildRiversDay(rng_seed):
+		return BuildCampaignDay(options, rng_seed, rivers=False)
+
+	def BuildPathsDay(rng_seed):
+		campaign_day = BuildCampaignDay(options, rng_seed)
+		game.ClearHexPathCache()
+		return campaign_day
+
+	def BuildSavedScenario(num_units):
+		def Setup(rng_seed):
+			scenario = BuildScenario(options, rng_seed, num_units)
+			DoSaveGame(scenario)
+			return scenario
+		return Setup
+
+	def BuildScenarioState(num_units, function=None):
+		def Setup(rng_seed):
+			scenario = BuildScenario(options, rng_seed, num_units)
+			if function is None:
+				return scenario
+			return (scenario, function(scenario))
+		return Setup
+
+	benchmark_list = [
+		('GenerateCombatCalendar', BuildCalendarCampaign, lambda campaign: campaign.GenerateCombatCalendar()),
+		('GenerateRoads', BuildRoadsDay, lambda campaign_day: campaign_day.GenerateRoads()),
+		('GenerateRivers', BuildRiversDay, lambda campaign_day: campaign_day.GenerateRivers()),
+		('GetHexPath', BuildPathsDay, DoGetHexPaths),
+		('load_xp_string', ReadXPFiles, DoLoadXPStrings)
+	]
+
+	for num_units in options.units:
+		suffix = ' [' + str(num_units) + ' units]'
+		benchmark_list.extend([
+			('GenerateLoS' + suffix, BuildScenarioState(num_units), DoGenerateLoS),
+			('DoAISpotChecks' + suffix, BuildScenarioState(num_units), DoAISpotChecks),
+			('AI.DoBestAttack' + suffix, BuildScenarioState(num_units), DoBestAttacks),
+			('CalcAttack' + suffix, BuildScenarioState(num_units, GetAttackList), DoCalcAttacks),
+			('CalcAP' + suffix, BuildScenarioState(num_units, GetAPProfileList), DoCalcAPs),
+			('SaveGame' + suffix, BuildScenarioState(num_units), DoSaveGame),
+			('LoadGame' + suffix, BuildSavedScenario(num_units), DoLoadGame)
+		])
+
+	return benchmark_list
+
+
+# run a benchmark a number of times, each time on a freshly built state with its own seed, and
+# return a summary of its run times
+def RunBenchmark(setup, function, repeat, first_seed):
+	times = []
+	for i in range(repeat):
+		state = setup(first_seed + i)
+		start_time = time.perf_counter()
+		function(state)
+		times.append(time.perf_counter() - start_time)
+	return {
+		'repeat' : repeat,
+		'min_ms' : round(min(times) * 1000.0, 3),
+		'median_ms' : round(statistics.median(times) * 1000.0, 3),
+		'mean_ms' : round(statistics.mean(times) * 1000.0, 3),
+		'max_ms' : round(max(times) * 1000.0, 3)
+	}
+
+
+# run all benchmarks whose names contain one of the selected names, saved games are written
+# to a temporary folder
+def RunBenchmarks(options):
+
+	results = {
+		'version' : game.VERSION,
+		'python' : platform.python_version(),
+		'platform' : platform.platform(),
+		'datetime' : datetime.now().strftime("%Y-%m-%d_%H_%M_%S"),
+		'options' : {
+			'campaign' : options.campaign,
+			'unit_id' : options.unit_id,
+			'units' : options.units,
+			'nation' : options.nation,
+			'precipitation' : options.precipitation,
+			'ground' : options.ground,
+			'fog' : options.fog,
+			'repeat' : options.repeat,
+			'seed' : options.seed
+		},
+		'benchmarks' : {}
+	}
+
+	save_path = game.SAVEPATH
+	game.SAVEPATH = tempfile.mkdtemp() + os.sep
+	try:
+		for (name, setup, function) in GetBenchmarkList(options):
+			if options.only is not None:
+				if not any(text in name for text in options.only): continue
+			timing = RunBenchmark(setup, function, options.repeat, options.seed)
+			results['benchmarks'][name] = timing
+			print(name.ljust(36) + str(timing['median_ms']).rjust(12) + ' ms')
+	finally:
+		shutil.rmtree(game.SAVEPATH, ignore_errors=True)
+		game.SAVEPATH = save_path
+
+	return results
+
+
+# compare the median run time of each benchmark to the baseline
+# returns a list of benchmark names that are slower than the baseline by more than the threshold
+def CompareToBaseline(results, baseline, threshold):
+
+	if baseline['options'] != results['options']:
+		print('Warning: baseline was run with different options: ' + json.dumps(baseline['options']))
+
+	regression_list = []
+	for name, timing in results['benchmarks'].items():
+		if name not in baseline['benchmarks']: continue
+		base_ms = baseline['benchmarks'][name]['median_ms']
+		if base_ms == 0.0: continue
+		change = (timing['median_ms'] - base_ms) / base_ms
+		timing['baseline_ms'] = base_ms
+		timing['change'] = round(change, 3)
+		text = name.ljust(36) + str(base_ms).rjust(12) + ' ms -> ' + str(timing['median_ms']) + ' ms ('
+		text += '{:+.1%}'.format(change) + ')'
+		if change > threshold:
+			regression_list.append(name)
+			text += ' REGRESSION'
+		print(text)
+	return regression_list
+
+
+def GetCommandLineParser():
+	parser = argparse.ArgumentParser(description=game.NAME + ' rules benchmarks')
+	parser.add_argument('--campaign', default='pattons_best.json', help='campaign file in the campaigns folder')
+	parser.add_argument('--unit-id', dest='unit_id', default='M4 Sherman', help='player tank unit type')
+	parser.add_argument('--units', type=int, nargs='+', default=[4, 12], help='numbers of enemy units in the scenario benchmarks')
+	parser.add_argument('--nation', help='enemy nation, default is the first one in the campaign')
+	parser.add_argument('--precipitation', help='precipitation, for example None, Rain or Heavy Rain')
+	parser.add_argument('--ground', help='ground conditions, for example Dry, Muddy or Deep Snow')
+	parser.add_argument('--fog', type=int, help='fog level')
+	parser.add_argument('--repeat', type=int, default=10, help='number of times to run each benchmark')
+	parser.add_argument('--seed', type=int, default=0, help='random number seed of the first run')
+	parser.add_argument('--only', nargs='+', metavar='NAME', help='run only benchmarks whose names contain one of these')
+	parser.add_argument('--output', default=RESULTS_FILE, help='results file')
+	parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline results file to compare against')
+	parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+		help='fraction slower than the baseline that counts as a regression')
+	parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', help='store these results as the new baseline')
+	return parser
+
+
+def Main(args):
+
+	parser = GetCommandLineParser()
+	options = parser.parse_args(args)
+
+	# make sure that the campaign, player unit, and nation are valid
+	if not os.path.exists(game.CAMPAIGNPATH + options.campaign):
+		parser.error('campaign file not found: ' + options.campaign)
+	with open(game.CAMPAIGNPATH + options.campaign, encoding='utf8') as data_file:
+		campaign_stats = json.load(data_file)
+	if options.unit_id not in campaign_stats['player_unit_list']:
+		parser.error(options.unit_id + ' is not a player unit in this campaign')
+	if options.nation is not None and options.nation not in campaign_stats['enemy_unit_list']:
+		parser.error(options.nation + ' is not an enemy nation in this campaign')
+	if options.repeat < 1:
+		parser.error('--repeat must be at least 1')
+	options.output = os.path.join(LAUNCHPATH, options.output)
+	options.baseline = os.path.join(LAUNCHPATH, options.baseline)
+
+	results = RunBenchmarks(options)
+
+	regression_list = []
+	if not options.save_baseline and os.path.exists(options.baseline):
+		with open(options.baseline, encoding='utf8') as f:
+			baseline = json.load(f)
+		print('')
+		print('Compared to baseline from ' + baseline['datetime'] + ':')
+		regression_list = CompareToBaseline(results, baseline, options.threshold)
+
+	with open(options.output, 'w', encoding='utf8') as f:
+		json.dump(results, f, indent=1)
+	print('Results written to ' + options.output)
+
+	if options.save_baseline:
+		with open(options.baseline, 'w', encoding='utf8') as f:
+			json.dump(results, f, indent=1)
+		print('Baseline written to ' + options.baseline)
+
+	if len(regression_list) > 0:
+		print(str(len(regression_list)) + ' benchmarks slower than the baseline by more than ' +
+			'{:.0%}'.format(options.threshold))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
@@ -1,3 +1,4 @@
+python xp_loader.py data data\xp_images.bundle
 pyinstaller -F armcom2.py
 copy /y .\*.dll .\dist
 copy /y .\*.lib .\dist
@@ -5,6 +6,7 @@ copy /y .\steam_appid.txt .\dist
 copy /y .\campaigns\*.json .\dist\campaigns
 copy /y .\data\*.json .\dist\data
 copy /y .\data\*.xp .\dist\data
+copy /y .\data\xp_images.bundle .\dist\data
 copy /y .\data\*.png .\dist\data
 copy /y .\sounds\*.ogg .\dist\sounds
 del .\dist\data\armcom2.cfg
@@ -8,6 +8,13 @@ elif platform == 'linux':
 else:
 	import libtcodpy as libtcod
 import binascii
+import struct
+import gzip, mmap, os, sys
+try:
+	import numpy
+	numpy_available = True
+except ImportError:
+	numpy_available = False
 
 ##################################
 # In-memory XP format is as follows:
@@ -18,6 +25,9 @@ import binascii
 ## layer_data is a list of individual layers, which are stored in the following format
 ### Each layer is a dictionary with keys width, height (see above), and cells. 
 ### Cells is a row major 2d array of, again, dictionaries with the values 'keycode' (ascii keycode), 'fore_r/g/b', and 'back_r/g/b' (technically ints but in value 0-255)
+### Each layer also holds compact arrays of the same data in console order (index y * width + x), under the keys 'keycodes', 'fore_r/g/b' and 'back_r/g/b'
+### These are bytes objects (lists for keycodes), or NumPy arrays if NumPy is available
+### The cells view is only built if load_xp_string is called with cells=True (the default); use get_layer_cells to build it later
 ##################################
 
 
@@ -81,17 +91,27 @@ def load_layer_to_console(console, xp_file_layer):
 	if not xp_file_layer['width'] or not xp_file_layer['height']:
 		raise AttributeError('Attempted to call load_layer_to_console on data that didn\'t have a width or height key, check your data')
 
+	# bulk path: fill the whole console at once from the layer arrays
+	if 'keycodes' in xp_file_layer:
+		if libtcod.console_get_width(console) == xp_file_layer['width'] and libtcod.console_get_height(console) == xp_file_layer['height']:
+			libtcod.console_fill_char(console, xp_file_layer['keycodes'])
+			libtcod.console_fill_foreground(console, xp_file_layer['fore_r'], xp_file_layer['fore_g'], xp_file_layer['fore_b'])
+			libtcod.console_fill_background(console, xp_file_layer['back_r'], xp_file_layer['back_g'], xp_file_layer['back_b'])
+			return
+
+	cells = get_layer_cells(xp_file_layer)
 	for x in range(xp_file_layer['width']):
 		for y in range(xp_file_layer['height']):
-			cell_data = xp_file_layer['cells'][x][y]
+			cell_data = cells[x][y]
 			fore_color = libtcod.Color(cell_data['fore_r'], cell_data['fore_g'], cell_data['fore_b'])
 			back_color = libtcod.Color(cell_data['back_r'], cell_data['back_g'], cell_data['back_b'])
 			libtcod.console_put_char_ex(console, x, y, cell_data['keycode'], fore_color, back_color)
 
 def get_position_key_xy(xp_file_layer, poskey_color):
+	cells = get_layer_cells(xp_file_layer)
 	for x in range(xp_file_layer['width']):
 		for y in range(xp_file_layer['height']):
-			cell_data = xp_file_layer['cells'][x][y]
+			cell_data = cells[x][y]
 			if cell_data['keycode'] == poskey_tile_character:
 				fore_color_matches = cell_data['fore_r'] == poskey_color.r and cell_data['fore_g'] == poskey_color.g and cell_data['fore_b'] == poskey_color.b
 				back_color_matches = cell_data['back_r'] == poskey_color.r and cell_data['back_g'] == poskey_color.g and cell_data['back_b'] == poskey_color.b
@@ -113,7 +133,7 @@ def get_position_key_xy(xp_file_layer, poskey_color):
 # I may just not be aware of it being unneeded, but have it there in case
 ##################################
 
-def load_xp_string(file_string, reverse_endian=True):
+def load_xp_string(file_string, reverse_endian=True, cells=True):
 
 	offset = 0
 
@@ -153,8 +173,7 @@ def load_xp_string(file_string, reverse_endian=True):
 
 		layer_data_size = layer_width_bytes + layer_height_bytes + (layer_cell_bytes *  this_layer_width * this_layer_height)
 
-		layer_data_raw = file_string[offset:offset + layer_data_size]
-		layer_data = parse_layer(file_string[offset:offset + layer_data_size], reverse_endian)
+		layer_data = parse_layer(memoryview(file_string)[offset:offset + layer_data_size], reverse_endian, cells)
 		layers.append(layer_data)
 
 		offset += layer_data_size
@@ -169,40 +188,107 @@ def load_xp_string(file_string, reverse_endian=True):
 
 ##################################
 # Takes a single layer's data and returns the format listed at the top of the file for a single layer.
+# The cell data is read in one pass: each cell is 10 bytes, so every byte of the keycode and colours
+# can be pulled out of the whole layer with a single stepped slice, then put into console order
+# by taking every height-th value for each row.
 ##################################
 
-def parse_layer(layer_string, reverse_endian=True):
-	offset = 0
+def parse_layer(layer_string, reverse_endian=True, cells=True):
+	if reverse_endian:
+		endian = '<'
+	else:
+		endian = '>'
 
-	width = layer_string[offset:offset + layer_width_bytes]
-	offset += layer_width_bytes
-	height = layer_string[offset:offset + layer_height_bytes]
-	offset += layer_height_bytes
+	(width, height) = struct.unpack_from(endian + 'II', layer_string, 0)
+	offset = layer_width_bytes + layer_height_bytes
+	cell_data_raw = bytes(layer_string[offset:offset + (layer_cell_bytes * width * height)])
 
-	if reverse_endian:
-		width = width[::-1]
-		height = height[::-1]
-	
-	width = int(binascii.b2a_hex(width), 16)
-	height = int(binascii.b2a_hex(height), 16)
+	if numpy_available:
+		layer = parse_layer_numpy(cell_data_raw, width, height, endian)
+	else:
+		layer = parse_layer_bytes(cell_data_raw, width, height, endian)
 
-	cells = []
-	for x in range(width):
-		row = []
+	if cells:
+		layer['cells'] = get_layer_cells(layer)
+
+	return layer
+
+def parse_layer_bytes(cell_data_raw, width, height, endian):
 
+	# cell data is stored column by column, consoles are filled row by row
+	def to_console_order(values):
+		if isinstance(values, bytes):
+			return b''.join(values[y::height] for y in range(height))
+		ordered = []
 		for y in range(height):
-			cell_data_raw = layer_string[offset:offset + layer_cell_bytes]
-			cell_data = parse_individual_cell(cell_data_raw, reverse_endian)
-			row.append(cell_data)
-			offset += layer_cell_bytes
+			ordered.extend(values[y::height])
+		return ordered
+
+	if endian == '<':
+		keycode_planes = [cell_data_raw[i::layer_cell_bytes] for i in range(layer_keycode_bytes)]
+	else:
+		keycode_planes = [cell_data_raw[i::layer_cell_bytes] for i in reversed(range(layer_keycode_bytes))]
+
+	# keycodes almost always fit in the lowest byte
+	if all(plane.count(0) == len(plane) for plane in keycode_planes[1:]):
+		keycodes = list(to_console_order(keycode_planes[0]))
+	else:
+		keycodes = [k for (k,) in struct.iter_unpack(endian + 'I6x', cell_data_raw)]
+		keycodes = to_console_order(keycodes)
+
+	layer = {
+		'width':width,
+		'height':height,
+		'keycodes':keycodes
+	}
+	offset = layer_keycode_bytes
+	for name in ['fore_r', 'fore_g', 'fore_b', 'back_r', 'back_g', 'back_b']:
+		layer[name] = to_console_order(cell_data_raw[offset::layer_cell_bytes])
+		offset += 1
 
-		cells.append(row)
+	return layer
 
-	return {
+def parse_layer_numpy(cell_data_raw, width, height, endian):
+	cell_dtype = numpy.dtype([('keycode', endian + 'u4'), ('fore', 'u1', (3,)), ('back', 'u1', (3,))])
+	data = numpy.frombuffer(cell_data_raw, dtype=cell_dtype).reshape((width, height)).T
+
+	layer = {
 		'width':width,
 		'height':height,
-		'cells':cells
+		'keycodes':numpy.ascontiguousarray(data['keycode']).ravel()
 	}
+	for i, c in enumerate(['r', 'g', 'b']):
+		layer['fore_' + c] = numpy.ascontiguousarray(data['fore'][:, :, i]).ravel()
+		layer['back_' + c] = numpy.ascontiguousarray(data['back'][:, :, i]).ravel()
+
+	return layer
+
+##################################
+# Returns the cells of a layer in the format listed at the top of this file, building them from the layer arrays if required.
+##################################
+
+def get_layer_cells(xp_file_layer):
+	if 'cells' in xp_file_layer:
+		return xp_file_layer['cells']
+
+	width = xp_file_layer['width']
+	cells = []
+	for x in range(width):
+		row = []
+		for y in range(xp_file_layer['height']):
+			i = y * width + x
+			row.append({
+				'keycode':int(xp_file_layer['keycodes'][i]),
+				'fore_r':int(xp_file_layer['fore_r'][i]),
+				'fore_g':int(xp_file_layer['fore_g'][i]),
+				'fore_b':int(xp_file_layer['fore_b'][i]),
+				'back_r':int(xp_file_layer['back_r'][i]),
+				'back_g':int(xp_file_layer['back_g'][i]),
+				'back_b':int(xp_file_layer['back_b'][i]),
+			})
+		cells.append(row)
+
+	return cells
 
 ##################################
 # Pulls out the keycode and the foreground/background RGB values from a single cell's data, returning them in the format listed at the top of this file for a single cell.
@@ -240,4 +326,166 @@ def parse_individual_cell(cell_string, reverse_endian=True):
 		'back_r':back_r,
 		'back_g':back_g,
 		'back_b':back_b,
-	}
\ No newline at end of file
+	}
+
+####################################################################
+# START BUNDLE CODE
+
+##################################
+# A bundle packs the first layer of many .xp files into one uncompressed file so they can be served from a memory map
+# without opening and inflating each file. The bundle is laid out as follows (all values little-endian):
+## Header: magic bytes, entry count
+## Index: one record per image: name length, name (utf-8), source file modification time, data offset, width, height
+## Data: for each image, keycodes as 4-byte values, then the fore_r/g/b and back_r/g/b planes as one byte per cell, all in console order
+##################################
+
+bundle_magic = b'XPB1'
+bundle_header_format = '<4sI'
+bundle_entry_format = '<dIII'
+
+##################################
+# Packs the given .xp files into a bundle file. Images are stored under their file name without the directory.
+##################################
+
+def build_xp_bundle(xp_paths, bundle_path):
+	index = bytearray()
+	data = bytearray()
+	entries = []
+
+	for path in sorted(xp_paths):
+		with gzip.open(path) as xp_file:
+			xp_data = load_xp_string(xp_file.read(), cells=False)
+		layer = xp_data['layer_data'][0]
+		name = os.path.basename(path).encode('utf-8')
+		entries.append((name, os.path.getmtime(path), len(data), layer['width'], layer['height']))
+
+		data += struct.pack('<' + str(len(layer['keycodes'])) + 'I', *[int(k) for k in layer['keycodes']])
+		for plane in ['fore_r', 'fore_g', 'fore_b', 'back_r', 'back_g', 'back_b']:
+			data += bytearray(int(v) for v in layer[plane])
+
+	for (name, mtime, offset, width, height) in entries:
+		index += struct.pack('<H', len(name)) + name + struct.pack(bundle_entry_format, mtime, offset, width, height)
+
+	# data offsets are relative to the end of the index
+	with open(bundle_path, 'wb') as bundle_file:
+		bundle_file.write(struct.pack(bundle_header_format, bundle_magic, len(entries)))
+		bundle_file.write(index)
+		bundle_file.write(data)
+
+##################################
+# Opens a bundle file as a memory map and reads its index. Returns None if the bundle is missing or unreadable.
+# If source_dir is given, images whose source .xp file is newer than the bundle copy are left out of the index,
+# so they will be loaded from the individual file instead.
+##################################
+
+def open_xp_bundle(bundle_path, source_dir=None):
+	if not os.path.exists(bundle_path):
+		return None
+
+	with open(bundle_path, 'rb') as bundle_file:
+		try:
+			data = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			return None
+
+	# a damaged bundle is treated the same as a missing one
+	try:
+		index = read_xp_bundle_index(data, source_dir)
+	except (struct.error, ValueError):
+		index = None
+	if index is None:
+		data.close()
+		return None
+
+	return {
+		'data':data,
+		'view':memoryview(data),
+		'index':index
+	}
+
+##################################
+# Reads the index of a bundle that has been opened as a memory map, as described for open_xp_bundle. Returns None if the
+# bundle does not start with the magic bytes, and raises struct.error or ValueError if the index is damaged.
+##################################
+
+def read_xp_bundle_index(data, source_dir=None):
+	(magic, entry_count) = struct.unpack_from(bundle_header_format, data, 0)
+	if magic != bundle_magic:
+		return None
+
+	offset = struct.calcsize(bundle_header_format)
+	entry_size = struct.calcsize(bundle_entry_format)
+	index = {}
+	for i in range(entry_count):
+		(name_length,) = struct.unpack_from('<H', data, offset)
+		offset += 2
+		name = data[offset:offset + name_length].decode('utf-8')
+		offset += name_length
+		(mtime, data_offset, width, height) = struct.unpack_from(bundle_entry_format, data, offset)
+		offset += entry_size
+
+		if source_dir is not None:
+			source_path = os.path.join(source_dir, name)
+			if os.path.exists(source_path) and os.path.getmtime(source_path) > mtime:
+				continue
+
+		index[name] = (data_offset, width, height)
+
+	# make sure that the data of each image lies within the bundle
+	for name, (data_offset, width, height) in index.items():
+		end = offset + data_offset + (layer_keycode_bytes + 6) * width * height
+		if end > len(data):
+			raise ValueError('Image ' + name + ' extends past the end of the bundle')
+		index[name] = (data_offset + offset, width, height)
+
+	return index
+
+##################################
+# Returns a single image from an open bundle in the in-memory format listed at the top of this file, with one layer and
+# no cells view. The layer arrays are slices of the memory map, so no cell data is copied.
+##################################
+
+def load_xp_bundle_entry(bundle, name):
+	(offset, width, height) = bundle['index'][name]
+	cell_count = width * height
+	view = bundle['view']
+
+	keycodes = view[offset:offset + (layer_keycode_bytes * cell_count)]
+	if sys.byteorder == 'little':
+		keycodes = keycodes.cast('I')
+	else:
+		keycodes = list(struct.unpack('<' + str(cell_count) + 'I', keycodes))
+	offset += layer_keycode_bytes * cell_count
+
+	layer = {
+		'width':width,
+		'height':height,
+		'keycodes':keycodes
+	}
+	for plane in ['fore_r', 'fore_g', 'fore_b', 'back_r', 'back_g', 'back_b']:
+		layer[plane] = view[offset:offset + cell_count]
+		offset += cell_count
+
+	return {
+		'version':0,
+		'layer_count':1,
+		'width':width,
+		'height':height,
+		'layer_data':[layer]
+	}
+
+# END BUNDLE CODE
+####################################################################
+
+
+##################################
+# Run directly to pack every .xp file in a directory into a bundle, eg.: python xp_loader.py data data/xp_images.bundle
+##################################
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('Usage: python xp_loader.py <xp directory> <bundle file>')
+		sys.exit(1)
+	xp_paths = [os.path.join(sys.argv[1], f) for f in os.listdir(sys.argv[1]) if f.endswith('.xp')]
+	build_xp_bundle(xp_paths, sys.argv[2])
+	print('Packed ' + str(len(xp_paths)) + ' images into ' + sys.argv[2])